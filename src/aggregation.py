@@ -0,0 +1,238 @@
+# core
+import calendar
+import logging
+import math
+import time
+
+# local
+from ledger import D, FillAmounts, zero
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# How fills are grouped before a reciprocal is placed for them
+FILL = 'fill'       # one reciprocal per fill, the original behaviour
+ORDER = 'order'     # one reciprocal per filled order
+BUCKET = 'bucket'   # one reciprocal per price bucket of bucketPercent
+WINDOW = 'window'   # one reciprocal per maxAge seconds of fills
+
+modes = (FILL, ORDER, BUCKET, WINDOW)
+
+
+def fill_time(fill):
+    """Unix time of FILL, whose date the exchange gives in UTC."""
+    return calendar.timegm(time.strptime(fill['date'], '%Y-%m-%d %H:%M:%S'))
+
+
+class FillBatch(object):
+
+    def __init__(self, market, direction, now):
+        """Fills waiting for one reciprocal in DIRECTION.
+
+        The reciprocal of a batch is priced from the volume-weighted rate
+        of its fills, as the reciprocals of the individual fills would
+        have been together, and trades what they add up to net of fees
+        (see ledger.FillAmounts.reciprocal_size). Amounts are exact.
+        """
+
+        self.market = market
+        self.direction = direction
+        self.first_seen = now
+        self.amount = zero # what the reciprocal trades
+        self.filled = zero # what the fills traded
+        self.total = zero
+        self.covers = list() # [reciprocant order, fill tradeID] pairs
+        self.sources = set()
+        self.filled_at = None # time of the earliest fill
+
+    def add(self, source_trade_id, fill):
+        a = FillAmounts(fill)
+        self.amount += a.reciprocal_size
+        self.filled += a.amount
+        # Not the total the exchange rounded, which would skew the rate
+        # of small fills.
+        self.total += a.amount * a.rate
+        self.covers.append([source_trade_id, fill['tradeID']])
+        self.sources.add(source_trade_id)
+        filled_at = fill_time(fill)
+        if self.filled_at is None or filled_at < self.filled_at:
+            self.filled_at = filled_at
+
+    def merge(self, other):
+        """Take in the fills of OTHER, an earlier batch of the same market
+        and direction, e.g. one whose reciprocal was too small to place."""
+        self.amount += other.amount
+        self.filled += other.filled
+        self.total += other.total
+        self.covers = other.covers + self.covers
+        self.sources |= other.sources
+        self.first_seen = min(self.first_seen, other.first_seen)
+        if other.filled_at is not None:
+            self.filled_at = min(self.filled_at or other.filled_at, other.filled_at)
+        return self
+
+    @property
+    def rate(self):
+        return float(self.total / self.filled)
+
+    def as_dict(self):
+        d = dict(self.__dict__)
+        d['sources'] = sorted(self.sources)
+        for k in 'amount filled total'.split():
+            d[k] = str(d[k])
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        batch = cls(d['market'], d['direction'], d['first_seen'])
+        batch.__dict__.update(d)
+        batch.covers = [list(c) for c in d['covers']]
+        batch.sources = set(d['sources'])
+        for k in 'amount filled total'.split():
+            setattr(batch, k, D(d[k]))
+        return batch
+
+    @property
+    def reciprocant_trade_id(self):
+        """The first fill stands for the batch in GridTrader.reciprocal"""
+        return self.covers[0][1]
+
+    def __str__(self):
+        return "<FillBatch {} {} {:.8f}@{:.8f} fills={}>".format(
+            self.market, self.direction, self.amount, self.rate, len(self.covers))
+
+    __repr__ = __str__
+
+
+class FillAggregator(object):
+
+    def __init__(self, mode=FILL, bucket_percent=1.0, max_age=0.0, flush_total=0.0):
+        """Coalesce fills before reciprocals are placed for them.
+
+        - mode: one of modes
+        - bucket_percent: width of a price bucket, in percent, for BUCKET
+        - max_age: seconds after which a batch is flushed however small.
+          0 means never in ORDER and BUCKET mode.
+        - flush_total: rate * amount at which a batch is flushed at once.
+          0 means never.
+
+        A batch is also flushed once every order that contributed to it
+        is completely filled.
+
+        Fills already in a batch are remembered per order they belong to,
+        and forgotten when that order is complete and will not be polled
+        again.
+        """
+
+        if mode not in modes:
+            raise ValueError("Aggregation mode {} is not one of {}".format(mode, modes))
+
+        self.mode = mode
+        self.bucket_ratio = math.log(1 + bucket_percent / 100.0)
+        self.max_age = max_age
+        self.flush_total = flush_total
+        self.batches = dict() # (market, direction, key) -> FillBatch
+        self.consumed = dict() # reciprocant order -> set of fill tradeIDs
+        self.completed = set()
+
+    def as_dict(self):
+        """What the aggregator has batched and remembers, without its
+        settings, which come from the configuration."""
+        return dict(
+            batches=[[list(k), b.as_dict()] for k, b in sorted(self.batches.items())],
+            consumed=[[t, sorted(ids)] for t, ids in self.consumed.items()],
+            completed=sorted(self.completed))
+
+    def restore(self, d):
+        self.batches = dict((tuple(k), FillBatch.from_dict(b)) for k, b in d['batches'])
+        self.consumed = dict((t, set(ids)) for t, ids in d['consumed'])
+        self.completed = set(d['completed'])
+        return self
+
+    def key(self, source_trade_id, fill):
+        if self.mode == FILL:
+            return fill['tradeID']
+        if self.mode == ORDER:
+            return source_trade_id
+        if self.mode == BUCKET:
+            return int(math.floor(math.log(float(fill['rate'])) / self.bucket_ratio))
+        return None
+
+    def add(self, market, direction, source_trade_id, fill, now=None):
+        """Batch FILL of order SOURCE_TRADE_ID for a reciprocal in DIRECTION,
+        unless it has been batched before. Returns whether it was new."""
+
+        consumed = self.consumed.setdefault(source_trade_id, set())
+        if fill['tradeID'] in consumed:
+            return False
+        consumed.add(fill['tradeID'])
+
+        k = (market, direction, self.key(source_trade_id, fill))
+        if k not in self.batches:
+            self.batches[k] = FillBatch(market, direction, time.time() if now is None else now)
+        self.batches[k].add(source_trade_id, fill)
+        logging.debug("Batched fill %s of %s into %s", fill['tradeID'], source_trade_id, self.batches[k])
+        return True
+
+    def consume(self, covers):
+        """Remember fills covered by a reciprocal placed outside of a flush,
+        as when GridTrader.reconcile() recovers one."""
+        for source_trade_id, trade_id in covers:
+            self.consumed.setdefault(source_trade_id, set()).add(trade_id)
+
+    def complete(self, source_trade_id):
+        """Order SOURCE_TRADE_ID is completely filled. Its batches may flush
+        and its fills need no longer be remembered."""
+        self.completed.add(source_trade_id)
+        self.consumed.pop(source_trade_id, None)
+
+    def ready(self, batch, now):
+        if self.mode == FILL:
+            return True
+        if self.max_age and now - batch.first_seen >= self.max_age:
+            return True
+        if self.flush_total and float(batch.total) >= self.flush_total:
+            return True
+        if self.mode != WINDOW and batch.sources <= self.completed:
+            return True
+        return False
+
+    def flush(self, market, now=None):
+        """Remove and return the batches of MARKET that are ready for a
+        reciprocal."""
+        if now is None:
+            now = time.time()
+        retval = list()
+        for k in sorted(self.batches):
+            if k[0] == market and self.ready(self.batches[k], now):
+                retval.append(self.batches.pop(k))
+
+        pending = set()
+        for batch in self.batches.values():
+            pending.update(batch.sources)
+        self.completed &= pending
+
+        logging.debug("Flushing %s", retval)
+        return retval
+
+
+def aggregation_options(config):
+    """The FillAggregator arguments the optional [aggregation] section
+    gives, as a dict."""
+
+    def option(name, default):
+        if config.has_option('aggregation', name):
+            return config.getfloat('aggregation', name)
+        return default
+
+    mode = FILL
+    if config.has_option('aggregation', 'mode'):
+        mode = config.get('aggregation', 'mode')
+
+    return dict(
+        mode=mode,
+        bucket_percent=option('bucketPercent', 1.0),
+        max_age=option('maxAge', 0.0),
+        flush_total=option('flushTotal', 0.0)
+    )
@@ -0,0 +1,153 @@
+# core
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Kinds of archive record
+FILL = 'fill'             # a fill of one of our orders
+ORDER = 'order'           # an order that is done: filled or cancelled
+RECIPROCAL = 'reciprocal' # a reciprocal placed, with the fills it covers
+DUST = 'dust'             # a reciprocal too small to place
+LEVEL = 'level'           # a grid level placed
+ADOPTED = 'adopted'       # an open order kept for a grid level by --init
+BALANCE = 'balance'       # the coin balances of the account
+CHAIN = 'chain'           # the totals of a chain of orders that is done
+
+
+def reciprocal_gain(f):
+    """Base currency earned by fill record F of a reciprocal, net of its
+    fee. A reciprocal sell earns what it sells for above the buys it
+    reciprocates, a reciprocal buy what it pays below the sells it
+    reciprocates."""
+    if f['direction'] == 'sell':
+        gain = f['amount'] * (f['rate'] - f['opens_rate'])
+    else:
+        gain = f['amount'] * (f['opens_rate'] - f['rate'])
+    return gain - f['fee'] * f['amount'] * f['rate']
+
+
+class HistoryArchive(object):
+
+    def __init__(self, directory):
+        """Append-only, gzipped record of everything that is no longer
+        live: fills, finished orders, the lineage of reciprocals, grid
+        levels placed and balance snapshots. Keeps it off the GridTrader
+        that is persisted between runs.
+
+        Records are buffered and written by flush(), one gzip member per
+        flush, to one segment file per month in DIRECTORY. With no
+        DIRECTORY records are kept nowhere.
+
+        Flushing happens before the GridTrader is stored, so a crash in
+        between can archive a record twice. The queries below, and
+        report.py, count each fill, order and level once.
+        """
+
+        self.directory = directory
+        self.buffer = list()
+
+    def record(self, kind, **fields):
+        fields['kind'] = kind
+        fields.setdefault('time', time.time())
+        if self.directory:
+            self.buffer.append(fields)
+        return fields
+
+    def fill(self, market, direction, role, order, fill, opens_rate=None):
+        """FILL of ORDER, a grid or reciprocal (ROLE) order in DIRECTION.
+        OPENS_RATE is the rate of what a reciprocal reciprocates."""
+        return self.record(
+            FILL, market=market, direction=direction, role=role, order=order,
+            tradeID=fill['tradeID'], rate=float(fill['rate']),
+            amount=float(fill['amount']), total=float(fill.get('total') or 0),
+            fee=float(fill.get('fee') or 0), date=fill.get('date'),
+            opens_rate=opens_rate)
+
+    def segment_file_name(self, t):
+        return os.path.join(self.directory, time.strftime('%Y-%m', time.gmtime(t)) + '.jsonl.gz')
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        by_segment = dict()
+        for r in self.buffer:
+            by_segment.setdefault(self.segment_file_name(r['time']), []).append(r)
+
+        for segment, records in sorted(by_segment.items()):
+            with gzip.open(segment, 'ab') as fp:
+                for r in records:
+                    fp.write(json.dumps(r) + "\n")
+
+        logging.debug("Archived %d records in %s", len(self.buffer), self.directory)
+        self.buffer = list()
+
+    def segments(self):
+        if not self.directory:
+            return []
+        return sorted(glob.glob(os.path.join(self.directory, '*.jsonl.gz')))
+
+    def records(self, kinds=None, market=None, since=None):
+        """Iterate over archived records, oldest first, optionally only
+        those of KINDS, of MARKET or from unix time SINCE on."""
+        for segment in self.segments():
+            if since and os.path.basename(segment) < time.strftime('%Y-%m', time.gmtime(since)):
+                continue
+            with gzip.open(segment, 'rb') as fp:
+                for line in fp:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue
+                    if kinds and r['kind'] not in kinds:
+                        continue
+                    if market and r.get('market') != market:
+                        continue
+                    if since and r['time'] < since:
+                        continue
+                    yield r
+
+    def fills(self, market=None, since=None):
+        """Archived fills, each once. Trade ids are only unique within a
+        market, so a fill is known by both."""
+        seen = set()
+        for r in self.records((FILL,), market, since):
+            key = (r['market'], r['tradeID'])
+            if key in seen:
+                continue
+            seen.add(key)
+            yield r
+
+    def realized_pnl(self, market=None, since=None):
+        """Dict of market -> base currency earned by reciprocals, net of
+        the fees of their fills (see reciprocal_gain)."""
+        pnl = dict()
+        for f in self.fills(market, since):
+            if f['role'] != 'reciprocal' or f['opens_rate'] is None:
+                continue
+            pnl[f['market']] = pnl.get(f['market'], 0.0) + reciprocal_gain(f)
+        return pnl
+
+    def lineage(self, order):
+        """The RECIPROCAL records leading to ORDER, from the grid order
+        that started the chain to ORDER itself."""
+        placed = dict()
+        for r in self.records((RECIPROCAL,)):
+            placed[r['order']] = r
+
+        chain = list()
+        while order in placed and placed[order] not in chain:
+            r = placed[order]
+            chain.append(r)
+            order = r['covers'][0][0]
+        chain.reverse()
+        return chain
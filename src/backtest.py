@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+# core
+import copy
+import csv
+import itertools
+import logging
+from multiprocessing import Pool
+import sys
+import time
+
+# 3rd party
+from argh import dispatch_command, arg
+from tabulate import tabulate
+
+# local
+import aggregation
+import exception
+from filenames import config_file_name
+from ledger import FillAmounts
+from markets import MarketMetadataCache, default_maker_fee
+from pricing import PricingTable
+import recorder
+from settings import load_settings
+import strategy
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def csv_ticks(ticks_file):
+    """Tick events from TICKS_FILE, a csv file of time,market,bid,ask
+    rows in time order. A header row is skipped."""
+    ticks = list()
+    with open(ticks_file, 'rb') as fp:
+        for row in csv.reader(fp):
+            try:
+                ticks.append(dict(kind=strategy.TICK, time=float(row[0]), market=row[1],
+                                  bid=float(row[2]), ask=float(row[3])))
+            except (IndexError, ValueError):
+                continue
+    return ticks
+
+
+def recorded_ticks(log_file):
+    """Tick events from the returnTicker calls in LOG_FILE, written by
+    gridtrader.py --record."""
+    ticks = list()
+    for r in recorder.read_log(log_file):
+        if r.get('endpoint') != 'returnTicker' or 'result' not in r:
+            continue
+        for market, t in sorted(r['result'].items()):
+            ticks.append(dict(kind=strategy.TICK, time=r['time'], market=market,
+                              bid=float(t['highestBid']), ask=float(t['lowestAsk'])))
+    return ticks
+
+
+def load_ticks(ticks_file):
+    if ticks_file.endswith('.gz'):
+        return recorded_ticks(ticks_file)
+    return csv_ticks(ticks_file)
+
+
+class Simulator(object):
+
+    def __init__(self, balances, metadata, fee):
+        """An exchange for a backtest: orders are normalized to the
+        MarketMetadata of their market in METADATA, as GridTrader.submit()
+        does, rest until a tick crosses them and then fill completely at
+        their rate, as a maker, paying FEE the way Poloniex charges it
+        (see ledger.FillAmounts). BALANCES, a dict of currency -> amount,
+        pay for orders when they are placed; an order they cannot pay for
+        is rejected."""
+
+        self.balances = dict(balances)
+        self.metadata = metadata
+        self.fee = fee
+        self.orders = dict() # order number -> place intent, normalized
+        self.order_numbers = itertools.count(1)
+        self.trade_ids = itertools.count(1)
+        self.fills = 0
+        self.fees = dict() # currency -> fees paid
+        self.dust = 0
+
+    @staticmethod
+    def currencies(market):
+        base, quote = market.split('_')
+        return base, quote
+
+    def execute(self, intents):
+        """Carry out INTENTS. Returns the events they lead to at once."""
+        events = list()
+        for i in intents:
+            if i['kind'] == strategy.DUST:
+                self.dust += 1
+                continue
+            try:
+                rate, amount = self.metadata[i['market']].normalize(
+                    i['direction'], i['rate'], i['amount'])
+            except exception.DustTrade as e:
+                events.append(dict(kind=strategy.REJECTED, intent=i['intent'], reason=str(e)))
+                continue
+            base, quote = self.currencies(i['market'])
+            currency, cost = (base, rate * amount) if i['direction'] == 'buy' else (quote, amount)
+            if self.balances.get(currency, 0.0) < cost:
+                events.append(dict(kind=strategy.REJECTED, intent=i['intent'],
+                                   reason="Not enough {0}".format(currency)))
+                continue
+            self.balances[currency] -= cost
+            order_number = next(self.order_numbers)
+            self.orders[order_number] = dict(i, rate=rate, amount=amount)
+            events.append(dict(kind=strategy.PLACED, intent=i['intent'], order=order_number))
+        return events
+
+    def match(self, tick):
+        """Fill and done events of the orders TICK crosses, the fills
+        as the exchange reports them."""
+        events = list()
+        for order_number, o in sorted(self.orders.items()):
+            if o['market'] != tick['market']:
+                continue
+            if o['direction'] == 'buy' and tick['ask'] <= o['rate']:
+                currency = self.currencies(o['market'])[1]
+            elif o['direction'] == 'sell' and tick['bid'] >= o['rate']:
+                currency = self.currencies(o['market'])[0]
+            else:
+                continue
+            del self.orders[order_number]
+            fill = dict(
+                tradeID=next(self.trade_ids), type=o['direction'],
+                rate="{:.8f}".format(o['rate']), amount="{:.8f}".format(o['amount']),
+                total="{:.8f}".format(o['rate'] * o['amount']), fee="{:.8f}".format(self.fee),
+                date=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(tick['time'])))
+            a = FillAmounts(fill)
+            self.balances[currency] = self.balances.get(currency, 0.0) + float(a.net)
+            self.fees[currency] = self.fees.get(currency, 0.0) + float(a.fee)
+            self.fills += 1
+            events.append(dict(kind=strategy.FILL, market=o['market'], direction=o['direction'],
+                               order=order_number, fill=fill, time=tick['time']))
+            events.append(dict(kind=strategy.DONE, order=order_number))
+        return events
+
+    def value(self, base, prices):
+        """Balances and open orders valued in BASE at PRICES, a dict of
+        market -> bid."""
+        holdings = dict(self.balances)
+        for o in self.orders.values():
+            b, q = self.currencies(o['market'])
+            if o['direction'] == 'buy':
+                holdings[b] = holdings.get(b, 0.0) + o['rate'] * o['amount']
+            else:
+                holdings[q] = holdings.get(q, 0.0) + o['amount']
+
+        total = 0.0
+        for currency, amount in holdings.items():
+            if currency == base:
+                total += amount
+            elif "{0}_{1}".format(base, currency) in prices:
+                total += amount * prices["{0}_{1}".format(base, currency)]
+        return total
+
+
+def backtest(params, ticks, balances, base='BTC'):
+    """Run GridStrategy with PARAMS over TICKS, tick events in time order,
+    starting with BALANCES. Returns a dict of what came of it."""
+
+    grid = strategy.GridStrategy(params)
+    exchange = Simulator(balances, params['metadata'], params['fee'])
+    state = grid.initial_state()
+
+    prices = dict()
+    start = None
+    events = list()
+    for tick in ticks:
+        prices[tick['market']] = tick['bid']
+        if start is None and set(prices) >= set(params['grids']):
+            start = exchange.value(base, prices)
+        # The tick's fills before the tick itself, so orders placed now
+        # wait for the next one.
+        events.extend(exchange.match(tick))
+        events.append(tick)
+        state, intents = grid.step(state, events)
+        events = exchange.execute(intents)
+
+    end = exchange.value(base, prices)
+    start = start if start is not None else end
+    return dict(fills=exchange.fills, open_orders=len(exchange.orders), dust=exchange.dust,
+                fees=exchange.fees, start=start, end=end, pnl=end - start)
+
+
+def vary(params, name, value):
+    """PARAMS with option NAME, as section.option of the .ini file, set
+    to VALUE for every market."""
+    params = copy.deepcopy(params)
+    section, option = name.lower().split('.')
+    if section in ('sellgrid', 'buygrid'):
+        for grids in params['grids'].values():
+            g = grids[section[:-len('grid')]]
+            if option == 'majorlevel':
+                g['majorLevel'] = float(value)
+            elif option == 'increments':
+                g['increments'] = float(value) / 100.0
+            elif option == 'numberoforders':
+                # The grid keeps its share of the core position.
+                n = int(value)
+                g['size'] = g['size'] * g['numberOfOrders'] / n
+                g['numberOfOrders'] = n
+            else:
+                raise ValueError("Cannot vary {0}".format(name))
+    elif section in ('reciprocalsell', 'reciprocalbuy') and option == 'majorlevel':
+        direction = section[len('reciprocal'):]
+        for tables in params['pricing'].values():
+            t = tables[direction]
+            tables[direction] = PricingTable(
+                t.market, direction, float(value), t.tick_size, t.minimum_total)
+    elif section == 'aggregation' and option == 'mode':
+        if value not in aggregation.modes:
+            raise ValueError("Aggregation mode {0} is not one of {1}".format(value, aggregation.modes))
+        params['aggregation']['mode'] = value
+    elif section == 'aggregation' and option in ('bucketpercent', 'maxage', 'flushtotal'):
+        name = dict(bucketpercent='bucket_percent', maxage='max_age', flushtotal='flush_total')
+        params['aggregation'][name[option]] = float(value)
+    else:
+        raise ValueError("Cannot vary {0}".format(name))
+    return params
+
+
+# The ticks and balances every process of optimize() backtests over,
+# handed to each once rather than with every run.
+_shared = dict()
+
+
+def _share(ticks, balances, base):
+    _shared.update(ticks=ticks, balances=balances, base=base)
+
+
+def _run(params):
+    return backtest(params, _shared['ticks'], _shared['balances'], _shared['base'])
+
+
+def optimize(params, ticks, balances, variations, processes=None, base='BTC'):
+    """Backtest every combination of VARIATIONS, a list of (name, values)
+    as vary() takes them, in PROCESSES processes (default: one per CPU).
+    Returns a list of (combination, result) pairs, best P&L first."""
+
+    names = [name for name, values in variations]
+    combinations = list(itertools.product(*[values for name, values in variations]))
+    runs = list()
+    for combination in combinations:
+        p = params
+        for name, value in zip(names, combination):
+            p = vary(p, name, value)
+        runs.append(p)
+
+    logging.debug("Backtesting %d combinations of %s", len(runs), names)
+    pool = Pool(processes, initializer=_share, initargs=(ticks, balances, base))
+    try:
+        results = pool.map(_run, runs)
+    finally:
+        pool.close()
+        pool.join()
+
+    retval = [(dict(zip(names, c)), r) for c, r in zip(combinations, results)]
+    return sorted(retval, key=lambda cr: cr[1]['pnl'], reverse=True)
+
+
+@arg('account', help="Backtest the settings in config/$account.ini")
+@arg('ticks', help="csv file of time,market,bid,ask rows, or a log written by gridtrader.py --record")
+@arg('--base', help="Currency the markets are in and results are valued in")
+@arg('--base-balance', help="Base currency to start with; the quote currencies start at [initialcorepositions]")
+@arg('--vary', action='append', help="section.option=v1,v2,... to try each of; repeat to try every combination")
+@arg('--processes', help="Processes to backtest combinations in (default: one per CPU)")
+def main(account, ticks, base='btc', base_balance=1.0, vary=None, processes=0):
+    """Backtest the grid strategy of ACCOUNT's settings over TICKS, or,
+    with --vary, every combination of the settings varied."""
+
+    config = load_settings(config_file_name(account))
+    base = base.upper()
+    quotes = config.get('pairs', 'pairs').split()
+    markets = dict(("{0}_{1}".format(base, q.upper()), q) for q in quotes)
+    metadata = MarketMetadataCache(None).refresh(config, markets)
+    params = strategy.grid_params(config, markets, metadata, default_maker_fee)
+
+    balances = dict((q.upper(), config.getfloat('initialcorepositions', q)) for q in quotes)
+    balances[base] = float(base_balance)
+    events = load_ticks(ticks)
+
+    if not vary:
+        r = backtest(params, events, balances, base)
+        rows = [[r['fills'], r['open_orders'], r['start'], r['end'], r['pnl']]]
+        headers = ['fills', 'open orders', 'start', 'end', 'P&L']
+    else:
+        variations = list()
+        for v in vary:
+            name, values = v.split('=')
+            variations.append((name, values.split(',')))
+        results = optimize(params, events, balances, variations, processes or None, base)
+        names = [name for name, values in variations]
+        rows = [[c[name] for name in names] + [r['fills'], r['end'], r['pnl']] for c, r in results]
+        headers = names + ['fills', 'end', 'P&L']
+
+    sys.stdout.write(tabulate(rows, headers, floatfmt=".8f") + "\n")
+
+
+if __name__ == '__main__':
+    dispatch_command(main)
@@ -0,0 +1,115 @@
+# Core
+import json
+import logging
+import os
+import socket
+import threading
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Version of what a runner hands over. Fields a runner does not know are
+# ignored and missing ones start afresh, so it only changes when the
+# meaning of a field does.
+handoff_version = 1
+
+default_timeout = 60 * 60 # seconds to wait for the running process to drain
+
+
+def socket_file_name(group):
+    return "persistence/{0}.handoff.sock".format(group)
+
+
+class Handoff(object):
+
+    def __init__(self, group, timeout=default_timeout):
+        """Hands a long-running batch/run.py of GROUP over to a new one,
+        e.g. after a deploy, without stopping trading for longer than a
+        run.
+
+        The running process listens on a unix socket. A new process that
+        connects to it asks it to drain: it sets self.stop, so the running
+        process launches no more runs and waits for those under way, then
+        sends what it knows (see hand_over()) and exits. The new process
+        carries on from there.
+
+        Between runs the state of every account is in its persistence
+        file, versioned and migrated by persist.py, so the new process's
+        runs pick it up whatever code wrote it, and leave open orders
+        alone.
+        """
+
+        self.path = socket_file_name(group)
+        self.timeout = timeout
+        self.stop = threading.Event()
+        self.server = None
+        self.connection = None
+
+    def take_over(self):
+        """Ask the process running the group to drain, and wait for it to.
+        Returns what it handed over, or None if no process runs the group.
+        Raises socket.timeout if it has not drained within the timeout."""
+        if not os.path.exists(self.path):
+            return None
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        try:
+            s.connect(self.path)
+        except socket.error as e:
+            logging.debug("No process to take over from at %s: %s", self.path, e)
+            return None
+
+        logging.debug("Waiting for the process running at %s to drain", self.path)
+        try:
+            s.sendall(json.dumps(dict(request='drain', version=handoff_version)) + "\n")
+            reply = s.makefile().read()
+        finally:
+            s.close()
+
+        if not reply:
+            logging.debug("The process at %s exited without handing over", self.path)
+            return None
+        d = json.loads(reply)
+        logging.debug("Took over %s from handoff version %s", sorted(d['state']), d['version'])
+        return d['state']
+
+    def listen(self):
+        """Wait, in a thread, for a process to take over from this one."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path):
+            # Left by the process taken over from, or one that died.
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+
+        def accept():
+            connection, address = self.server.accept()
+            request = json.loads(connection.makefile().readline())
+            logging.debug("Asked to drain: %s", request)
+            self.connection = connection
+            self.stop.set()
+
+        t = threading.Thread(target=accept, name='handoff')
+        t.daemon = True
+        t.start()
+        return self
+
+    def hand_over(self, state):
+        """Send STATE, a json-able dict, to the process taking over, once
+        every run this process launched is done."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.sendall(json.dumps(dict(version=handoff_version, state=state)))
+            logging.debug("Handed over %s", sorted(state))
+        except socket.error as e:
+            # It gave up waiting; its successor starts afresh.
+            logging.debug("The process taking over is gone: %s", e)
+        finally:
+            self.connection.close()
+            self.server.close()
@@ -1,13 +1,21 @@
 # Core
 import ConfigParser
 import logging
-import subprocess, time
+import os
+import subprocess, sys, time
 
 # 3rd Party
 from argh import dispatch_command, arg
 
 # Local
-
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from coordinator import coordinate, coordinates
+from filenames import config_file_name
+from handoff import Handoff
+import mymailer
+from scheduler import Scheduler
+from shards import Supervisor
+from settings import load_settings
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -17,16 +25,22 @@ def minutes(m):
     return 60 * m
 
 
-def gridtrader(command, account):
-    shell_cmd = 'python gridtrader.py --{0} {1}'.format(command, account)
+def gridtrader(command, account, shadow=False, markets=None):
+    # Notifications are left in the outbox for this process to send.
+    shell_cmd = 'python gridtrader.py --{0} --no-deliver {1}'.format(command, account)
+    if shadow:
+        shell_cmd += ' --shadow'
+    if markets:
+        shell_cmd += ' --markets ' + ','.join(markets)
     return shell_cmd
 
 
 class Batch(object):
 
-    def __init__(self, config, accountgroup):
+    def __init__(self, config, accountgroup, shadow=False):
         self.config = config
         self.accountgroup = accountgroup
+        self.shadow = shadow
 
     @property
     def accounts(self):
@@ -35,52 +49,133 @@ class Batch(object):
         except ConfigParser.NoOptionError:
             return [self.accountgroup]
 
+    @property
+    def mail_settings(self):
+        """The settings whose [admin] section says how notifications are
+        sent: batch/config.ini's, or else the first account's."""
+        if self.config.has_section('admin'):
+            return self.config
+        return load_settings(config_file_name(self.accounts[0]))
+
+    def reload_settings(self):
+        """Picks up edits to accountgroups and delays without a restart.
+        An edit that does not validate leaves the settings as they were,
+        and the admin is told."""
+        self.config = self.config.reload_if_changed(self.settings_rejected)
+
+    def settings_rejected(self, problems):
+        mymailer.notify(self.mail_settings, self.accountgroup, 'critical',
+                        '({}) Settings not reloaded'.format(self.accountgroup),
+                        "Still running on the settings loaded before: {}".format(problems))
+
     def _init(self):
+        if coordinates(self.config, self.accountgroup):
+            logging.debug("Planning the grids of %s together", self.accountgroup)
+            coordinate(self.config, self.accountgroup, self.accounts)
+
         for account in self.accounts:
             logging.debug("*** %s", account)
-            shell_cmd = gridtrader('init', account)
+            shell_cmd = gridtrader('init', account, self.shadow)
             subprocess.call(shell_cmd.split())
 
-    def verbose_delay(self, _type):
+    def verbose_delay(self, _type, stop=None):
         delay = self.config.getfloat('delay', _type)
         print "Next loop begins after {} delay of {} minutes".format(
             _type, delay)
-        time.sleep(minutes(delay))
+        if stop:
+            stop.wait(minutes(delay))
+        else:
+            time.sleep(minutes(delay))
 
 
-    def _monitor(self):
+    def _monitor(self, stop=None):
 
         for account in self.accounts:
-            shell_cmd = gridtrader('monitor', account)
+            if stop and stop.is_set():
+                return
+            shell_cmd = gridtrader('monitor', account, self.shadow)
             subprocess.call(shell_cmd.split())
-            self.verbose_delay('account')
+            self.verbose_delay('account', stop)
 
     def _cancel_all(self):
         for account in self.accounts:
-            shell_cmd = gridtrader('cancel-all', account)
+            shell_cmd = gridtrader('cancel-all', account, self.shadow)
             subprocess.call(shell_cmd.split())
 
-    def _monitor_forever(self):
+    def _monitor_forever(self, stop=None, state=None):
+
+        while not (stop and stop.is_set()):
+            self._monitor(stop)
+            self.verbose_delay('group', stop)
+            self.reload_settings()
+        return dict()
+
+    def scheduler_option(self, option, default):
+        if self.config.has_option('scheduler', option):
+            return self.config.getfloat('scheduler', option)
+        return default
+
+    def _monitor_adaptive(self, stop=None, state=None):
+        scheduler = Scheduler(
+            self.accounts,
+            min_interval=self.scheduler_option('minInterval', 1),
+            max_interval=self.scheduler_option('maxInterval', 30),
+            calls_per_minute=self.scheduler_option('apiCallsPerMinute', 60),
+            shadow=self.shadow)
+
+        def launch(account, markets):
+            shell_cmd = gridtrader('monitor', account, self.shadow, markets)
+            subprocess.call(shell_cmd.split())
 
-        while True:
-            self._monitor()
-            self.verbose_delay('group')
+        def accounts():
+            self.reload_settings()
+            return self.accounts
+
+        if state and 'scheduler' in state:
+            scheduler.restore(state['scheduler'])
+        scheduler.run(launch, accounts, stop)
+        return dict(scheduler=scheduler.as_dict())
+
+    def _supervise(self, shards, adaptive, stop=None, state=None):
+        options = dict(
+            adaptive=adaptive, shadow=self.shadow,
+            account_delay=self.config.getfloat('delay', 'account'),
+            group_delay=self.config.getfloat('delay', 'group'),
+            min_interval=self.scheduler_option('minInterval', 1),
+            max_interval=self.scheduler_option('maxInterval', 30),
+            calls_per_minute=self.scheduler_option('apiCallsPerMinute', 60))
+
+        def command_for(account, markets):
+            return gridtrader('monitor', account, self.shadow, markets)
+
+        supervisor = Supervisor(
+            self.accountgroup, self.accounts, shards, command_for, options, self.mail_settings,
+            suffix='.shadow' if self.shadow else '')
+        if state and 'loads' in state:
+            supervisor.loads.update(state['loads'])
+        supervisor.run(stop)
+        return dict(loads=supervisor.loads)
 
 @arg('--cancel-all', help="Cancel all open orders, even if this program did not open them")
 @arg('--init', help="Create new trade grids, issue trades and persist grids.")
 @arg('--monitor', help="See if any trades in grid have closed and adjust accordingly")
 @arg('--monitor-loop', help="Run monitor in a loop")
+@arg('--monitor-adaptive', help="Run monitor forever, polling each market as often as its activity calls for (see [scheduler])")
+@arg('--shadow', help="Run every account in shadow mode: orders go to a virtual book, not the exchange")
+@arg('--shards', type=int, help="Run --monitor-loop or --monitor-adaptive in this many processes, under a supervisor")
 @arg('accountgroup', help="Searches [accountgroups] in config.ini for this value. Otherwise considers it a single .ini in src/config")
 def main(
         accountgroup,
-        init=False, monitor=False, monitor_loop=False, delay=1,
-        cancel_all=False
+        init=False, monitor=False, monitor_loop=False, monitor_adaptive=False, delay=1,
+        cancel_all=False, shadow=False, shards=1
 ):
 
-    config = ConfigParser.RawConfigParser()
-    config.read('batch/config.ini')
+    config = load_settings('batch/config.ini', 'batch')
 
-    batch = Batch(config, accountgroup)
+    batch = Batch(config, accountgroup, shadow)
+    # The runs leave their notifications in the outbox; this process
+    # sends them, deduplicated and digested across runs and accounts.
+    courier = mymailer.Courier(batch.mail_settings).start()
 
     if init:
         batch._init()
@@ -88,12 +183,27 @@ def main(
     if monitor:
         batch._monitor()
 
-    if monitor_loop:
-        batch._monitor_forever()
+    if monitor_loop or monitor_adaptive:
+        # A runner already monitoring the group drains and hands over to
+        # this one, which in turn hands over to the next.
+        handoff = Handoff(accountgroup + ('.shadow' if shadow else ''))
+        state = handoff.take_over()
+        handoff.listen()
+        if shards > 1:
+            state = batch._supervise(shards, monitor_adaptive, handoff.stop, state)
+        elif monitor_loop:
+            state = batch._monitor_forever(handoff.stop, state)
+        else:
+            state = batch._monitor_adaptive(handoff.stop, state)
+        handoff.hand_over(state)
 
     if cancel_all:
         batch._cancel_all()
 
+    courier.stop()
+    # What is due now rather than at the next start.
+    courier.deliver()
+
 
 if __name__ == '__main__':
     dispatch_command(main)
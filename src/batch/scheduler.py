@@ -0,0 +1,219 @@
+# Core
+import json
+import logging
+import os
+import time
+
+# Local
+from filenames import activity_file_name
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+default_min_interval = 1.0 # minutes
+default_max_interval = 30.0
+default_calls_per_minute = 60.0
+default_calls_per_market = 10.0
+
+# Weight of the latest run in the running averages below
+smoothing = 0.3
+
+
+def average(old, new):
+    return smoothing * new + (1 - smoothing) * old
+
+
+class MarketState(object):
+
+    def __init__(self):
+        """What is known of one market of one account from the activity
+        files its --monitor runs write."""
+        self.last_poll = 0
+        self.mid = None
+        self.distance = None # percent from the mid rate to the nearest live order
+        self.speed = 0.0 # average percent the mid rate moves per minute
+        self.fill_rate = 0.0 # average fills per minute
+
+    def update(self, t, m):
+        if self.mid and t > self.last_poll:
+            minutes = (t - self.last_poll) / 60.0
+            self.speed = average(self.speed, abs(m['mid'] - self.mid) / self.mid * 100 / minutes)
+            self.fill_rate = average(self.fill_rate, m['fills'] / minutes)
+        self.mid = m['mid']
+        self.distance = m['distance']
+        self.last_poll = t
+
+
+class Scheduler(object):
+
+    def __init__(self, accounts, min_interval=default_min_interval,
+                 max_interval=default_max_interval, calls_per_minute=default_calls_per_minute,
+                 shadow=False):
+        """Decides when to poll each market of ACCOUNTS.
+
+        A market is polled again after about half the time the market
+        would take, at its recent speed, to reach its nearest live order,
+        and at least as often as it has been filling. The interval stays
+        between MIN_INTERVAL and MAX_INTERVAL minutes.
+
+        All accounts share a budget of CALLS_PER_MINUTE exchange API
+        calls: a run waits until the budget has room for the calls it is
+        expected to make, judging by what earlier runs of the account
+        made per market polled.
+
+        With SHADOW the activity of the accounts' shadow runs is read.
+        """
+
+        self.accounts = accounts
+        self.suffix = '.shadow' if shadow else ''
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.calls_per_minute = calls_per_minute
+        self.states = dict() # (account, market) -> MarketState
+        self.calls_per_market = dict() # account -> average API calls per market polled
+        self.read = dict() # account -> time of the activity file last read
+        self.launched = dict() # account -> time of its last run
+        self.tokens = calls_per_minute
+        self.refilled = time.time()
+
+    def as_dict(self):
+        """What the scheduler has learnt, for a process taking over."""
+        return dict(
+            states=[[account, market, dict(state.__dict__)]
+                    for (account, market), state in self.states.items()],
+            calls_per_market=self.calls_per_market, read=self.read, launched=self.launched)
+
+    def restore(self, d):
+        for account, market, state in d['states']:
+            self.states[(account, market)] = MarketState()
+            self.states[(account, market)].__dict__.update(state)
+        self.calls_per_market.update(d['calls_per_market'])
+        self.read.update(d['read'])
+        self.launched.update(d['launched'])
+        return self
+
+    def interval(self, state):
+        """Minutes until STATE's market should be polled again."""
+        candidates = [self.max_interval]
+        if state.distance is not None and state.speed > 0:
+            candidates.append(state.distance / state.speed / 2)
+        if state.fill_rate > 0:
+            candidates.append(1 / state.fill_rate)
+        return max(self.min_interval, min(candidates))
+
+    def read_activity(self, account):
+        path = activity_file_name(account + self.suffix)
+        if not os.path.exists(path):
+            return
+        with open(path) as fp:
+            activity = json.load(fp)
+        if activity['time'] <= self.read.get(account, 0):
+            return
+        self.read[account] = activity['time']
+
+        for market, m in activity['markets'].items():
+            # A market new to the account is due at once.
+            state = self.states.setdefault((account, market), MarketState())
+            if m['polled']:
+                state.update(activity['time'], m)
+        if activity['polled']:
+            self.calls_per_market[account] = average(
+                self.calls_per_market.get(account, default_calls_per_market),
+                float(activity['api_calls']) / activity['polled'])
+        self.spend(activity['api_calls'])
+
+    def markets_of(self, account):
+        return [market for (a, market) in self.states if a == account]
+
+    def due(self, now=None):
+        """List of (account, markets due for a poll) to run now. MARKETS is
+        None for an account with no activity yet: all of them."""
+        now = now or time.time()
+        retval = list()
+        for account in self.accounts:
+            markets = self.markets_of(account)
+            if not markets:
+                if now >= self.first_poll(account):
+                    retval.append((account, None))
+                continue
+            due = [market for market in sorted(markets)
+                   if now >= self.next_poll(account, market)]
+            if due:
+                retval.append((account, due))
+        return retval
+
+    def next_poll(self, account, market):
+        state = self.states[(account, market)]
+        return state.last_poll + 60 * self.interval(state)
+
+    def first_poll(self, account):
+        """When to run ACCOUNT, which has no activity yet."""
+        return self.launched.get(account, 0) + 60 * self.min_interval
+
+    def next_due(self):
+        """Unix time at which the next market falls due."""
+        times = list()
+        for account in self.accounts:
+            markets = self.markets_of(account)
+            if markets:
+                times.extend(self.next_poll(account, m) for m in markets)
+            else:
+                times.append(self.first_poll(account))
+        return min(times)
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.calls_per_minute,
+                          self.tokens + (now - self.refilled) * self.calls_per_minute / 60)
+        self.refilled = now
+
+    def spend(self, calls):
+        self.refill()
+        self.tokens -= calls
+
+    def wait_for_budget(self, account, markets):
+        n = len(markets) if markets else max(len(self.markets_of(account)), 1)
+        cost = min(self.calls_per_market.get(account, default_calls_per_market) * n,
+                   self.calls_per_minute)
+        self.refill()
+        if self.tokens < cost:
+            delay = (cost - self.tokens) * 60 / self.calls_per_minute
+            logging.debug("API budget: waiting %.1f seconds before polling %s", delay, account)
+            time.sleep(delay)
+            self.refill()
+
+    def run(self, launch, accounts=None, stop=None):
+        """Poll until STOP, a threading or multiprocessing Event, is set
+        (or forever), calling LAUNCH(account, markets) for each account
+        with markets due. ACCOUNTS, a callable, may return a new list of
+        accounts before each round."""
+        for account in self.accounts:
+            self.read_activity(account)
+        # Runs from before we started do not count against the budget.
+        self.tokens = self.calls_per_minute
+
+        while not (stop and stop.is_set()):
+            if accounts:
+                self.accounts = accounts()
+            for account, markets in self.due():
+                if stop and stop.is_set():
+                    return
+                self.wait_for_budget(account, markets)
+                self.launched[account] = time.time()
+                launch(account, markets)
+                read = self.read.get(account)
+                self.read_activity(account)
+                if markets and self.read.get(account) == read:
+                    # The run failed before writing its activity. Do not
+                    # retry it at once.
+                    for market in markets:
+                        self.states[(account, market)].last_poll = time.time()
+
+            delay = self.next_due() - time.time()
+            if delay > 0:
+                logging.debug("Next poll in %.1f seconds", delay)
+                if stop:
+                    stop.wait(delay)
+                else:
+                    time.sleep(delay)
@@ -0,0 +1,244 @@
+# Core
+import fcntl
+import logging
+import multiprocessing
+import os
+import Queue
+import subprocess
+import time
+
+# Local
+from filenames import metrics_file_name
+import metrics
+import mymailer
+from scheduler import Scheduler
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Rebalance when the busiest shard has this much more load than the idlest
+rebalance_threshold = 1.5
+rebalance_interval = 15 # minutes
+
+# Weight of the latest run in the load of an account
+smoothing = 0.3
+
+# A shard that died is restarted after restart_backoff seconds, doubled
+# for each restart within restart_window minutes, up to max_backoff. One
+# that died max_restarts times within the window is left down.
+restart_backoff = 10
+max_backoff = 600
+max_restarts = 5
+restart_window = 60
+
+shard_restarts = metrics.registry.counter(
+    'gridtrader_shard_restarts_total', "Shards restarted after they died", ('shard',))
+account_runs = metrics.registry.histogram(
+    'gridtrader_account_run_seconds', "Time of one gridtrader.py run, by shard",
+    ('shard', 'account', 'outcome'))
+
+
+def lock_file_name(account):
+    return "persistence/{0}.lock".format(account)
+
+
+def assign(accounts, loads, n):
+    """Split ACCOUNTS into N lists with about the same total of LOADS,
+    seconds per run, placing the heaviest accounts first."""
+    shards = [list() for i in range(n)]
+    totals = [0.0] * n
+    for account in sorted(sorted(accounts), key=lambda a: -loads.get(a, 1.0)):
+        i = totals.index(min(totals))
+        shards[i].append(account)
+        totals[i] += loads.get(account, 1.0)
+    return shards
+
+
+def imbalance(shards, loads):
+    totals = [sum(loads.get(a, 1.0) for a in s) for s in shards if s]
+    if len(totals) < 2:
+        return 1.0
+    return max(totals) / max(min(totals), 1e-9)
+
+
+def run_shard(shard_id, accounts, command_for, results, stop, options):
+    """Body of one shard process: run gridtrader.py for each of ACCOUNTS,
+    in a fixed loop or as the adaptive scheduler says, until STOP is set.
+    Each run is reported on RESULTS as (shard, account, seconds,
+    returncode)."""
+
+    def launch(account, markets=None):
+        lock_file = lock_file_name(account)
+        if not os.path.isdir(os.path.dirname(lock_file)):
+            os.makedirs(os.path.dirname(lock_file))
+        with open(lock_file, 'a') as lock:
+            # The run inherits the lock, so a run left behind by a shard
+            # that died holds it until it is done.
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            start = time.time()
+            returncode = subprocess.call(command_for(account, markets).split())
+        results.put((shard_id, account, time.time() - start, returncode))
+
+    if options['adaptive']:
+        scheduler = Scheduler(
+            accounts, options['min_interval'], options['max_interval'],
+            options['calls_per_minute'], options['shadow'])
+        scheduler.run(launch, stop=stop)
+        return
+
+    while not stop.is_set():
+        for account in accounts:
+            if stop.is_set():
+                return
+            launch(account)
+            stop.wait(60 * options['account_delay'])
+        stop.wait(60 * options['group_delay'])
+
+
+class Supervisor(object):
+
+    def __init__(self, group, accounts, n, command_for, options, admin_config, suffix=''):
+        """Runs ACCOUNTS of GROUP in N shard processes, each with its own
+        loop (see run_shard), so that N accounts are traded at once.
+
+        The supervisor restarts a shard that dies with the accounts it
+        had, moves accounts between shards when the time their runs take
+        leaves the shards unbalanced, combines the metrics of every
+        account into metrics/<group>.fleet.prom and sends one admin
+        notification per failed run or dead shard, which the mailer
+        digests.
+
+        COMMAND_FOR(account, markets) is the gridtrader.py command line of
+        a run. OPTIONS are those of run_shard; the API call budget of the
+        adaptive scheduler is split between the shards. ADMIN_CONFIG are
+        the settings notifications are sent with. SUFFIX is what --shadow
+        appends to account names in file names.
+        """
+
+        self.group = group
+        self.accounts = accounts
+        self.n = n
+        self.command_for = command_for
+        self.options = dict(options)
+        self.options['calls_per_minute'] = options['calls_per_minute'] / float(n)
+        self.suffix = suffix
+        self.loads = dict() # account -> average seconds per run
+        self.results = multiprocessing.Queue()
+        self.shards = dict() # shard id -> (Process, accounts)
+        self.waiting = dict() # shard id -> (restart time, accounts) of shards that died
+        self.restarts = dict() # shard id -> times it was restarted
+        self.stop = None
+        self.admin_config = admin_config
+
+    def start(self, shard_id, accounts):
+        p = multiprocessing.Process(
+            target=run_shard, name='shard-{}'.format(shard_id),
+            args=(shard_id, accounts, self.command_for, self.results, self.stop, self.options))
+        p.daemon = True
+        p.start()
+        self.shards[shard_id] = (p, accounts)
+        logging.debug("Started shard %d (pid %d) with %s", shard_id, p.pid, accounts)
+
+    def start_all(self):
+        self.stop = multiprocessing.Event()
+        for shard_id, accounts in enumerate(assign(self.accounts, self.loads, self.n)):
+            if accounts:
+                self.start(shard_id, accounts)
+
+    def stop_all(self):
+        """Stop every shard once its current run is done."""
+        self.stop.set()
+        for p, accounts in self.shards.values():
+            p.join()
+        self.shards = dict()
+        self.waiting = dict()
+
+    def alert(self, severity, subject, body):
+        mymailer.notify(self.admin_config, 'supervisor', severity,
+                        '({}) {}'.format(self.group, subject), body)
+
+    def collect(self, timeout):
+        """Take in the runs the shards report within TIMEOUT seconds."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                shard_id, account, seconds, returncode = self.results.get(
+                    timeout=max(deadline - time.time(), 0.01))
+            except Queue.Empty:
+                return
+            outcome = 'ok' if returncode == 0 else 'failed'
+            account_runs.observe(seconds, shard=shard_id, account=account, outcome=outcome)
+            self.loads[account] = (smoothing * seconds
+                                   + (1 - smoothing) * self.loads.get(account, seconds))
+            if returncode != 0:
+                # The mailer folds repeats of the same last line into one.
+                self.alert('warning', 'Run of {} failed'.format(account),
+                           "Ran {:.1f} seconds in shard {}.\ngridtrader.py for {} exited with {}".format(
+                               seconds, shard_id, account, returncode))
+
+    def check(self):
+        """Restart shards that died, backing off when they keep dying."""
+        now = time.time()
+        for shard_id, (p, accounts) in self.shards.items():
+            if p.is_alive():
+                continue
+            logging.debug("Shard %d died with exit code %s", shard_id, p.exitcode)
+            del self.shards[shard_id]
+            recent = [t for t in self.restarts.get(shard_id, []) if now - t < 60 * restart_window]
+            self.restarts[shard_id] = recent
+            if len(recent) >= max_restarts:
+                self.alert('critical', 'Shard {} left down'.format(shard_id),
+                           "Exit code {}; it died {} times within {} minutes. {} are not traded "
+                           "until batch/run.py is restarted.".format(
+                               p.exitcode, len(recent) + 1, restart_window, accounts))
+                continue
+            delay = min(restart_backoff * 2 ** len(recent), max_backoff)
+            self.alert('critical', 'Shard {} died'.format(shard_id),
+                       "Exit code {}; restarting it with {} in {} seconds".format(
+                           p.exitcode, accounts, delay))
+            self.waiting[shard_id] = (now + delay, accounts)
+
+        for shard_id, (due, accounts) in self.waiting.items():
+            if due > now:
+                continue
+            del self.waiting[shard_id]
+            shard_restarts.inc(shard=shard_id)
+            self.restarts[shard_id].append(now)
+            self.start(shard_id, accounts)
+
+    def rebalance(self):
+        current = [accounts for p, accounts in self.shards.values()]
+        if imbalance(current, self.loads) < rebalance_threshold:
+            return False
+        if imbalance(assign(self.accounts, self.loads, self.n), self.loads) >= imbalance(current, self.loads):
+            return False
+        logging.debug("Rebalancing shards by load %s", self.loads)
+        self.stop_all()
+        self.start_all()
+        return True
+
+    def combine_metrics(self):
+        path = metrics_file_name(self.group + '.fleet')
+        for account in self.accounts:
+            metrics.registry.restore(metrics_file_name(account + self.suffix))
+        metrics.registry.save(path)
+
+    def run(self, stop=None):
+        """Supervise the shards until STOP, a threading Event, is set (or
+        forever). Then stop every shard once its current run is done."""
+        metrics.registry.restore(metrics_file_name(self.group + '.fleet'))
+        self.start_all()
+        last_rebalance = time.time()
+        while not (stop and stop.is_set()):
+            self.collect(timeout=10)
+            self.check()
+            if time.time() - last_rebalance >= 60 * rebalance_interval:
+                self.rebalance()
+                self.combine_metrics()
+                last_rebalance = time.time()
+
+        logging.debug("Draining the shards of %s", self.group)
+        self.stop_all()
+        self.collect(timeout=0)
+        self.combine_metrics()
@@ -0,0 +1,172 @@
+# core
+import json
+import logging
+import os
+import time
+
+# local
+import exchange as _exchange
+from filenames import config_file_name, plan_file_name
+from gridtrader import GridTrader
+from settings import load_settings
+from shadow import ShadowExchange
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+default_tolerance = 0.1 # percent
+default_max_age = 10 # minutes
+
+
+class Level(object):
+
+    def __init__(self, account, market, direction, level, rate, amount, increments):
+        self.account = account
+        self.market = market
+        self.direction = direction
+        self.level = level
+        self.rate = float(rate)
+        self.amount = float(amount)
+        self.increments = float(increments)
+        self.dropped = False
+
+
+class GroupPlan(object):
+
+    def __init__(self, group, accounts, exchange_name='polo'):
+        """Grids of every account of GROUP planned together, before each
+        account's --init places them.
+
+        Accounts with the same pairs and grid settings put their levels at
+        the same rates, so every market move fills all of them at once.
+        stagger() spreads such levels across one increment of the grid,
+        always away from the market, and drop_crossing() leaves out a buy
+        that would fill against another account's sell.
+
+        Each account trades its own funds, so the orders of two accounts
+        cannot be merged into one. Only the grids --init places are
+        planned: reciprocals are priced from each account's own fills as
+        they come, by the account's own process.
+        """
+
+        self.group = group
+        self.accounts = accounts
+        self.exchange_name = exchange_name
+        self.traders = dict()
+        self.levels = list()
+
+    def build(self):
+        shared = None
+        for account in self.accounts:
+            config = load_settings(config_file_name(account))
+            e = _exchange.exchangeFactory(self.exchange_name, config, account)
+            if shared is None:
+                # One ticker for the whole group: every grid is planned
+                # from the same market.
+                shared = ShadowExchange(e, ticker_ttl=600)
+
+            g = GridTrader(shared, config, account)
+            g.build_new_grids()
+            self.traders[account] = g
+
+            for market, grids in g.grids.items():
+                for direction, grid in grids.items():
+                    for i, rate in enumerate(grid.grid):
+                        self.levels.append(Level(
+                            account, market, direction, i, rate, grid.size, grid.increments))
+
+        return self
+
+    def side(self, market, direction):
+        return [l for l in self.levels
+                if l.market == market and l.direction == direction and not l.dropped]
+
+    def markets(self):
+        return sorted(set(l.market for l in self.levels))
+
+    def stagger(self, tolerance=default_tolerance):
+        """Spread levels of different accounts within TOLERANCE percent of
+        each other evenly across one increment, away from the market."""
+        moved = 0
+        for market in self.markets():
+            for direction, sign in (('sell', 1), ('buy', -1)):
+                levels = sorted(self.side(market, direction), key=lambda l: sign * l.rate)
+                clusters = list()
+                for l in levels:
+                    c = clusters[-1] if clusters else None
+                    if (c and l.account not in [x.account for x in c]
+                            and abs(l.rate - c[0].rate) <= c[0].rate * tolerance / 100):
+                        c.append(l)
+                    else:
+                        clusters.append([l])
+
+                for c in clusters:
+                    c.sort(key=lambda l: l.account)
+                    for j, l in enumerate(c):
+                        if j:
+                            l.rate = c[0].rate * (1 + sign * j * l.increments / len(c))
+                            moved += 1
+
+        logging.debug("Staggered %d levels of group %s", moved, self.group)
+        return moved
+
+    def drop_crossing(self):
+        """Leave out buys at or above the lowest sell of the group."""
+        dropped = 0
+        for market in self.markets():
+            sells = self.side(market, 'sell')
+            if not sells:
+                continue
+            lowest_sell = min(l.rate for l in sells)
+            for l in self.side(market, 'buy'):
+                if l.rate >= lowest_sell:
+                    logging.debug("%s buy at %.8f would fill against a sell of the group at %.8f",
+                                  l.account, l.rate, lowest_sell)
+                    l.dropped = True
+                    dropped += 1
+        return dropped
+
+    def write(self, max_age=default_max_age):
+        now = time.time()
+        for account in self.accounts:
+            grids = dict()
+            for l in self.levels:
+                if l.account == account:
+                    rates = grids.setdefault(l.market, dict()).setdefault(l.direction, list())
+                    rates.append(None if l.dropped else l.rate)
+            dump(plan_file_name(account), dict(
+                group=self.group, created=now, expires=now + 60 * max_age, grids=grids))
+
+
+def dump(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(data, fp, indent=1, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def coordinates(config, group):
+    """Whether GROUP has opted in to coordination in batch/config.ini."""
+    if not config.has_option('coordination', 'groups'):
+        return False
+    return group in config.get('coordination', 'groups').split()
+
+
+def coordinate(config, group, accounts):
+    """Plan the grids of ACCOUNTS, the accounts of GROUP, together and
+    write a plan for each for its next --init."""
+    tolerance = default_tolerance
+    if config.has_option('coordination', 'tolerance'):
+        tolerance = config.getfloat('coordination', 'tolerance')
+    max_age = default_max_age
+    if config.has_option('coordination', 'maxAge'):
+        max_age = config.getfloat('coordination', 'maxAge')
+
+    plan = GroupPlan(group, accounts).build()
+    plan.stagger(tolerance)
+    plan.drop_crossing()
+    plan.write(max_age)
+    return plan
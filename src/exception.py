@@ -11,6 +11,24 @@ class DustTrade(Exception):
 
 class InvalidDictionaryKey(Exception):
     pass
+
+class InvalidOrderTransition(Exception):
+    pass
+
+class InvalidConfig(Exception):
+    pass
+
+class ReplayExhausted(Exception):
+    pass
+
+class ReplayMismatch(Exception):
+    pass
+
+class ReplayedError(Exception):
+    pass
+
+class UnknownStateSchema(Exception):
+    pass
 # -*- coding: utf-8 -*-
 
 
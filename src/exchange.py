@@ -1,6 +1,7 @@
 # core
 import logging
 import pprint
+import time
 
 # 3rd party
 from dotmap import DotMap
@@ -9,6 +10,8 @@ import poloniex
 
 # local
 import exception
+import metrics
+import recorder
 from mynumbers import F, CF
 
 
@@ -49,9 +52,40 @@ def poloniex_api_data(d, **kwargs):
 
 wrapper = dict(polo=poloniex_api_data)
 
-def exchangeFactory(exchange_label, config, **kwargs):
+
+class InstrumentedAPI(object):
+
+    def __init__(self, api, account=None):
+        """Wraps an exchange API object, counting and timing every call
+        made through it by ACCOUNT and endpoint (see metrics.py)."""
+        self.api = api
+        self.account = account
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'api' not in self.__dict__:
+            raise AttributeError(name)
+
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            labels = dict(account=self.account, endpoint=name)
+            metrics.api_calls.inc(**labels)
+            try:
+                with metrics.api_latency.time(**labels):
+                    return attr(*args, **kwargs)
+            except Exception:
+                metrics.api_errors.inc(**labels)
+                raise
+
+        return call
+
+
+def exchangeFactory(exchange_label, config, account=None, **kwargs):
 
     if exchange_label == 'polo':
+        kwargs['account'] = account
         kwargs['extend'] = True
         kwargs['retval_wrapper'] = wrapper[exchange_label]
 
@@ -66,8 +100,21 @@ def exchangeFactory(exchange_label, config, **kwargs):
 class PoloniexFacade(poloniex.Poloniex):
     def_delegators('api', 'returnCompleteBalances, returnTicker')
 
-    def __init__(self, **kwargs):
-        self.api = poloniex.Poloniex(**kwargs)
+    def __init__(self, account=None, record=None, replay=None, replay_speed=1.0, **kwargs):
+        """RECORD names a log to write every API call to. REPLAY names
+        one to answer them from instead of Poloniex (see recorder.py)."""
+        if replay:
+            api = recorder.ReplayAPI(replay, replay_speed, kwargs['retval_wrapper'])
+            self.clock = api.clock
+        else:
+            api = poloniex.Poloniex(**kwargs)
+            self.clock = time.time
+            if record:
+                api = recorder.RecordingAPI(api, record)
+                self.clock = api.clock
+        self.api = InstrumentedAPI(api, account)
+        # Nothing outside this process is touched during a replay.
+        self.replaying = bool(replay)
 
     def currency2pair(self, base, quote, uppercase=True):
         v = "{0}_{1}".format(base, quote)
@@ -82,6 +129,32 @@ class PoloniexFacade(poloniex.Poloniex):
             if orderlist:
                 self.cancelOrders([o.orderNumber for o in orderlist])
 
+    def openOrders(self):
+        """Dict of open orders keyed by market."""
+        return self.api.returnOpenOrders()
+
+    def tradeHistory(self, market, start):
+        """Our own trades in MARKET since the unix timestamp START."""
+        r = self.api.returnTradeHistory(market, start=int(start))
+        if isinstance(r, dict) and r.get('error'):
+            exception.identify_and_raise(r['error'])
+        return r
+
+    def publicTrades(self, market, start, end=None):
+        """Everyone's trades in MARKET since the unix timestamp START, from
+        the public trade tape."""
+        kwargs = dict(start=int(start))
+        if end is not None:
+            kwargs['end'] = int(end)
+        r = self.api.returnTradeHistoryPublic(market, **kwargs)
+        if isinstance(r, dict) and r.get('error'):
+            exception.identify_and_raise(r['error'])
+        return r
+
+    def orderBook(self, market, depth):
+        """The top DEPTH bids and asks of MARKET."""
+        return self.api.returnOrderBook(market, depth=depth)
+
     def cancelOrders(self, order_numbers):
         logging.debug("cancelOrders {0}".format(order_numbers))
         for order_number in order_numbers:
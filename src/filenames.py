@@ -0,0 +1,38 @@
+# Where each account's files live, relative to src/. Kept apart from
+# gridtrader.py so that batch/ and the reports need not import it.
+
+
+def config_file_name(exch):
+    return "config/{0}.ini".format(exch)
+
+
+def persistence_file_name(exch):
+    return "persistence/{0}.storage".format(exch)
+
+
+def journal_file_name(exch):
+    return "persistence/{0}.journal".format(exch)
+
+
+def metrics_file_name(exch):
+    return "metrics/{0}".format(exch)
+
+
+def history_dir_name(exch):
+    return "history/{0}".format(exch)
+
+
+def market_metadata_file_name(exch):
+    return "persistence/{0}.markets.json".format(exch)
+
+
+def activity_file_name(exch):
+    return "activity/{0}.json".format(exch)
+
+
+def plan_file_name(exch):
+    return "plans/{0}.plan.json".format(exch)
+
+
+def shadow_report_file_name(exch):
+    return "reports/{0}.txt".format(exch)
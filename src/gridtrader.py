@@ -2,10 +2,13 @@
 
 
 # core
-import ConfigParser
+from collections import deque, OrderedDict
 from datetime import datetime
+import json
 import logging
+import os
 import pprint
+import shutil
 import sys
 import time
 import traceback
@@ -15,10 +18,25 @@ from argh import dispatch_command, arg
 from tabulate import tabulate
 
 # local
+import archive
 import exception
 import exchange as _exchange
-from mynumbers import F, CF
+from filenames import (
+    activity_file_name, config_file_name, history_dir_name, journal_file_name,
+    market_metadata_file_name, metrics_file_name, persistence_file_name, plan_file_name,
+    shadow_report_file_name)
+from ledger import FillLedger
+from markets import MarketMetadataCache
+import metrics
+import mymailer
+from mynumbers import F, RF
+from orderbook import order_book_mirror
+import orders
 from persist import Persist
+import recorder
+from settings import load_settings
+import shadow as _shadow
+import strategy
 
 
 
@@ -26,10 +44,14 @@ from persist import Persist
 # consider it totally filled
 epsilon = 1e-8
 
+# --init with [init] reuse: an open order stands for a level of the new
+# grids when its rate is this close, in percent
+default_reuse_tolerance = 0.1
+
 def human_readable(attrs, delta):
     return ['%d %s' % (getattr(delta, attr), getattr(delta, attr) > 1 and attr or attr[:-1]) for attr in attrs if getattr(delta, attr)]
 
-def display_session_info(session_args, e, start_time=None):
+def display_session_info(session_args, e, start_time=None, history=None):
     logging.debug("dsi args: {}, {}, {}".format(session_args, e, start_time))
     now = datetime.now()
     session_date = now.strftime('%a, %d %b %Y %H:%M:%S +0000')
@@ -41,6 +63,9 @@ def display_session_info(session_args, e, start_time=None):
         logging.debug("This run took {}", human_readable(attrs, elapsed_time))
 
     balances = get_balances(e)
+    if history is not None:
+        history.record(archive.BALANCE, balances=dict(
+            (coin, float(amounts['TOTAL'])) for coin, amounts in balances.items()))
     balstr = ""
     for coin in sorted(balances.keys()):
         amounts = balances[coin]
@@ -54,12 +79,32 @@ def display_session_info(session_args, e, start_time=None):
 
 
 
-def config_file_name(exch):
-    return "config/{0}.ini".format(exch)
+def load_plan(path):
+    """The grid plan coordinator.py wrote to PATH for the next --init,
+    or None if there is none or it expired."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as fp:
+        plan = json.load(fp)
+    if plan['expires'] < time.time():
+        logging.debug("Ignoring expired grid plan %s", path)
+        return None
+    return plan
 
 
-def persistence_file_name(exch):
-    return "persistence/{0}.storage".format(exch)
+def reuse_options(config):
+    """(tolerance percent,) of an --init that keeps the
+    open orders matching the new grids, when the optional [init] section
+    asks for one, else None: cancel everything and start over."""
+    if not (config.has_option('init', 'reuse') and config.getboolean('init', 'reuse')):
+        return None
+
+    def option(name, get, default):
+        if config.has_option('init', name):
+            return get('init', name)
+        return default
+
+    return (option('tolerancePercent', config.getfloat, default_reuse_tolerance),)
 
 
 def pair2currency(pair):
@@ -93,6 +138,12 @@ def float_equal(a, b, epsilon=1e-8):
     return abs(a-b) < epsilon
 
 
+def first_placed(order_numbers):
+    """The order placed first of ORDER_NUMBERS: the exchange numbers
+    orders in the order it takes them."""
+    return min(order_numbers, key=int)
+
+
 def i_range(a):
     l = len(a)
     if not l:
@@ -101,21 +152,6 @@ def i_range(a):
         return "from {0} to {1}".format(0, len(a)-1)
 
 
-class TallyGoal(object):
-
-    def __init__(self, target=None):
-        self.target = target
-        self.elems = list()
-
-    def add(self, elem):
-        self.elems.append(elem)
-
-    @property
-    def meets_target(self):
-        logging.debug("Does sum(%s) meet the target of %.8f ?",
-                      self.elems, self.target)
-        return float_equal(self.target, sum(self.elems))
-
 class Grid(object):
     def __init__(
             self, quote, pair, current_market_price, config):
@@ -132,34 +168,31 @@ class Grid(object):
         self.pair = pair
         self.current_market_price = F(current_market_price)
         self.config = config
+        self.resolve_config()
         self.make_grid()
 
-    @property
-    def majorLevel(self):
-        return CF(self.config, self.config_section, 'majorLevel')
-
-    @property
-    def numberOfOrders(self):
-        return self.config.getint(self.config_section, 'numberOfOrders')
+    def resolve_config(self):
+        """Look up the grid parameters once. The orders of a grid keep
+        the size they were placed with whatever the config says later."""
+        section = self.config_section
+        self.majorLevel = F(self.config.getfloat(section, 'majorLevel'))
+        self.numberOfOrders = self.config.getint(section, 'numberOfOrders')
+        self.increments = percent2ratio(F(self.config.getfloat(section, 'increments')))
+        self.size = (
+            percent2ratio(F(self.config.getfloat(section, 'size')))
+            * self.initial_core_position
+            / self.numberOfOrders
+        )
 
-    @property
-    def increments(self):
-        return percent2ratio(
-            F(self.config.getfloat(self.config_section, 'increments')))
+    def make_grid(self):
+        self.grid = strategy.grid_levels(self.direction, self.current_market_price,
+                                         self.majorLevel, self.increments, self.numberOfOrders)
+        self.far_end = self.grid[-1]
 
     @property
     def config_section(self):
         return self.__class__.__name__.lower()
 
-    @property
-    def size(self):
-
-        return (
-            percent2ratio(CF(self.config, self.config_section, 'size'))
-            * self.initial_core_position
-            / self.numberOfOrders
-        )
-
     def build_order(self, rate):
         order = dict(market=self.pair, rate=rate, amount=self.size)
         return order
@@ -168,6 +201,57 @@ class Grid(object):
         logging.debug("<order from=%s>%s</order>", type(self).__name__, pprint.pformat(order))
         return order
 
+    def slot(self, level):
+        return dict(kind='grid', market=self.pair, direction=self.direction, level=level)
+
+    def near_slot(self, replaces):
+        """The slot of a level follow() places in front of the grid, in
+        place of REPLACES, the far end order it cancelled, if any."""
+        return dict(self.slot(0), end='near', replaces=replaces)
+
+    def attach(self, slot, trade_id, rate):
+        """Record TRADE_ID, placed at RATE for SLOT, when it was placed but
+        never persisted. Returns False if the grid cannot take it: levels
+        are placed in order from the near end, so the level of SLOT must
+        be the next one. A near_slot() level goes in front, and the far
+        end order it replaces is dropped."""
+        if trade_id in self.trade_ids:
+            return True
+        if slot.get('end') == 'near':
+            if self.trade_ids and self.trade_ids[-1] == slot['replaces']:
+                self.grid.pop()
+                self.trade_ids.pop()
+            self.grid.insert(0, RF(rate))
+            self.trade_ids.insert(0, trade_id)
+            self.far_end = self.grid[-1]
+            return True
+        level = slot['level']
+        if level != len(self.trade_ids):
+            logging.debug("Cannot attach %s at level %d of %d placed levels",
+                          trade_id, level, len(self.trade_ids))
+            return False
+        if level == len(self.grid):
+            # Placed by extend() beyond the levels that were persisted.
+            self.grid.append(RF(rate))
+            self.far_end = self.grid[-1]
+        self.trade_ids.append(trade_id)
+        return True
+
+    def place_orders(self, submit):
+        """Place one order per level of the grid through SUBMIT, normally
+        GridTrader.submit()."""
+        logging.debug("<PLACE_ORDERS>")
+
+        for level, rate in enumerate(self.grid):
+            order = self.build_order(rate)
+            self.print_order(order)
+            trade_id = submit(direction=self.direction, slot=self.slot(level), **order)
+            self.trade_ids.append(trade_id)
+
+        logging.debug("</PLACE_ORDERS>")
+
+        return self
+
     def trade_activity(self, exchange):
         for i in xrange(len(self.trade_ids)-1, -1, -1):
             uuid = self.trade_ids[i]
@@ -182,25 +266,146 @@ class Grid(object):
 
         return None
 
-    def _fill_activity(self, exchange):
-        r = [(i, exchange.fills(trade_id)) for i, trade_id in enumerate(self.trade_ids)]
+    def _fill_activity(self, exchange, check=None):
+        r = [(i, exchange.fills(trade_id) if check is None or check(self.grid[i]) else [])
+             for i, trade_id in enumerate(self.trade_ids)]
         return r
 
-    def fill_activity(self, exchange):
-        retval = self._fill_activity(exchange)
+    def fill_activity(self, exchange, check=None):
+        """(level, fills) of each order of the grid. With CHECK, only
+        levels whose rate CHECK is true for are asked about."""
+        retval = self._fill_activity(exchange, check)
         logging.debug("Fill activity = {}".format(retval))
         return retval
 
-    def purge_closed_trades(self, deepest_i):
+    def purge_closed_trades(self):
+        """Drop the levels whose orders are completely filled. Returns the
+        trade ids of those orders."""
         new_grid = list()
         new_trade_ids = list()
-        for i in xrange(0, len(self.trade_ids)):
-            if i > deepest_i:
-                new_grid.append(self.grid[i])
+        purged = list()
+        for i in xrange(0, len(self.grid)):
+            if i in self.trade_ids_filled:
+                purged.append(self.trade_ids[i])
+                continue
+            new_grid.append(self.grid[i])
+            if i < len(self.trade_ids):
                 new_trade_ids.append(self.trade_ids[i])
 
         self.grid = new_grid
         self.trade_ids = new_trade_ids
+        self.trade_ids_filled = list()
+        return purged
+
+    def trim(self, max_orders):
+        """Drop the levels farthest from the market beyond MAX_ORDERS.
+        Returns the trade ids of the orders placed for them."""
+        trimmed = self.trade_ids[max_orders:]
+        self.grid = self.grid[:max_orders]
+        self.trade_ids = self.trade_ids[:max_orders]
+        if self.grid:
+            self.far_end = self.grid[-1]
+        return trimmed
+
+    def drop_unplaced(self):
+        """Drop the levels beyond the last one placed, e.g. those that
+        could not be afforded, so that the grid can be extended from the
+        levels it has. Returns how many were dropped."""
+        placed = len(self.trade_ids)
+        dropped = len(self.grid) - placed
+        if dropped <= 0:
+            return 0
+        logging.debug("Dropping the %d levels of %s %s that were never placed",
+                      dropped, self.pair, type(self).__name__)
+        if placed:
+            self.far_end = self.grid[placed - 1]
+        else:
+            self.far_end = self.previous_level(self.grid[0])
+        self.grid = self.grid[:placed]
+        return dropped
+
+    def extend(self, submit, max_orders):
+        """Place new levels through SUBMIT beyond the far end of the grid
+        until it has MAX_ORDERS. Levels that were never placed are dropped
+        first. Returns the trade ids placed."""
+        placed = list()
+        self.drop_unplaced()
+
+        while len(self.grid) < max_orders:
+            rate = self.next_level(self.far_end)
+            order = self.build_order(rate)
+            self.print_order(order)
+            trade_id = submit(direction=self.direction, slot=self.slot(len(self.grid)), **order)
+            self.grid.append(rate)
+            self.trade_ids.append(trade_id)
+            self.far_end = rate
+            placed.append(trade_id)
+
+        return placed
+
+    def follow(self, market_price, submit, cancel, max_orders):
+        """Place levels at the near end of the grid while MARKET_PRICE has
+        moved away from it by more than a level, so that a grid the
+        market leaves behind keeps its orders near the market. A grid
+        that has MAX_ORDERS levels first has its far end order cancelled
+        through CANCEL. Orders are placed through SUBMIT. Moves at most
+        every level once; the next call goes on from there. Returns the
+        trade ids placed."""
+        placed = list()
+        if not self.grid or len(self.trade_ids) < len(self.grid):
+            return placed
+
+        sign = 1 if self.direction == 'sell' else -1
+        start = strategy.grid_levels(
+            self.direction, market_price, self.majorLevel, self.increments, 1)[0]
+        for moves in range(max(len(self.grid), max_orders)):
+            rate = self.previous_level(self.grid[0])
+            if (rate - start) * sign < 0:
+                break
+            logging.debug("%s %s follows the market to %s", self.pair, type(self).__name__, rate)
+            replaces = None
+            if len(self.grid) >= max_orders:
+                replaces = self.trade_ids[-1]
+                cancel(replaces)
+                self.grid.pop()
+                self.trade_ids.pop()
+                # Where extend() goes on from, should the new level fail.
+                self.far_end = self.grid[-1] if self.grid else self.previous_level(rate)
+            order = self.build_order(rate)
+            self.print_order(order)
+            trade_id = submit(direction=self.direction, slot=self.near_slot(replaces), **order)
+            self.grid.insert(0, rate)
+            self.trade_ids.insert(0, trade_id)
+            self.far_end = self.grid[-1]
+            placed.append(trade_id)
+
+        return placed
+
+    def as_dict(self):
+        """The state of the grid, as plain values. The levels and sizes its
+        orders were placed with are kept, not looked up again."""
+        return dict(
+            direction=self.direction, quote=self.quote, pair=self.pair,
+            current_market_price=float(self.current_market_price),
+            initial_core_position=float(self.initial_core_position),
+            majorLevel=float(self.majorLevel), numberOfOrders=self.numberOfOrders,
+            increments=float(self.increments), size=float(self.size),
+            grid=[float(rate) for rate in self.grid],
+            far_end=float(getattr(self, 'far_end', self.grid[-1] if self.grid else 0)),
+            trade_ids=list(self.trade_ids), trade_ids_filled=list(self.trade_ids_filled))
+
+    @staticmethod
+    def from_dict(d, config):
+        grid = object.__new__(Grid.constructor_for[d['direction']])
+        grid.config = config
+        grid.quote, grid.pair = d['quote'], d['pair']
+        grid.numberOfOrders = d['numberOfOrders']
+        for attr in 'current_market_price initial_core_position majorLevel increments size far_end'.split():
+            setattr(grid, attr, RF(d[attr]))
+        grid.grid = [RF(rate) for rate in d['grid']]
+        grid.trade_ids = list(d['trade_ids'])
+        grid.trade_ids_filled = list(d['trade_ids_filled'])
+        return grid
 
     def __str__(self):
 
@@ -229,6 +434,8 @@ class Grid(object):
 
 class SellGrid(Grid):
 
+    direction = 'sell'
+
     def __init__(self, quote, pair, current_market_price, config):
         super(type(self), self).__init__(
             quote, pair, current_market_price, config)
@@ -238,32 +445,16 @@ class SellGrid(Grid):
         return delta_by_percent(self.current_market_price, self.majorLevel)
 
 
-    def make_grid(self):
-        retval = list()
-        last_price = self.starting_price
-        for i in range(0, self.numberOfOrders):
-            retval.append(last_price)
-            next_price = last_price + last_price * self.increments
-            # print next_price
-            last_price = next_price
-
-        self.grid = retval
-
-    def place_orders(self, exchange):
-        logging.debug("<PLACE_ORDERS>")
-
-        for rate in self.grid:
-            order = self.build_order(rate)
-            self.print_order(order)
-            r = exchange.sell(**order)
-            self.trade_ids.append(r.orderNumber)
+    def next_level(self, rate):
+        return rate + rate * self.increments
 
-        logging.debug("</PLACE_ORDERS>")
-
-        return self
+    def previous_level(self, rate):
+        return rate / (1 + self.increments)
 
 class BuyGrid(Grid):
 
+    direction = 'buy'
+
     def __init__(self, quote, pair, current_market_price, config):
         super(type(self), self).__init__(
             quote, pair, current_market_price, config)
@@ -275,36 +466,20 @@ class BuyGrid(Grid):
         # ))
         return delta_by_percent(self.current_market_price, -1*self.majorLevel)
 
-    def make_grid(self):
-        retval = list()
-        last_price = self.starting_price
-        for i in range(0, self.numberOfOrders):
-            retval.append(last_price)
-            next_price = last_price - last_price * self.increments
-            # print next_price
-            last_price = next_price
-
-        self.grid = retval
-
-    def place_orders(self, exchange):
-        print "<PLACE_ORDERS>"
-
-        for rate in self.grid:
-            order = self.build_order(rate)
-            self.print_order(order)
-            r = exchange.buy(**order)
-            self.trade_ids.append(r.orderNumber)
+    def next_level(self, rate):
+        return rate - rate * self.increments
 
-        print "</PLACE_ORDERS>"
+    def previous_level(self, rate):
+        return rate / (1 - self.increments)
 
-        return self
+Grid.constructor_for = dict(buy=BuyGrid, sell=SellGrid)
 
 
 class ReciprocalTrade(object):
 
     direction_toggle = dict(buy='sell', sell='buy')
 
-    def __init__(self, reciprocant_trade_id, config, market, exchange, rate_of_closed_trade, size_of_closed_trade, grids):
+    def __init__(self, reciprocant_trade_id, market, rate_of_closed_trade, size_of_closed_trade):
         """A reciprocal trade is created as a trade (partially) fills. It is
         created in the opposite direction of the trade that it reciprocates.
         E.g., if a buy (of any sort - grid buy, compliment buy, etc) order
@@ -314,31 +489,45 @@ class ReciprocalTrade(object):
 
         - reciprocant_trade_id: the trade_id that this reciprocal trade reciprocates.
         - market: something like BTC_STRAT
-        - exchange: the exchange instance
         - rate_of_closed_trade
-        - grids: the grids that initiated the chain of reciprocation.
+        - size_of_closed_trade
 
-        Initialization of the reciprocal takes place build_new_grids().
+        A reciprocal is a small value record: its rate and size come from
+        the GridStrategy intent it is placed for (see
+        GridTrader.execute()), so that persisting a GridTrader does not
+        persist a submitter or pricing table once per reciprocal.
         """
 
         self.reciprocant_trade_id = reciprocant_trade_id
-        self.config = config
         self.market = market
-        self.exchange = exchange
-        self.rate_of_closed_trade = rate_of_closed_trade
-        self.size_of_closed_trade = size_of_closed_trade
-        self.grid = grids
+        self.rate_of_closed_trade = float(rate_of_closed_trade)
+        self.size_of_closed_trade = float(size_of_closed_trade)
         self.trade_id = None
-        logging.debug("{} of {} initialized with grids {}".format(
-            type(self).__name__, reciprocant_trade_id, grids))
+        logging.debug("{} of {} initialized".format(
+            type(self).__name__, reciprocant_trade_id))
+
+    def slot(self, covers=()):
+        return dict(
+            kind='reciprocal', market=self.market, direction=self.direction,
+            reciprocant_trade_id=self.reciprocant_trade_id,
+            rate_of_closed_trade=self.rate_of_closed_trade,
+            size_of_closed_trade=self.size_of_closed_trade,
+            covers=list(covers)
+        )
 
-    @property
-    def fills(self):
-        return self.exchange.fills(self.trade_id)
+    def as_dict(self):
+        d = dict(self.__dict__)
+        d['direction'] = self.direction
+        return d
 
-    @property
-    def majorLevel(self):
-        return CF(self.config, type(self).__name__, 'majorLevel')
+    @staticmethod
+    def from_dict(d):
+        r = ReciprocalTrade.constructor_for[d['direction']](
+            d['reciprocant_trade_id'], d['market'],
+            rate_of_closed_trade=d['rate_of_closed_trade'],
+            size_of_closed_trade=d['size_of_closed_trade'])
+        r.trade_id = d['trade_id']
+        return r
 
     def __str__(self):
         return """{} reciprocant={} trade_id={}
@@ -354,55 +543,45 @@ class ReciprocalTrade(object):
 
 class ReciprocalSell(ReciprocalTrade):
 
-    """A ReciprocalSell is made when a buy order fills."""
+    """A ReciprocalSell is made when a buy order fills. It sells
+    majorLevel percent above the rate of the buy."""
 
-    @property
-    def rate(self):
-        """Take the rate of the buy trade and create a retrace sell trade
-        mirror_delta percent greater than that rate."""
-
-        delta = delta_by_percent(self.rate_of_closed_trade, self.majorLevel)
-        return delta
-
-    def place_order(self):
-        r = self.exchange.sell(self.market,
-                               rate=self.rate,
-                               amount=self.size_of_closed_trade
-                               )
-        self.trade_id = r.orderNumber
-        return self
+    direction = 'sell'
 
 
 class ReciprocalBuy(ReciprocalTrade):
 
-    @property
-    def rate(self):
-        """Take the rate of the closed sell trade and create a buy trade
-        delta percent less than that rate."""
-
-        delta = delta_by_percent(self.rate_of_closed_trade, -1.0 * self.majorLevel)
-        return delta
-
-    def place_order(self):
-        r = self.exchange.buy(self.market,
-                              rate=self.rate,
-                              amount=self.size_of_closed_trade
-                              )
-        self.trade_id = r.orderNumber
-        return self
+    """A ReciprocalBuy is made when a sell order fills. It buys
+    majorLevel percent below the rate of the sell."""
+
+    direction = 'buy'
 
 ReciprocalTrade.constructor_for = dict(buy=ReciprocalBuy, sell=ReciprocalSell)
 
 class GridTrader(object):
 
-    def __init__(self, exchange, config, account, base='btc'):
+    def __init__(self, exchange, config, account, base='btc', journal=None, history=None,
+                 metadata=None):
         self.exchange, self.config, self.base = exchange, config, base
         self.account = account
+        self.journal = journal or orders.OrderJournal(None)
+        # Fills, finished orders and reciprocal lineage go to the history
+        # archive, so that what is persisted only grows with live orders.
+        self.history = history or archive.HistoryArchive(None)
+        # Every order is normalized to what its market accepts before it
+        # is submitted.
+        self.metadata = metadata or MarketMetadataCache(None)
         self.market = dict()
         self.reciprocal = dict()
-        self.reciprocal_dust = list() # trades too small to place
+        self.reciprocal_dust = deque(maxlen=10) # latest trades too small to place
+        self.orders = dict() # orderNumber -> OrderRecord of each live order
+        # What becomes of fills: batches, reciprocals and dust (see strategy.py)
+        self.strategy = strategy.GridStrategy(strategy.strategy_params(config, [], self.metadata))
+        self.state = self.strategy.initial_state()
+        self.ledger = FillLedger() # exact totals of the fills of each order and chain
+        self.mirror = order_book_mirror(config) # None unless [orderbook] enabled
 
-        # self.grids is set in .build_new_grids() below
+        # self.grids are set in .build_new_grids() below
 
     def __str__(self):
         s = str()
@@ -426,6 +605,102 @@ class GridTrader(object):
 
         return "{0}\n{1}".format(type(self).__name__, s)
 
+    def as_dict(self):
+        """The state of this GridTrader, as plain values, for persist.py.
+        What follows from the settings (pricing, aggregation and mirror
+        options) and what has a file of its own (journal, history, market
+        metadata) is left out."""
+        d = dict(
+            account=self.account, base=self.base,
+            market=dict((m, dict((k, float(v)) for k, v in r.items()))
+                        for m, r in self.market.items()),
+            grids=dict((m, dict((direction, g.as_dict()) for direction, g in grids.items()))
+                       for m, grids in self.grids.items()),
+            reciprocal=dict((m, dict((direction, [r.as_dict() for r in rs.values()])
+                                     for direction, rs in directions.items()))
+                            for m, directions in self.reciprocal.items()),
+            reciprocal_dust=[r.as_dict() for r in self.reciprocal_dust],
+            orders=[r.as_dict() for r in sorted(self.orders.values(), key=lambda r: r.created)],
+            aggregator=self.state['aggregator'],
+            dust_batches=self.state['dust_batches'],
+            mirror=self.mirror.as_dict() if self.mirror is not None else None,
+            ledger=self.ledger.as_dict())
+        if isinstance(self.exchange, _shadow.ShadowExchange):
+            d['shadow'] = self.exchange.book.as_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d, exchange, config, journal=None, history=None, metadata=None):
+        """The GridTrader D, what as_dict() gave, trading on EXCHANGE
+        with CONFIG."""
+        g = cls(exchange, config, d['account'], d['base'], journal, history, metadata)
+        g.market = dict((m, dict((k, RF(v)) for k, v in r.items()))
+                        for m, r in d['market'].items())
+        g.grids = dict((m, dict((direction, Grid.from_dict(grid, config))
+                                for direction, grid in grids.items()))
+                       for m, grids in d['grids'].items())
+        for m, directions in d['reciprocal'].items():
+            g.reciprocal[m] = dict()
+            for direction, rs in directions.items():
+                g.reciprocal[m][direction] = dict(
+                    (r['reciprocant_trade_id'], ReciprocalTrade.from_dict(r)) for r in rs)
+        g.reciprocal_dust.extend(ReciprocalTrade.from_dict(r) for r in d['reciprocal_dust'])
+        g.orders = dict((r['order_number'], orders.OrderRecord(**r)) for r in d['orders'])
+        g.state = dict(g.state, aggregator=d['aggregator'], dust_batches=d['dust_batches'])
+        if g.mirror is not None and d['mirror']:
+            g.mirror.restore(d['mirror'])
+        g.ledger.restore(d['ledger'])
+        if d.get('shadow') and isinstance(exchange, _shadow.ShadowExchange):
+            exchange.book.restore(d['shadow'])
+        g.metadata.refresh(config, g.grids.keys())
+        g.use_strategy()
+        return g
+
+    def use_strategy(self):
+        """Turn fills into reciprocals in the markets of the grids as the
+        settings say: the GridStrategy of their pricing and aggregation."""
+        self.strategy = strategy.GridStrategy(
+            strategy.strategy_params(self.config, self.grids.keys(), self.metadata))
+
+    def reload_settings(self, config):
+        """Switch to CONFIG, the reloaded settings of this account. Sanity
+        checks, admin notification, reciprocal pricing and fill aggregation
+        follow it at once: batches and dust carry over in the strategy
+        state. Grids keep the levels and sizes their orders were placed
+        with until the next --init."""
+        logging.debug("Reloading settings from %s", config)
+        self.config = config
+        self.metadata.refresh(config, self.grids.keys())
+        self.use_strategy()
+        mirror = order_book_mirror(config)
+        if mirror is not None:
+            mirror.adopt(self.mirror)
+        self.mirror = mirror
+
+    def alert(self, subject, body):
+        """Queue a critical notification for the admin, in the outbox. A
+        replay only logs it."""
+        logging.debug("%s: %s", subject, body)
+        if getattr(self.exchange, 'replaying', False):
+            return
+        mymailer.notify(self.config, self.account, 'critical',
+                        '({}) {}'.format(self.account, subject), body)
+
+    def refresh_settings(self):
+        """Reload the settings if the .ini file changed since they were
+        loaded. Returns whether it did. An edit that does not validate is kept out, and
+        the admin is told."""
+
+        def rejected(problems):
+            self.alert('Settings not reloaded',
+                       "Still trading on the settings loaded before: {}".format(problems))
+
+        config = self.config.reload_if_changed(rejected)
+        if config is self.config:
+            return False
+        self.reload_settings(config)
+        return True
+
     def sanity_check(self, market):
         logging.debug("Sanity checking %s", market)
         new_bid = F(self.exchange.tickerFor(market).highestBid)
@@ -451,15 +726,30 @@ class GridTrader(object):
         logging.debug("PASSES")
 
     def notify_admin(self, error_msg):
+        """Queue ERROR_MSG for the admin, in the outbox, so that this never
+        waits on SMTP, then cancel all open orders. The notification is
+        queued first: the error may well keep the cancel from working.
+        A replay only logs the error: it neither mails nor cancels."""
 
-        logging.debug("Cancelling all open orders before notifying admin about error %s", error_msg)
+        if getattr(self.exchange, 'replaying', False):
+            logging.debug("Replay: not notifying the admin or cancelling orders after error %s",
+                          error_msg)
+            return
 
-        self.exchange.cancelAllOpen()
+        mymailer.send_email(self, error_msg)
 
-        logging.debug("Cancellation done.")
+        logging.debug("Cancelling all open orders after error %s", error_msg)
+        try:
+            self.exchange.cancelAllOpen()
+        except Exception as e:
+            logging.debug("Could not cancel all open orders: %s", e)
+            mymailer.notify(self.config, self.account, 'critical',
+                            '({}) Open orders not cancelled'.format(self.account),
+                            "After the error below, cancelling all open orders failed: {}\n\n{}".format(
+                                e, error_msg))
+            return
 
-        import mymailer
-        mymailer.send_email(self, error_msg)
+        logging.debug("Cancellation done.")
 
 
     @property
@@ -513,6 +803,29 @@ class GridTrader(object):
 
 
         self.grids = grid
+        self.metadata.refresh(self.config, grid.keys())
+        self.use_strategy()
+
+    def apply_plan(self, plan):
+        """Move the levels of the grids just built to the rates PLAN, a
+        grid plan of the account's group, gives them. A level planned
+        as None is left out. A grid the plan does not fit, because it
+        has another number of levels or the market moved past a planned
+        rate, is left as built."""
+        for market, grids in plan['grids'].items():
+            for direction, rates in grids.items():
+                grid = self.grids.get(market, {}).get(direction)
+                if grid is None or len(rates) != len(grid.grid):
+                    logging.debug("Grid plan does not fit %s %s", market, direction)
+                    continue
+                sign = 1 if direction == 'sell' else -1
+                kept = [F(r) for r in rates if r is not None]
+                if not kept or any(sign * (r - grid.current_market_price) <= 0 for r in kept):
+                    logging.debug("Market moved past the grid plan of %s %s", market, direction)
+                    continue
+                grid.grid = kept
+                grid.far_end = max(kept) if direction == 'sell' else min(kept)
+                logging.debug("Planned %s %s grid: %s", market, direction, kept)
 
     def issue_trades(self):
         for market in self.grids:
@@ -524,49 +837,425 @@ class GridTrader(object):
                 g = self.grids[market][buysell]
 
                 if buysell == 'buy':
-                    g.place_orders(self.exchange)
+                    g.place_orders(self.submit)
                 elif buysell == 'sell':
                     try:
-                        g.place_orders(self.exchange)
+                        g.place_orders(self.submit)
                     except (exception.NotEnoughCoin, exception.DustTrade):
                         logging.debug("Sell grid not fully created because there was not enough coin")
                         # self.grids[market][buysell].trade_ids = list()
                 else:
                     raise exception.InvalidDictionaryKey("Key other than buy or sell")
 
-    def monitor_reciprocals(self, market, buy_reciprocal_market, sell_reciprocal_market):
+    def reusable(self, market, grid, rate, candidates, tolerance):
+        """The order among CANDIDATES, open orders of MARKET in the
+        direction of GRID, that can stand for its level at RATE: nothing
+        filled yet, the size of the grid's orders to the lot, and the
+        nearest rate within TOLERANCE percent. None if there is none."""
+        lot = self.metadata.get(market).lot_size
+        best = None
+        for o in candidates:
+            amount = float(o['amount'])
+            if 'startingAmount' in o and not float_equal(float(o['startingAmount']), amount):
+                continue
+            if abs(amount - float(grid.size)) > lot + epsilon:
+                continue
+            d = abs(percent_difference(rate, F(o['rate'])))
+            if d <= tolerance and (best is None or d < best[0]):
+                best = (d, o)
+        return best and best[1]
+
+    def diff_trades(self, open_orders, tolerance):
+        """Issue the trades of the grids just built without starting over:
+        an order among OPEN_ORDERS (see exchange.openOrders()) that can
+        stand for a level (see reusable()) is kept for it, the other open
+        orders are cancelled and only the levels left are placed. Returns
+        (kept, cancelled, placed).
+
+        The exchange is called one order at a time: private calls made at
+        once on one API key can reach it with their nonces out of order.
+        An order that cannot be cancelled is logged and left open. A sell
+        level the account cannot afford is left out of its grid. A buy
+        level that cannot be placed raises, as in issue_trades(), once the
+        rest are placed."""
+
+        jobs = list() # (grid, level) to place
+        kept = 0
+        for market in self.grids:
+            self.market[market] = {
+                'lowestAsk'  : F(self.exchange.tickerFor(market).lowestAsk),
+                'highestBid' : F(self.exchange.tickerFor(market).highestBid),
+            }
+            for direction, g in self.grids[market].items():
+                candidates = [o for o in open_orders.get(market, []) if o['type'] == direction]
+                g.trade_ids = [None] * len(g.grid)
+                for level, rate in enumerate(g.grid):
+                    o = self.reusable(market, g, rate, candidates, tolerance)
+                    if o is None:
+                        jobs.append((g, level))
+                        continue
+                    candidates.remove(o)
+                    g.grid[level] = F(o['rate'])
+                    g.trade_ids[level] = o['orderNumber']
+                    self.orders[o['orderNumber']] = self.journal.adopt(
+                        market, direction, o['rate'], o['amount'], g.slot(level), o['orderNumber'])
+                    # Placed by an earlier run, which recorded the level.
+                    self.history.record(
+                        archive.ADOPTED, market=market, direction=direction, order=o['orderNumber'],
+                        rate=float(o['rate']), amount=float(o['amount']))
+                    kept += 1
+
+        tracked = self.tracked_trade_ids()
+        stale = [o['orderNumber'] for market_orders in open_orders.values()
+                 for o in market_orders if o['orderNumber'] not in tracked]
+        logging.debug("Keeping %d open orders, cancelling %d, placing %d",
+                      kept, len(stale), len(jobs))
+
+        # Cancel first, so the balance they hold is there for the new
+        # orders.
+        cancelled = 0
+        for order_number in stale:
+            try:
+                self.exchange.cancelOrders([order_number])
+                cancelled += 1
+            except Exception as e:
+                logging.debug("Could not cancel open order %s: %s", order_number, e)
+
+        failed = list()
+        for g, level in jobs:
+            try:
+                g.trade_ids[level] = self.submit(direction=g.direction, slot=g.slot(level),
+                                                 **g.build_order(g.grid[level]))
+            except (exception.NotEnoughCoin, exception.DustTrade) as e:
+                logging.debug("%s %s level %d not placed: %s", g.pair, g.direction, level, e)
+                if g.direction == 'buy':
+                    failed.append(e)
+
+        placed = 0
+        for market in self.grids:
+            for g in self.grids[market].values():
+                levels = [(rate, trade_id) for rate, trade_id in zip(g.grid, g.trade_ids)
+                          if trade_id is not None]
+                placed += len(levels)
+                g.grid = [rate for rate, trade_id in levels]
+                g.trade_ids = [trade_id for rate, trade_id in levels]
+                if g.grid:
+                    g.far_end = g.grid[-1]
+
+        if failed:
+            raise failed[0]
+        return kept, cancelled, placed - kept
+
+    def submit(self, market, direction, rate, amount, slot):
+        """Place an order, journaling the intent before the exchange is
+        called and the orderNumber before returning it. SLOT says where
+        the order lives in this GridTrader (see orders.OrderRecord).
+
+        The rate and amount are first normalized to the tick and lot of
+        the market, and an order below its minimum total raises DustTrade
+        without calling the exchange.
+
+        An order the exchange rejects is journaled as cancelled. Any other
+        failure leaves it submitted, for reconcile() to look for on the
+        exchange.
+        """
+        try:
+            rate, amount = self.metadata.get(market).normalize(direction, rate, amount)
+        except exception.DustTrade:
+            metrics.local_rejections.inc(account=self.account, market=market, direction=direction)
+            raise
+        record = self.journal.intent(market, direction, rate, amount, slot)
+        self.journal.transition(record, orders.SUBMITTED)
+        place = getattr(self.exchange, direction)
+        try:
+            trade_id = place(market, rate=rate, amount=amount).orderNumber
+        except (exception.NotEnoughCoin, exception.DustTrade):
+            self.journal.transition(record, orders.CANCELLED)
+            raise
+        self.journal.transition(record, orders.ACKNOWLEDGED, order_number=trade_id)
+        self.orders[trade_id] = record
+        if slot['kind'] == 'grid':
+            self.history.record(
+                archive.LEVEL, market=market, direction=direction, order=trade_id,
+                rate=float(rate), amount=float(amount))
+        return trade_id
+
+    def track_fills(self, trade_id, filled):
+        """Advance the lifecycle of TRADE_ID, which has fills, in the
+        journal. FILLED says whether they meet its target."""
+        record = self.orders.get(trade_id)
+        if record is None:
+            return
+        if filled:
+            self.journal.transition(record, orders.FILLED)
+            del self.orders[trade_id]
+        elif record.state != orders.PARTIALLY_FILLED:
+            self.journal.transition(record, orders.PARTIALLY_FILLED)
+
+    def target_of(self, trade_id, size):
+        """The amount order TRADE_ID was placed with, as journaled, or
+        SIZE, what it was meant to have, for an order placed before
+        amounts were journaled."""
+        record = self.orders.get(trade_id)
+        if record is not None:
+            return record.amount
+        return size
+
+    def cancel_order(self, trade_id):
+        self.exchange.cancelOrders([trade_id])
+        self.ledger.close(trade_id)
+        record = self.orders.pop(trade_id, None)
+        if record is not None:
+            self.journal.transition(record, orders.CANCELLED)
+            self.history.record(
+                archive.ORDER, market=record.market, direction=record.direction,
+                order=trade_id, rate=record.rate, amount=record.amount,
+                role=record.slot['kind'], state=orders.CANCELLED)
+
+    @property
+    def rolling(self):
+        return (self.config.has_option('rolling', 'enabled')
+                and self.config.getboolean('rolling', 'enabled'))
+
+    def roll_grids(self, market):
+        """Purge the completely filled levels of the grids of MARKET and
+        place new levels at their far ends, so that the grids follow the
+        market with at most [rolling] maxOrders orders each. A grid the
+        market moved away from, such as the buy grid of a rising market,
+        has its far end levels moved to its near end. Only the difference
+        is sent to the exchange."""
+        ticker = self.exchange.tickerFor(market)
+        market_price = dict(buy=F(ticker.highestBid), sell=F(ticker.lowestAsk))
+        for direction, grid in self.grids[market].items():
+            labels = dict(account=self.account, market=market, direction=direction)
+            max_orders = grid.numberOfOrders
+            if self.config.has_option('rolling', 'maxOrders'):
+                max_orders = self.config.getint('rolling', 'maxOrders')
+
+            purged = grid.purge_closed_trades()
+            metrics.grid_levels.inc(len(purged), outcome='purged', **labels)
+
+            for trade_id in grid.trim(max_orders):
+                logging.debug("Cancelling %s beyond %d levels", trade_id, max_orders)
+                self.cancel_order(trade_id)
+                metrics.grid_levels.inc(outcome='cancelled', **labels)
+
+            def cancel(trade_id):
+                self.cancel_order(trade_id)
+                metrics.grid_levels.inc(outcome='cancelled', **labels)
+
+            try:
+                placed = grid.follow(market_price[direction], self.submit, cancel, max_orders)
+                placed += grid.extend(self.submit, max_orders)
+            except (exception.NotEnoughCoin, exception.DustTrade):
+                logging.debug("%s %s grid not fully extended", market, direction)
+                continue
+            metrics.grid_levels.inc(len(placed), outcome='placed', **labels)
+            logging.debug("Rolled %s %s grid: purged %s, placed %s",
+                          market, direction, purged, placed)
+
+    def tracked_trade_ids(self):
+        trade_ids = set(self.orders)
+        for market in self.grids:
+            for direction in self.grids[market]:
+                trade_ids.update(self.grids[market][direction].trade_ids)
+                for r in self.reciprocal[market][direction].values():
+                    trade_ids.add(r.trade_id)
+        return trade_ids
+
+    def find_trade_id(self, record, open_orders, tracked):
+        """The orderNumber of the order placed for RECORD, found among
+        OPEN_ORDERS or, if it already filled, in our trade history: an
+        order whose fills are all at RECORD's rate and add up to its
+        amount.
+
+        Orders of the same rate and amount are alike to reconcile, so a
+        tie goes to the lowest orderNumber, the one placed first: records
+        are reconciled oldest first, and each takes the next."""
+        matches = [o['orderNumber'] for o in open_orders.get(record.market, [])
+                   if o['type'] == record.direction
+                   and o['orderNumber'] not in tracked
+                   and float_equal(float(o['rate']), record.rate)
+                   and float_equal(float(o.get('startingAmount', o['amount'])), record.amount)]
+        if matches:
+            return first_placed(matches)
+
+        filled = OrderedDict() # orderNumber -> amount, or None if at another rate
+        for t in self.exchange.tradeHistory(record.market, record.created - 60):
+            if t['type'] != record.direction or t['orderNumber'] in tracked:
+                continue
+            amount = filled.get(t['orderNumber'], 0.0)
+            if amount is not None and float_equal(float(t['rate']), record.rate):
+                filled[t['orderNumber']] = amount + float(t['amount'])
+            else:
+                filled[t['orderNumber']] = None
+        matches = [order_number for order_number, amount in filled.items()
+                   if amount is not None and float_equal(amount, record.amount)]
+        if matches:
+            return first_placed(matches)
+
+        return None
+
+    def attach(self, record):
+        """Put the order of RECORD back where its slot says it lives."""
+        slot = record.slot
+        market, direction = slot['market'], slot['direction']
+        if slot['kind'] == 'grid':
+            if slot.get('replaces') is not None:
+                # follow() journaled its cancel before this order's intent.
+                self.orders.pop(slot['replaces'], None)
+                self.ledger.close(slot['replaces'])
+            if not self.grids[market][direction].attach(slot, record.order_number, record.rate):
+                self.alert('Order not reconciled',
+                           "{} {} order {} was placed for level {} of its grid, which has {} orders "
+                           "placed. It stays open on the exchange but is not part of the grid.".format(
+                               market, direction, record.order_number, slot['level'],
+                               len(self.grids[market][direction].trade_ids)))
+        else:
+            reciprocal_market = self.reciprocal[market][direction]
+            if slot['reciprocant_trade_id'] not in reciprocal_market:
+                r = ReciprocalTrade.constructor_for[direction](
+                    slot['reciprocant_trade_id'], market,
+                    rate_of_closed_trade=slot['rate_of_closed_trade'],
+                    size_of_closed_trade=slot['size_of_closed_trade']
+                )
+                r.trade_id = record.order_number
+                reciprocal_market[r.reciprocant_trade_id] = r
+                if slot['covers']:
+                    self.ledger.open(r.trade_id, market, direction, record.amount,
+                                     source=slot['covers'][0][0])
+            self.step([dict(kind=strategy.COVERED, covers=slot['covers'])])
+        self.orders[record.order_number] = record
+        logging.debug("Reconciled %s", record)
+
+    def reconcile(self):
+        """Recover orders placed after this GridTrader was last persisted,
+        using the order journal and the open orders on the exchange. Run
+        before polling a retrieved GridTrader."""
+        records = [r for r in self.journal.records() if r.state not in orders.terminal]
+        if not records:
+            return
+
+        logging.debug("Reconciling %d journaled orders", len(records))
+        open_orders = self.exchange.openOrders()
+        tracked = self.tracked_trade_ids()
+
+        for record in records:
+            if record.order_number in tracked:
+                continue
+
+            if record.state == orders.INTENT:
+                # Nothing is sent to the exchange before SUBMITTED is journaled.
+                self.journal.transition(record, orders.CANCELLED)
+                continue
+
+            if record.state == orders.SUBMITTED:
+                trade_id = self.find_trade_id(record, open_orders, tracked)
+                if trade_id is None:
+                    logging.debug("%s never reached the exchange", record)
+                    self.journal.transition(record, orders.CANCELLED)
+                    continue
+                self.journal.transition(record, orders.ACKNOWLEDGED, order_number=trade_id)
+
+            self.attach(record)
+            tracked.add(record.order_number)
+
+    def monitor_reciprocals(self, market, events):
+        """Add the fills of the reciprocals of MARKET to EVENTS, as
+        _poll() does for a grid. Returns how many of them had not been
+        seen before."""
         logging.debug("---------- monitor_reciprocals")
+        new_fills = 0
         for direction in 'buy sell'.split():
             logging.debug("... studying %s reciprocal market", direction)
             for reciprocant_trade_id, reciprocal_trade in self.reciprocal[market][direction].items():
-                fill_tally = TallyGoal(reciprocal_trade.size_of_closed_trade)
-                for fill in reciprocal_trade.fills:
-                    ftid = fill['tradeID']
-                    logging.debug("Looking for reciprocal trades of %d", ftid)
-                    opposite_direction = ReciprocalTrade.direction_toggle[direction]
-                    opposite_market = self.reciprocal[market][opposite_direction]
-                    if ftid not in opposite_market:
-                        r = ReciprocalTrade.constructor_for[opposite_direction](
-                                ftid, self.config,
-                                market, self.exchange,
-                                rate_of_closed_trade=float(fill['rate']),
-                                size_of_closed_trade=float(fill['amount']),
-                                grids=self.grids[market]
-                            )
-                        self.place_reciprocal_order(r, opposite_market)
-                    fill_tally.add(float(fill['amount']))
-                if fill_tally.meets_target:
+                record = self.orders.get(reciprocal_trade.trade_id)
+                if record is not None and not self.check(market, direction, record.rate):
+                    continue
+                fills = self.exchange.fills(reciprocal_trade.trade_id)
+                if not fills:
+                    continue
+                tally = self.ledger.open(
+                    reciprocal_trade.trade_id, market, direction,
+                    self.target_of(reciprocal_trade.trade_id, reciprocal_trade.size_of_closed_trade))
+                for fill in fills:
+                    logging.debug("Looking for reciprocal trades of %d", fill['tradeID'])
+                    if self.ledger.add(reciprocal_trade.trade_id, fill) is not None:
+                        events.append(self.fill_event(market, direction, reciprocal_trade.trade_id, fill))
+                        new_fills += 1
+                        self.history.fill(
+                            market, direction, 'reciprocal', reciprocal_trade.trade_id, fill,
+                            opens_rate=reciprocal_trade.rate_of_closed_trade)
+                self.track_fills(reciprocal_trade.trade_id, tally.meets_target)
+                if tally.meets_target:
                     del self.reciprocal[market][direction][reciprocant_trade_id]
+                    events.append(dict(kind=strategy.DONE, order=reciprocal_trade.trade_id))
+                    self.ledger.close(reciprocal_trade.trade_id)
+                    self.history.record(
+                        archive.ORDER, market=market, direction=direction,
+                        order=reciprocal_trade.trade_id, role='reciprocal',
+                        reciprocant=reciprocant_trade_id,
+                        amount=reciprocal_trade.size_of_closed_trade, state=orders.FILLED)
+        return new_fills
 
-    def place_reciprocal_order(self, reciprocal_trade, reciprocal_market):
-        """Place RECIPROCAL_TRADE, adding to RECIPROCAL_MARKET dictionary, indexed by TradeID of FILL
-        that had not previously been filled.
-        """
+    @staticmethod
+    def fill_event(market, direction, trade_id, fill):
+        return dict(kind=strategy.FILL, market=market, direction=direction, order=trade_id,
+                    fill=fill, time=time.time())
+
+    def step(self, events):
+        """Run EVENTS through the strategy and carry out the intents it
+        returns (see execute()). What came of placing them goes back to
+        the strategy in turn."""
+        while events:
+            self.state, intents = self.strategy.step(self.state, events)
+            events = [e for e in (self.execute(i) for i in intents) if e is not None]
+
+    def execute(self, intent):
+        """Carry out INTENT, a reciprocal GridStrategy.step() returned:
+        place it through submit(), keyed in self.reciprocal by the tradeID
+        of the first fill it covers, or record it as dust. Returns the
+        event that follows, if any: PLACED, or REJECTED for an order too
+        small once normalized, whose fills the strategy keeps as dust."""
+        market, direction = intent['market'], intent['direction']
+        r = ReciprocalTrade.constructor_for[direction](
+            intent['reciprocant_trade_id'], market,
+            rate_of_closed_trade=intent['opens_rate'],
+            size_of_closed_trade=intent['amount']
+        )
+        labels = dict(account=self.account, market=market, direction=direction)
+
+        if intent['kind'] == strategy.DUST:
+            self.reciprocal_dust.append(r)
+            metrics.reciprocals.inc(outcome='dust', **labels)
+            self.history.record(
+                archive.DUST, market=market, direction=direction, order=None,
+                reciprocant=r.reciprocant_trade_id, rate_of_closed_trade=r.rate_of_closed_trade,
+                amount=r.size_of_closed_trade, covers=intent['covers'])
+            return None
+
+        logging.debug("Placing this order %s", r)
         try:
-            reciprocal_trade.place_order()
-            reciprocal_market[reciprocal_trade.reciprocant_trade_id] = reciprocal_trade
-        except exception.DustTrade:
-            self.reciprocal_dust.append(reciprocal_trade)
+            r.trade_id = self.submit(market, direction, rate=intent['rate'],
+                                     amount=intent['amount'], slot=r.slot(intent['covers']))
+        except exception.DustTrade as e:
+            return dict(kind=strategy.REJECTED, intent=intent['intent'], reason=str(e))
+
+        self.reciprocal[market][direction][r.reciprocant_trade_id] = r
+        metrics.reciprocals.inc(outcome='placed', **labels)
+        self.history.record(
+            archive.RECIPROCAL, market=market, direction=direction, order=r.trade_id,
+            reciprocant=r.reciprocant_trade_id, rate_of_closed_trade=r.rate_of_closed_trade,
+            amount=r.size_of_closed_trade, covers=intent['covers'])
+        # The reciprocal carries on the chain of the first order it
+        # reciprocates, as HistoryArchive.lineage() has it.
+        self.ledger.open(r.trade_id, market, direction,
+                         self.target_of(r.trade_id, r.size_of_closed_trade),
+                         source=intent['covers'][0][0])
+        metrics.fill_to_reciprocal.observe(
+            time.time() - intent['filled_at'], account=self.account, market=market,
+            direction=direction)
+        return dict(kind=strategy.PLACED, intent=intent['intent'], order=r.trade_id)
 
     @staticmethod
     def other_direction(buyorsell):
@@ -576,52 +1265,131 @@ class GridTrader(object):
             return 'buy'
         raise Exception("%s was passed to a method only accept buy or sell", buyorsell)
 
-    def _poll(self, grid, grids, market, reciprocal_market, reciprocal_constructor):
-        for i, fills in grid.fill_activity(self.exchange):
+    def check(self, market, direction, rate):
+        """Whether to ask the exchange for the fills of an order in MARKET
+        and DIRECTION at RATE: always, unless the order book mirror says
+        the market has not come near it."""
+        touched = self.mirror is None or self.mirror.touched(market, direction, rate)
+        metrics.order_checks.inc(
+            account=self.account, market=market, outcome='checked' if touched else 'skipped')
+        return touched
+
+    def _poll(self, grid, market, events):
+        """Add the fills of each order of GRID to EVENTS, for the
+        strategy, and a DONE event for each order completely filled.
+        Returns how many of them had not been seen before."""
+        new_fills = 0
+        check = lambda rate: self.check(market, grid.direction, rate)
+        for i, fills in grid.fill_activity(self.exchange, check):
             if i in grid.trade_ids_filled:
                 logging.debug("Index %d has been completely filled", i)
                 continue
             if fills:
-                logging.debug("Index %d in grid has some fills towards its goal of %f", i, grid.size)
-                fill_tally = TallyGoal(grid.size)
+                trade_id = grid.trade_ids[i]
+                tally = self.ledger.open(
+                    trade_id, market, grid.direction, self.target_of(trade_id, grid.size))
                 for fill in fills:
-                    if fill['tradeID'] not in reciprocal_market:
+                    # Fills counted before went to the strategy then.
+                    if self.ledger.add(trade_id, fill) is not None:
                         logging.debug("No reciprocal trade placed for %d", fill['tradeID'])
-                        r = reciprocal_constructor(
-                            fill['tradeID'],
-                            self.config,
-                            market, self.exchange,
-                            rate_of_closed_trade=F(fill['rate']),
-                            size_of_closed_trade=F(fill['amount']),
-                            grids=grids
-                        )
-                        logging.debug("Placing this order %s", r)
-                        self.place_reciprocal_order(r, reciprocal_market)
-                    fill_tally.add(F(fill['amount']))
-                if fill_tally.meets_target:
+                        events.append(self.fill_event(market, grid.direction, trade_id, fill))
+                        new_fills += 1
+                        self.history.fill(market, grid.direction, 'grid', trade_id, fill)
+                logging.debug("Index %d in grid has fills towards its goal: %s", i, tally)
+                self.track_fills(trade_id, tally.meets_target)
+                if tally.meets_target:
                     grid.trade_ids_filled.append(i)
+                    events.append(dict(kind=strategy.DONE, order=trade_id))
+                    self.ledger.close(trade_id)
+                    self.history.record(
+                        archive.ORDER, market=market, direction=grid.direction,
+                        order=grid.trade_ids[i], role='grid', rate=float(grid.grid[i]),
+                        amount=float(grid.size), state=orders.FILLED)
             else:
                 logging.debug("Index %d in grid has no fills towards its goal of %f", i, grid.size)
+        return new_fills
 
-    def poll(self):
+    def poll(self, markets=None):
+        """Poll MARKETS, by default every market of the grids. Returns a
+        dict of market -> new fills seen."""
 
         logging.debug("------------------------------ poll method")
 
-        for market in self.grids:
-            logging.debug("Analyze %s", market)
-            self.sanity_check(market)
-
-            grids = self.grids[market]
+        new_fills = dict()
+        for market in markets or self.grids:
+            if market not in self.grids:
+                logging.debug("No grids in %s, not polling it", market)
+                continue
+            with metrics.poll_seconds.time(account=self.account, market=market):
+                new_fills[market] = self.poll_market(market)
+        self.settle_chains()
+        return new_fills
+
+    def settle_chains(self):
+        """Archive the totals of the chains of orders that are done: no
+        order of theirs is live and none of their fills waits for a
+        reciprocal."""
+        for totals in self.ledger.settle(strategy.waiting(self.state)):
+            logging.debug("Chain done: %s", totals)
+            self.history.record(
+                archive.CHAIN, market=totals.market, chain=totals.chain, fills=totals.fills,
+                inventory=float(totals.inventory), cash=float(totals.cash),
+                quote_fees=float(totals.quote_fees), base_fees=float(totals.base_fees))
+
+    def poll_market(self, market):
+        logging.debug("Analyze %s", market)
+        self.sanity_check(market)
+        if self.mirror is not None:
+            self.mirror.refresh(self.exchange, market)
+
+        grids = self.grids[market]
+        new_fills = 0
+        events = list()
 
-            for direction in 'buy sell'.split():
-                grid = grids[direction]
-                logging.debug("Checking %s %s grid for fill activity", market, direction)
-                other_direction = self.other_direction(direction)
-                reciprocal_market = self.reciprocal[market][other_direction]
-                self._poll(
-                        grid, grids, market, reciprocal_market, ReciprocalTrade.constructor_for[other_direction])
+        for direction in 'buy sell'.split():
+            grid = grids[direction]
+            logging.debug("Checking %s %s grid for fill activity", market, direction)
+            new_fills += self._poll(grid, market, events)
+
+        new_fills += self.monitor_reciprocals(market, events)
+        metrics.poll_fills.observe(new_fills, account=self.account, market=market)
+        # The tick has the strategy flush what is ready for a reciprocal.
+        events.append(dict(kind=strategy.TICK, market=market, time=time.time()))
+        self.step(events)
+        if self.rolling:
+            self.roll_grids(market)
+        return new_fills
+
+    def nearest_order(self, market, rate):
+        """Percent distance from RATE to the nearest live order in MARKET,
+        or None if there is none."""
+        rates = [float(r.rate) for r in self.orders.values() if r.market == market]
+        if not rates:
+            return None
+        return min(abs(r - rate) for r in rates) / rate * 100
+
+    def write_activity(self, path, new_fills, calls_before):
+        """Write what batch/scheduler.py needs to schedule the next poll of
+        each market: NEW_FILLS, the dict poll() returned, the market's mid
+        rate and its distance to the nearest live order, and the API calls
+        this run made, counted from CALLS_BEFORE, api_calls_made() at its
+        start, once the ticker read here is counted too."""
+        ticker = self.exchange.returnTicker()
+        api_calls = api_calls_made(self.account) - calls_before
+        markets = dict()
+        for market in self.grids:
+            mid = float(_exchange.PoloniexAPIData(ticker[market]).midPoint)
+            markets[market] = dict(
+                polled=market in new_fills, fills=new_fills.get(market, 0),
+                mid=mid, distance=self.nearest_order(market, mid))
 
-            self.monitor_reciprocals(market, self.reciprocal[market]['buy'], self.reciprocal[market]['sell'])
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(dict(time=time.time(), api_calls=api_calls,
+                           polled=len(new_fills), markets=markets), fp)
+        os.rename(path + '.tmp', path)
 
 
 
@@ -659,6 +1427,11 @@ def get_balances(e):
     return b
 
 
+def api_calls_made(account):
+    """Exchange API calls ACCOUNT made, as counted in the metrics."""
+    return sum(v for k, v in metrics.api_calls.values.items() if k[0] == account)
+
+
 def initialize_logging(account_name, args):
 
     args = pdict(args)
@@ -690,6 +1463,12 @@ def initialize_logging(account_name, args):
 @arg('account', help="The account whose API keys we are using (e.g. terrence, joseph, peter, etc.")
 @arg('--exchange-name', help="on which exchange (polo, trex, gdax)")
 @arg('--balances', help="list coin holdings")
+@arg('--record', help="Write every exchange API call of this run to this log")
+@arg('--replay', help="Answer exchange API calls from this log, written by --record, instead of the exchange")
+@arg('--replay-speed', type=float, help="1 replays calls as far apart as they were recorded, 2 twice as fast, 0 without waiting")
+@arg('--markets', help="Comma-separated markets to poll on --monitor (default: all)")
+@arg('--shadow', help="Send orders to a virtual book instead of the exchange and report what would have been done")
+@arg('--no-deliver', help="Leave admin notifications in the outbox for batch/run.py to send")
 def main(
         account,
         exchange_name='polo',
@@ -698,15 +1477,20 @@ def main(
         monitor=False,
         balances=False,
         status_of='',
+        shadow=False,
+        markets='',
+        record='',
+        replay='',
+        replay_speed=1.0,
+        no_deliver=False,
 ):
 
     command_line_args = locals()
 
     args, fileName = initialize_logging(account, command_line_args)
 
-    config_file = config_file_name(account)
-    config = ConfigParser.RawConfigParser()
-    config.read(config_file)
+    # Invalid settings fail here, before anything is traded.
+    config = load_settings(config_file_name(account))
 
     # logging.debug("Config contents:")
     # for section_name in config.sections():
@@ -715,13 +1499,42 @@ def main(
     #     for name, value in config.items(section_name):
     #         logging.debug('  %s = %s', name, value)
 
-    persistence_file = persistence_file_name(account)
-
-    exchange = _exchange.exchangeFactory(exchange_name, config)
-
-    now = display_session_info(args, exchange)
-
-    g = GridTrader(exchange, config, account)
+    # A shadow run keeps its state apart from the live trader of the
+    # account, so both can run side by side.
+    label = account
+    if replay:
+        label += '.replay'
+    if shadow:
+        label += '.shadow'
+
+    persistence_file = persistence_file_name(label)
+    # A recording keeps the state it started from, so that replaying it
+    # starts from there too.
+    if record and os.path.exists(persistence_file):
+        shutil.copyfile(persistence_file, record + '.storage')
+    if replay and os.path.exists(replay + '.storage'):
+        shutil.copyfile(replay + '.storage', persistence_file)
+
+    journal = orders.OrderJournal(journal_file_name(label))
+    history = archive.HistoryArchive(history_dir_name(label))
+    metadata = MarketMetadataCache(market_metadata_file_name(label))
+    metrics.registry.restore(metrics_file_name(label))
+    calls_before = api_calls_made(label)
+
+    def connect():
+        e = _exchange.exchangeFactory(
+            exchange_name, config, label,
+            record=record, replay=replay, replay_speed=replay_speed)
+        if shadow:
+            e = _shadow.ShadowExchange(e)
+        return e
+
+    exchange = connect()
+
+    now = display_session_info(args, exchange, history=history)
+    timings = list()
+
+    g = GridTrader(exchange, config, label, journal=journal, history=history, metadata=metadata)
 
     try:
         if cancel_all:
@@ -729,27 +1542,61 @@ def main(
             exchange.cancelAllOpen()
 
         if init:
-            exchange = _exchange.exchangeFactory(exchange_name, config)
+            start = time.time()
+            exchange = connect()
+            reuse = reuse_options(config)
 
-            logging.debug("Cancelling ALL open orders on exchange %s", exchange)
-            exchange.cancelAllOpen()
+            if reuse:
+                open_orders = exchange.openOrders()
+            else:
+                logging.debug("Cancelling ALL open orders on exchange %s", exchange)
+                exchange.cancelAllOpen()
+            journal.checkpoint()
 
             logging.debug("Building trade grids")
             g.build_new_grids()
+            plan = load_plan(plan_file_name(account))
+            if plan:
+                logging.debug("Applying the grid plan of group %s", plan['group'])
+                g.apply_plan(plan)
 
             logging.debug("Issuing trades on created grids.")
             logging.debug("(also storing market rates for sanity checks.)")
-            g.issue_trades()
+            if reuse:
+                try:
+                    kept, cancelled, placed = g.diff_trades(open_orders, *reuse)
+                    logging.debug("Kept %d open orders, cancelled %d and placed %d",
+                                  kept, cancelled, placed)
+                finally:
+                    # Even when a level failed, the grids hold the orders
+                    # kept and placed, which a later run must know of.
+                    history.flush()
+                    Persist(persistence_file).store(g)
+            else:
+                g.issue_trades()
 
             logging.debug("Storing GridTrader to disk.")
+            history.flush()
             Persist(persistence_file).store(g)
+            journal.checkpoint()
+            timings.append(('init', time.time() - start))
 
         if monitor:
+            start = time.time()
             logging.debug("Evaluating trade activity since last invocation")
             persistence = Persist(persistence_file)
-            g = persistence.retrieve()
-            g.poll()
+            g = GridTrader.from_dict(
+                persistence.retrieve(), exchange, config,
+                journal=journal, history=history, metadata=metadata)
+            g.refresh_settings()
+            logging.debug("Reconciling orders placed since the last store")
+            g.reconcile()
+            new_fills = g.poll(markets.split(',') if markets else None)
+            history.flush()
             persistence.store(g)
+            journal.checkpoint()
+            timings.append(('monitor', time.time() - start))
+            g.write_activity(activity_file_name(label), new_fills, calls_before)
 
         if balances:
             logging.debug("Getting balances")
@@ -761,7 +1608,19 @@ def main(
         g.notify_admin(error_msg)
 
 
-    display_session_info(args, exchange, start_time=now)
+    display_session_info(args, exchange, start_time=now, history=history)
+    history.flush()
+    metrics.registry.save(metrics_file_name(label))
+    recorder.flush()
+
+    if shadow:
+        shadow_report = _shadow.report(g.exchange.book, timings, time.mktime(now.timetuple()))
+        print shadow_report
+        _shadow.write_report(shadow_report_file_name(label), shadow_report)
+
+    if not (no_deliver or replay):
+        # Run on its own: no batch/run.py Courier sends the outbox.
+        mymailer.deliver(config)
 
 
 if __name__ == '__main__':
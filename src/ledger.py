@@ -0,0 +1,246 @@
+# core
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+import logging
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Poloniex gives amounts, rates and fees to 8 decimal places.
+places = Decimal('0.00000001')
+zero = Decimal(0)
+
+
+def D(v):
+    """V as an exact Decimal of 8 places. Strings, as the exchange gives
+    them, are taken as they are; floats and F values of ours are rounded
+    down, as the exchange does with the amounts it is sent."""
+    if isinstance(v, Decimal):
+        return v
+    if isinstance(v, basestring):
+        return Decimal(v)
+    return Decimal('{:.9f}'.format(float(v))).quantize(places, rounding=ROUND_DOWN)
+
+
+class FillAmounts(object):
+
+    def __init__(self, fill):
+        """What FILL, as the exchange reports it, moved, exactly.
+
+        - amount: quote currency traded
+        - rate
+        - total: base currency traded, as the exchange rounded it
+        - fee: what the exchange kept, in the currency the fill brought
+          in: the quote currency for a buy, the base currency for a sell
+        - net: what the fill brought in after the fee
+        """
+
+        self.direction = fill['type']
+        self.amount = D(fill['amount'])
+        self.rate = D(fill['rate'])
+        self.total = D(fill['total']) if fill.get('total') else (
+            self.amount * self.rate).quantize(places)
+        fee_rate = D(fill.get('fee') or 0)
+        received = self.amount if self.direction == 'buy' else self.total
+        # Rounded up, so what we count on having is never more than we have.
+        self.fee = (received * fee_rate).quantize(places, rounding=ROUND_UP)
+        self.net = received - self.fee
+
+    @property
+    def reciprocal_size(self):
+        """The amount a reciprocal of this fill trades: all a buy brought
+        in, net of its fee, and all a sell sold, its fee having been paid
+        in the base currency."""
+        if self.direction == 'buy':
+            return self.net
+        return self.amount
+
+
+class OrderTally(object):
+
+    def __init__(self, direction, target, chain):
+        """Running totals of the fills of one order of TARGET amount in
+        DIRECTION, belonging to CHAIN."""
+
+        self.direction = direction
+        self.target = D(target)
+        self.chain = chain
+        self.filled = zero
+        self.total = zero
+        self.fee = zero
+        self.seen = set() # tradeIDs counted
+
+    def add(self, fill):
+        """Count FILL unless it was counted before. Returns its
+        FillAmounts, or None."""
+        if fill['tradeID'] in self.seen:
+            return None
+        self.seen.add(fill['tradeID'])
+        a = FillAmounts(fill)
+        self.filled += a.amount
+        self.total += a.total
+        self.fee += a.fee
+        return a
+
+    @property
+    def remaining(self):
+        return self.target - self.filled
+
+    @property
+    def meets_target(self):
+        return self.remaining <= 0
+
+    def as_dict(self):
+        return dict(direction=self.direction, target=str(self.target), chain=self.chain,
+                    filled=str(self.filled), total=str(self.total), fee=str(self.fee),
+                    seen=sorted(self.seen))
+
+    @classmethod
+    def from_dict(cls, d):
+        tally = cls(d['direction'], D(d['target']), d['chain'])
+        tally.filled, tally.total, tally.fee = D(d['filled']), D(d['total']), D(d['fee'])
+        tally.seen = set(d['seen'])
+        return tally
+
+    def __str__(self):
+        return "<OrderTally {} {}/{} fee={} chain={}>".format(
+            self.direction, self.filled, self.target, self.fee, self.chain)
+
+    __repr__ = __str__
+
+
+class ChainTotals(object):
+
+    def __init__(self, chain, market):
+        """Running totals of a chain in MARKET: a grid order and the
+        reciprocals that follow from its fills, one from another. CHAIN is
+        the grid order's number."""
+
+        self.chain = chain
+        self.market = market
+        self.live = 0 # orders of the chain not done yet
+        self.fills = 0
+        self.bought = zero # quote currency, net of fees
+        self.sold = zero
+        self.spent = zero # base currency, net of fees
+        self.received = zero
+        self.quote_fees = zero
+        self.base_fees = zero
+
+    def add(self, a):
+        self.fills += 1
+        if a.direction == 'buy':
+            self.bought += a.net
+            self.spent += a.total
+            self.quote_fees += a.fee
+        else:
+            self.sold += a.amount
+            self.received += a.net
+            self.base_fees += a.fee
+
+    @property
+    def inventory(self):
+        """Quote currency the chain holds: bought and not sold again."""
+        return self.bought - self.sold
+
+    @property
+    def cash(self):
+        """Base currency the chain made (or, while it holds inventory,
+        paid for it)."""
+        return self.received - self.spent
+
+    def as_dict(self):
+        d = dict((k, str(v) if isinstance(v, Decimal) else v) for k, v in self.__dict__.items())
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        totals = cls(d['chain'], d['market'])
+        for k, v in d.items():
+            setattr(totals, k, D(v) if isinstance(getattr(totals, k), Decimal) else v)
+        return totals
+
+    def __str__(self):
+        return "<ChainTotals {} {} live={} fills={} inventory={} cash={} fees={}/{}>".format(
+            self.market, self.chain, self.live, self.fills, self.inventory, self.cash,
+            self.quote_fees, self.base_fees)
+
+    __repr__ = __str__
+
+
+class FillLedger(object):
+
+    def __init__(self):
+        """Exact accounting of the fills of a GridTrader's orders.
+
+        Each live order has an OrderTally and each chain of orders a
+        ChainTotals, both updated once per fill, so that an order is known
+        to be done without adding its fills up again on every poll.
+        """
+
+        self.orders = dict() # orderNumber -> OrderTally of each order with fills
+        self.chains = dict() # chain -> ChainTotals
+        self.done = dict() # orderNumber -> chain of the orders done, until the chain settles
+
+    def chain_of(self, trade_id):
+        tally = self.orders.get(trade_id)
+        if tally is not None:
+            return tally.chain
+        return self.done.get(trade_id, trade_id)
+
+    def open(self, trade_id, market, direction, target, source=None):
+        """The OrderTally of TRADE_ID, an order in MARKET of TARGET amount
+        in DIRECTION, opening one if there is none. An order placed for fills
+        of order SOURCE belongs to the chain of SOURCE; any other starts
+        its own."""
+        tally = self.orders.get(trade_id)
+        if tally is None:
+            chain = self.chain_of(source if source is not None else trade_id)
+            tally = self.orders[trade_id] = OrderTally(direction, target, chain)
+            if chain not in self.chains:
+                self.chains[chain] = ChainTotals(chain, market)
+            self.chains[chain].live += 1
+        return tally
+
+    def add(self, trade_id, fill):
+        """Count FILL of TRADE_ID, whose tally is open. Returns its
+        FillAmounts, or None if it was counted before."""
+        tally = self.orders[trade_id]
+        a = tally.add(fill)
+        if a is not None:
+            self.chains[tally.chain].add(a)
+        return a
+
+    def close(self, trade_id):
+        """TRADE_ID is filled or cancelled."""
+        tally = self.orders.pop(trade_id, None)
+        if tally is None:
+            return
+        self.done[trade_id] = tally.chain
+        self.chains[tally.chain].live -= 1
+
+    def settle(self, pending=()):
+        """Remove and return the ChainTotals of the chains without live
+        orders left, but for those of orders in PENDING, whose fills wait
+        for a reciprocal."""
+        keep = set(self.chain_of(trade_id) for trade_id in pending)
+        settled = [c for c in self.chains.values() if c.live <= 0 and c.chain not in keep]
+        for totals in settled:
+            del self.chains[totals.chain]
+        chains = set(c.chain for c in settled)
+        for trade_id, chain in self.done.items():
+            if chain in chains:
+                del self.done[trade_id]
+        return settled
+
+    def as_dict(self):
+        return dict(
+            orders=[[t, tally.as_dict()] for t, tally in self.orders.items()],
+            chains=[c.as_dict() for c in self.chains.values()],
+            done=self.done.items())
+
+    def restore(self, d):
+        self.orders = dict((t, OrderTally.from_dict(tally)) for t, tally in d['orders'])
+        self.chains = dict((c['chain'], ChainTotals.from_dict(c)) for c in d['chains'])
+        self.done = dict((t, chain) for t, chain in d['done'])
+        return self
@@ -0,0 +1,101 @@
+# core
+import json
+import logging
+import math
+import os
+
+# local
+import exception
+from pricing import default_minimum_total, default_tick_size, pricing_option, to_step
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+default_lot_size = 0.00000001
+default_maker_fee = 0.0015
+
+
+class MarketMetadata(object):
+
+    def __init__(self, market, tick_size, lot_size, minimum_total):
+        """What the exchange accepts in one market.
+
+        - tick_size: price increment
+        - lot_size: amount increment
+        - minimum_total: smallest rate * amount
+        """
+
+        self.market = market
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+        self.minimum_total = minimum_total
+
+    def normalize(self, direction, rate, amount):
+        """RATE and AMOUNT of an order in DIRECTION as the exchange will
+        take them: the rate rounded to the tick away from the market, so
+        an order never trades at a worse rate than asked, and the amount
+        rounded down to the lot. Raises DustTrade, without calling the
+        exchange, for an order below the minimum total."""
+
+        rounding = math.ceil if direction == 'sell' else math.floor
+        rate = to_step(float(rate), self.tick_size, rounding)
+        amount = to_step(float(amount), self.lot_size, math.floor)
+        if rate * amount < self.minimum_total:
+            raise exception.DustTrade(
+                "{} {} of {:.8f} at {:.8f} is below the minimum total of {:.8f}".format(
+                    self.market, direction, amount, rate, self.minimum_total))
+        return rate, amount
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __str__(self):
+        return "<MarketMetadata {market} tick={tick_size:.8f} lot={lot_size:.8f} minimumTotal={minimum_total:.8f}>".format(**self.__dict__)
+
+    __repr__ = __str__
+
+
+class MarketMetadataCache(object):
+
+    def __init__(self, path):
+        """MarketMetadata of every market an account trades, written to
+        the json file PATH, for a look at what orders were normalized
+        with. The file is never read back: refresh() builds the metadata
+        anew each run. With no PATH it is kept in memory only.
+
+        Poloniex does not publish tick size, lot size or minimum total per
+        market, so those come from [pricing] (see config/0-ini-sample) or
+        its defaults. The fees charged are taken from each fill (see
+        ledger.py), so no fee tier is kept here.
+        """
+
+        self.path = path
+        self.markets = dict()
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        d = dict(markets=dict((k, m.as_dict()) for k, m in self.markets.items()))
+        with open(self.path + '.tmp', 'w') as fp:
+            json.dump(d, fp, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+    def refresh(self, config, markets):
+        """Metadata of MARKETS from CONFIG."""
+
+        tick_size = pricing_option(config, 'tickSize', default_tick_size)
+        lot_size = pricing_option(config, 'lotSize', default_lot_size)
+        minimum_total = pricing_option(config, 'minimumTotal', default_minimum_total)
+        for market in markets:
+            self.markets[market] = MarketMetadata(market, tick_size, lot_size, minimum_total)
+            logging.debug("Built %s", self.markets[market])
+
+        self.save()
+        return self
+
+    def get(self, market):
+        return self.markets[market]
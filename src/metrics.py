@@ -0,0 +1,194 @@
+# core
+from contextlib import contextmanager
+import json
+import logging
+import os
+import time
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+count_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def escape(v):
+    return str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def label_text(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(n, escape(v)) for n, v in pairs) + '}'
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = dict() # tuple of label values -> value
+
+    def key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self):
+        for key in sorted(self.values):
+            yield self.name, label_text(self.labelnames, key), self.values[key]
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        k = self.key(labels)
+        self.values[k] = self.values.get(k, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=latency_buckets):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        k = self.key(labels)
+        if k not in self.values:
+            self.values[k] = [[0] * len(self.buckets), 0.0, 0]
+        counts, total, n = self.values[k]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.values[k] = [counts, total + value, n + 1]
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        for key in sorted(self.values):
+            counts, total, n = self.values[key]
+            for bound, count in zip(self.buckets, counts):
+                yield (self.name + '_bucket',
+                       label_text(self.labelnames, key, [('le', repr(float(bound)))]), count)
+            yield self.name + '_bucket', label_text(self.labelnames, key, [('le', '+Inf')]), n
+            yield self.name + '_sum', label_text(self.labelnames, key), total
+            yield self.name + '_count', label_text(self.labelnames, key), n
+
+
+class Registry(object):
+
+    def __init__(self):
+        """Metrics of one trader. Each gridtrader.py run is a separate
+        process, so restore() picks up the totals of the previous runs
+        and save() writes them back along with the Prometheus text file a
+        local scraper (e.g. the node_exporter textfile collector) reads.
+        """
+
+        self.metrics = list()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=latency_buckets):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+    def restore(self, path):
+        state_file = path + '.json'
+        if not os.path.exists(state_file):
+            return
+        with open(state_file) as fp:
+            state = json.load(fp)
+        for m in self.metrics:
+            for key, value in state.get(m.name, []):
+                m.values[tuple(str(k) for k in key)] = value
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        state = dict((m.name, [[list(k), v] for k, v in m.values.items()]) for m in self.metrics)
+        for filename, text in ((path + '.json', json.dumps(state)), (path + '.prom', self.render())):
+            # The scraper must never see half a file.
+            with open(filename + '.tmp', 'w') as fp:
+                fp.write(text)
+            os.rename(filename + '.tmp', filename)
+
+        logging.debug("Metrics written to %s.prom", path)
+
+
+registry = Registry()
+
+api_calls = registry.counter(
+    'gridtrader_api_calls_total', "Exchange API calls", ('account', 'endpoint'))
+api_errors = registry.counter(
+    'gridtrader_api_errors_total', "Exchange API calls that raised", ('account', 'endpoint'))
+api_latency = registry.histogram(
+    'gridtrader_api_call_seconds', "Exchange API call latency", ('account', 'endpoint'))
+poll_seconds = registry.histogram(
+    'gridtrader_poll_seconds', "Time to poll one market", ('account', 'market'))
+poll_fills = registry.histogram(
+    'gridtrader_poll_fills', "New fills seen by one poll of one market",
+    ('account', 'market'), count_buckets)
+reciprocals = registry.counter(
+    'gridtrader_reciprocals_total', "Reciprocal orders placed or kept as dust",
+    ('account', 'market', 'direction', 'outcome'))
+fill_to_reciprocal = registry.histogram(
+    'gridtrader_fill_to_reciprocal_seconds',
+    "Time from the earliest fill of a reciprocal to placing it",
+    ('account', 'market', 'direction'))
+local_rejections = registry.counter(
+    'gridtrader_local_rejections_total',
+    "Orders below the minimum total, rejected without calling the exchange",
+    ('account', 'market', 'direction'))
+order_checks = registry.counter(
+    'gridtrader_order_checks_total',
+    "Orders whose fills were asked for (checked) or not (skipped) as the order book mirror says",
+    ('account', 'market', 'outcome'))
+grid_levels = registry.counter(
+    'gridtrader_grid_levels_total', "Grid levels purged, placed or cancelled by rolling",
+    ('account', 'market', 'direction', 'outcome'))
+store_seconds = registry.histogram(
+    'gridtrader_store_seconds', "Time to persist state", ('store',))
+store_bytes = registry.gauge(
+    'gridtrader_store_bytes', "Size of the persisted state", ('store',))
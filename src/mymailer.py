@@ -1,59 +1,352 @@
+# core
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+import fcntl
+import hashlib
+import json
 import logging
+import os
+import smtplib
+import threading
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 
-def _send_via_gmail(user, password, recipient, subject, body):
-    import smtplib
-
-    gmail_user = user
-    gmail_pwd = password
-    FROM = user
-    TO = recipient if type(recipient) is list else [recipient]
-    SUBJECT = subject
-    TEXT = body
-
-    # Prepare actual message
-    message = """From: %s\nTo: %s\nSubject: %s\n\n%s
-    """ % (FROM, ", ".join(TO), SUBJECT, TEXT)
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.ehlo()
-        server.starttls()
-        server.login(gmail_user, gmail_pwd)
-        server.sendmail(FROM, TO, message)
-        server.close()
-        logging.debug('successfully sent the mail')
-    except Exception as e:
-        logging.debug('failed to send mail %s', e)
-
-
-def send_via_email(account, body):
-    _send_via_gmail(
-        'terrence.brannon@gmail.com',
-        'serca972Yancey!',
-        'terrence.brannon@gmail.com',
-        '({}) ADSactly Grid Trader Error'.format(account),
-        body
-    )
-
-def send_email(grid_trader, error_msg):
-
-    # Import smtplib for the actual sending function
-    import smtplib
-
-    # Import the email modules we'll need
-    from email.mime.text import MIMEText
-
-    msg = MIMEText(error_msg)
-
-    # me == the sender's email address
-    # you == the recipient's email address
-    msg['Subject'] = '({}) Error has occured'.format(grid_trader.account)
-    msg['From'] = me = 'gridtrader@arbit.ca'
-    msg['To'] = you = grid_trader.config.get('admin', 'email')
-
-    # Send the message via our own SMTP server, but don't include the
-    # envelope header.
-    s = smtplib.SMTP(grid_trader.config.get('admin', 'smtpServer'))
-    s.sendmail(me, [you], msg.as_string())
-    s.quit()
+
+severities = ('critical', 'error', 'warning', 'info')
+
+
+class Notification(object):
+
+    def __init__(self, account, severity, subject, body, recipients):
+        self.account = account
+        self.severity = severity
+        self.subject = subject
+        self.body = body
+        self.recipients = tuple(recipients)
+        self.created = time.time()
+        self.count = 1 # how many duplicates this one stands for
+
+    repeats_of = None # fingerprint of the notification sent before this repeats
+
+    @classmethod
+    def repeat(cls, fingerprint, seen):
+        """What stands in a digest for the repeats of the notification of
+        FINGERPRINT sent before, whose details SEEN the outbox kept."""
+        n = cls(seen['account'], seen['severity'], seen['subject'] + ' (repeated)',
+                "Seen {} more times since it was sent.".format(seen['repeats']),
+                seen['recipients'])
+        n.count = seen['repeats']
+        n.repeats_of = fingerprint
+        return n
+
+    def as_dict(self):
+        return dict(account=self.account, severity=self.severity, subject=self.subject,
+                    body=self.body, recipients=list(self.recipients), created=self.created,
+                    count=self.count, fingerprint=self.fingerprint)
+
+    @classmethod
+    def from_dict(cls, d):
+        n = cls(d['account'], d['severity'], d['subject'], d['body'], d['recipients'])
+        n.created, n.count = d['created'], d['count']
+        return n
+
+    @property
+    def fingerprint(self):
+        """Tracebacks of the same error differ in little but their last
+        line, so that is what duplicates are recognized by."""
+        lines = [l for l in self.body.splitlines() if l.strip()]
+        last = lines[-1] if lines else ''
+        return hashlib.sha1("{}|{}|{}|{}".format(
+            self.account, self.severity, self.subject, last)).hexdigest()
+
+    def __str__(self):
+        return "<Notification {} {} {!r} x{}>".format(
+            self.account, self.severity, self.subject, self.count)
+
+    __repr__ = __str__
+
+
+class SMTPConnection(object):
+
+    def __init__(self, server, port=25, tls=False, user=None, password=None, timeout=30):
+        """One SMTP session, opened on first use and reused for every
+        message after that. Reconnects once if the server hung up."""
+
+        self.server, self.port, self.tls = server, port, tls
+        self.user, self.password = user, password
+        self.timeout = timeout
+        self.smtp = None
+
+    def connect(self):
+        logging.debug("Connecting to SMTP server %s:%d", self.server, self.port)
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        if self.tls:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+        if self.user:
+            smtp.login(self.user, self.password)
+        self.smtp = smtp
+
+    def send(self, sender, recipients, message):
+        for attempt in (1, 2):
+            if self.smtp is None:
+                self.connect()
+            try:
+                self.smtp.sendmail(sender, list(recipients), message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self.smtp = None
+
+
+def outbox_file_name():
+    return "persistence/outbox.json"
+
+
+class Outbox(object):
+
+    def __init__(self, path):
+        """Notifications waiting to be sent, kept in PATH for every process
+        of the installation: each gridtrader.py run is a process of its
+        own, so deduplication, digests and the rate limit only hold across
+        runs and accounts if what they go by outlives a run.
+
+        Adding a notification is a short write under a file lock. Sending
+        is deliver()'s job, normally from the long-running batch/run.py
+        (see Courier), never from the trading critical path.
+        """
+
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        """The outbox state, saved again when the block is done. Other
+        processes wait meanwhile, so keep the block short."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = dict(pending=[], seen=dict(), sent=[], last_digest=0)
+            if os.path.exists(self.path):
+                with open(self.path) as fp:
+                    try:
+                        state = json.load(fp)
+                    except ValueError:
+                        logging.debug("Starting %s afresh", self.path)
+            yield state
+            with open(self.path + '.tmp', 'w') as fp:
+                json.dump(state, fp)
+            os.rename(self.path + '.tmp', self.path)
+
+    def add(self, notification, dedup_window=600):
+        """Queue NOTIFICATION, unless it repeats one seen less than
+        DEDUP_WINDOW seconds ago: a repeat is counted, in the notification
+        while it waits and otherwise in the next digest."""
+        now = time.time()
+        fingerprint = notification.fingerprint
+        with self.locked() as state:
+            for f, seen in state['seen'].items():
+                if not seen['pending'] and not seen['repeats'] and now - seen['time'] >= dedup_window:
+                    del state['seen'][f]
+
+            seen = state['seen'].get(fingerprint)
+            if seen is None:
+                state['seen'][fingerprint] = dict(
+                    time=now, pending=True, repeats=0, account=notification.account,
+                    severity=notification.severity, subject=notification.subject,
+                    recipients=list(notification.recipients))
+                state['pending'].append(notification.as_dict())
+            elif seen['pending']:
+                for n in state['pending']:
+                    if n['fingerprint'] == fingerprint:
+                        n['count'] += 1
+                logging.debug("Counted duplicate of %s", notification)
+            else:
+                seen['repeats'] += 1
+                logging.debug("Counted repeat of %s, sent before", notification)
+
+    def deliver(self, connection, sender, digest_interval=60, max_per_hour=20):
+        """Send what is queued through CONNECTION, an SMTPConnection, as
+        one digest per set of recipients, if the last digest went out at
+        least DIGEST_INTERVAL seconds ago and fewer than MAX_PER_HOUR
+        messages went out in the last hour. Returns the number of messages
+        sent. What cannot be sent goes back in the queue."""
+        now = time.time()
+        with self.locked() as state:
+            state['sent'] = [t for t in state['sent'] if now - t < 3600]
+            repeats = [(f, seen) for f, seen in state['seen'].items() if seen['repeats']]
+            if not state['pending'] and not repeats:
+                return 0
+            if now - state['last_digest'] < digest_interval or len(state['sent']) >= max_per_hour:
+                return 0
+
+            notifications = [Notification.from_dict(n) for n in state['pending']]
+            state['pending'] = list()
+            for n in notifications:
+                state['seen'][n.fingerprint]['pending'] = False
+            for f, seen in repeats:
+                notifications.append(Notification.repeat(f, seen))
+                seen['repeats'] = 0
+            by_recipients = dict()
+            for n in notifications:
+                by_recipients.setdefault(n.recipients, []).append(n)
+            state['last_digest'] = now
+            state['sent'].extend([now] * len(by_recipients))
+
+        # Sent with the outbox unlocked, so adding never waits on SMTP.
+        sent = 0
+        for recipients, notifications in by_recipients.items():
+            msg = digest(notifications)
+            msg['From'] = sender
+            msg['To'] = ", ".join(recipients)
+            try:
+                connection.send(sender, recipients, msg.as_string())
+                sent += 1
+                logging.debug('successfully sent %s', notifications)
+            except Exception as e:
+                logging.debug('failed to send %s: %s', notifications, e)
+                self.requeue(notifications)
+        return sent
+
+    def requeue(self, notifications):
+        with self.locked() as state:
+            for n in notifications:
+                seen = state['seen'].setdefault(n.repeats_of or n.fingerprint, dict(
+                    time=n.created, pending=False, repeats=0, account=n.account,
+                    severity=n.severity, subject=n.subject, recipients=list(n.recipients)))
+                if n.repeats_of:
+                    seen['repeats'] += n.count
+                elif seen['pending']:
+                    for p in state['pending']:
+                        if p['fingerprint'] == n.fingerprint:
+                            p['count'] += n.count
+                else:
+                    seen['pending'] = True
+                    state['pending'].append(n.as_dict())
+
+
+class Courier(object):
+
+    def __init__(self, config, outbox=None, interval=10):
+        """Delivers the outbox every INTERVAL seconds from a background
+        thread, with the [admin] settings of CONFIG and one SMTP session
+        for as long as the server keeps it open. Runs in the long-running
+        batch/run.py, whose loop it never holds up."""
+
+        self.config = config
+        self.outbox = outbox or Outbox(outbox_file_name())
+        self.interval = interval
+        self.connection = smtp_connection(config)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def deliver(self):
+        try:
+            return self.outbox.deliver(
+                self.connection, sender(self.config),
+                digest_interval=admin_option(self.config, 'digestInterval', 60, 'getfloat'),
+                max_per_hour=admin_option(self.config, 'maxEmailsPerHour', 20, 'getint'))
+        except Exception as e:
+            logging.debug("Could not deliver the outbox: %s", e)
+            return 0
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.deliver()
+        self.connection.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='courier')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop once a delivery under way is done."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def digest(notifications):
+    if len(notifications) == 1:
+        n = notifications[0]
+        subject = n.subject
+        body = n.body
+        if n.count > 1 and not n.repeats_of:
+            body = "(seen {} times)\n\n{}".format(n.count, body)
+    else:
+        accounts = sorted(set(n.account for n in notifications))
+        subject = '({}) {} notifications'.format(",".join(accounts), len(notifications))
+        parts = list()
+        for n in sorted(notifications, key=lambda n: severities.index(n.severity)):
+            parts.append("[{}] {} (seen {} times)\n\n{}".format(
+                n.severity.upper(), n.subject, n.count, n.body))
+        body = ("\n\n" + "-" * 72 + "\n\n").join(parts)
+
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    return msg
+
+
+def admin_option(config, option, default=None, get='get'):
+    if config.has_option('admin', option):
+        return getattr(config, get)('admin', option)
+    return default
+
+
+def recipients(config, severity):
+    """The addresses in [admin] ${severity}Email, or in [admin] email when
+    there is no address for that severity."""
+    addresses = admin_option(config, severity + 'Email') or config.get('admin', 'email')
+    return [a.strip() for a in addresses.split(',') if a.strip()]
+
+
+def sender(config):
+    return admin_option(config, 'sender', 'gridtrader@arbit.ca')
+
+
+def smtp_connection(config):
+    """An SMTPConnection to the server in the [admin] section of CONFIG."""
+    return SMTPConnection(
+        config.get('admin', 'smtpServer'),
+        admin_option(config, 'smtpPort', 25, 'getint'),
+        admin_option(config, 'smtpTls', False, 'getboolean'),
+        admin_option(config, 'smtpUser'),
+        admin_option(config, 'smtpPassword'))
+
+
+def notify(config, account, severity, subject, body, outbox=None):
+    """Queue a notification, routed by the [admin] section of CONFIG, in
+    OUTBOX (default: the installation's) and return at once."""
+    n = Notification(account, severity, subject, body, recipients(config, severity))
+    (outbox or Outbox(outbox_file_name())).add(
+        n, admin_option(config, 'dedupWindow', 600, 'getfloat'))
+    return n
+
+
+def send_email(grid_trader, error_msg, severity='critical'):
+    return notify(grid_trader.config, grid_trader.account, severity,
+                  '({}) Error has occured'.format(grid_trader.account), error_msg)
+
+
+def deliver(config, outbox=None):
+    """Send what is due in OUTBOX (default: the installation's) with the
+    [admin] settings of CONFIG, in this thread. For processes that run
+    no Courier: a gridtrader.py run on its own, a one-off batch/run.py."""
+    courier = Courier(config, outbox)
+    sent = courier.deliver()
+    courier.connection.close()
+    return sent
@@ -14,3 +14,8 @@ def F(n):
 def CF(config, config_section, config_parm):
     return F(config.getfloat(config_section, config_parm))
 
+
+# A value read back from a stored state, kept as exact as the float it
+# was stored as rather than rounded again to the precision of F.
+def RF(n):
+    return Float(n, precision=53)
@@ -0,0 +1,160 @@
+# core
+import logging
+import time
+
+# local
+from aggregation import fill_time
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+default_margin = 0.1 # percent
+default_full_check_every = 10
+# Most trades the public trade history returns at once. A refresh that
+# gets this many may have missed some of the range it asked for.
+public_trades_limit = 1000
+
+
+class MarketMirror(object):
+
+    def __init__(self, market):
+        """The public trade tape and order book of one market, as far as
+        a poll needs them: the range of rates traded, or quoted at the
+        top of the book, since the previous refresh."""
+
+        self.market = market
+        self.last_time = None # time of the latest trade seen
+        self.seen = set() # tradeIDs at last_time, which the next refresh sees again
+        self.low = None
+        self.high = None
+        self.bids = list() # [rate, amount], best first
+        self.asks = list()
+        self.refreshes = 0
+        self.synced = False
+
+    def refresh(self, exchange, depth, full_check_every):
+        self.refreshes += 1
+        self.low = self.high = None
+        start = self.last_time
+        # Recorded and replayed along with the calls (see recorder.py).
+        clock = getattr(exchange, 'clock', time.time)
+
+        try:
+            # Back one second, to be sure of the trades of that second.
+            trades = exchange.publicTrades(self.market, start=(start or clock()) - 1)
+            if depth:
+                book = exchange.orderBook(self.market, depth)
+                self.bids, self.asks = book['bids'], book['asks']
+        except Exception as e:
+            logging.debug("Order book mirror of %s lost sync: %s", self.market, e)
+            self.synced = False
+            return self
+
+        rates = list()
+        latest = start
+        for t in trades:
+            t_time = fill_time(t)
+            if start is not None and (t_time < start or t['tradeID'] in self.seen):
+                continue
+            rates.append(float(t['rate']))
+            latest = max(latest, t_time)
+        self.seen = set(t['tradeID'] for t in trades if fill_time(t) == latest)
+        # The tape has whole seconds.
+        self.last_time = latest or int(clock())
+
+        if self.bids:
+            rates.append(float(self.bids[0][0]))
+        if self.asks:
+            rates.append(float(self.asks[0][0]))
+        if rates:
+            self.low, self.high = min(rates), max(rates)
+
+        # The first refresh has nothing to compare with, and every
+        # FULL_CHECK_EVERY refreshes all orders are confirmed anyway.
+        self.synced = start is not None and self.refreshes % full_check_every != 0
+        if len(trades) >= public_trades_limit:
+            logging.debug("Mirror of %s got %d trades, the most there are at once: "
+                          "some may be missing", self.market, len(trades))
+            self.synced = False
+        logging.debug("Mirror of %s: %d trades between %s and %s, synced=%s",
+                      self.market, len(rates), self.low, self.high, self.synced)
+        return self
+
+    def as_dict(self):
+        d = dict(self.__dict__)
+        d['seen'] = sorted(self.seen)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        mirror = cls(d['market'])
+        mirror.__dict__.update(d)
+        mirror.seen = set(d['seen'])
+        return mirror
+
+    def touched(self, direction, rate, margin):
+        """Whether an order in DIRECTION at RATE may have filled since the
+        previous refresh. Always True when the mirror is not in sync."""
+        if not self.synced:
+            return True
+        if self.low is None:
+            return False
+        rate = float(rate)
+        if direction == 'sell':
+            return self.high >= rate * (1 - margin / 100)
+        return self.low <= rate * (1 + margin / 100)
+
+
+class OrderBookMirror(object):
+
+    def __init__(self, margin=default_margin, depth=0, full_check_every=default_full_check_every):
+        """Mirrors of the markets a GridTrader polls. Only orders a mirror
+        says were touched, within MARGIN percent, have their fills asked
+        for through the private API. DEPTH levels of the order book are
+        mirrored besides the tape (0: tape only)."""
+
+        self.margin = margin
+        self.depth = depth
+        self.full_check_every = full_check_every
+        self.markets = dict()
+
+    def adopt(self, previous):
+        """Carry on from PREVIOUS, the mirror before the settings changed."""
+        if previous is not None:
+            self.markets = previous.markets
+        return self
+
+    def as_dict(self):
+        return [m.as_dict() for m in self.markets.values()]
+
+    def restore(self, markets):
+        self.markets = dict((m['market'], MarketMirror.from_dict(m)) for m in markets)
+        return self
+
+    def refresh(self, exchange, market):
+        mirror = self.markets.setdefault(market, MarketMirror(market))
+        return mirror.refresh(exchange, self.depth, self.full_check_every)
+
+    def touched(self, market, direction, rate):
+        mirror = self.markets.get(market)
+        if mirror is None:
+            return True
+        return mirror.touched(direction, rate, self.margin)
+
+
+def order_book_mirror(config):
+    """The OrderBookMirror the optional [orderbook] section asks for, or
+    None."""
+    if not (config.has_option('orderbook', 'enabled') and config.getboolean('orderbook', 'enabled')):
+        return None
+
+    def option(name, get, default):
+        if config.has_option('orderbook', name):
+            return get('orderbook', name)
+        return default
+
+    return OrderBookMirror(
+        margin=option('marginPercent', config.getfloat, default_margin),
+        depth=option('depth', config.getint, 0),
+        full_check_every=option('fullCheckEvery', config.getint, default_full_check_every))
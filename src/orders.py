@@ -0,0 +1,159 @@
+# core
+import json
+import logging
+import os
+import time
+import uuid
+
+# local
+import exception
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# The lifecycle of every order this program places.
+INTENT = 'intent'
+SUBMITTED = 'submitted'
+ACKNOWLEDGED = 'acknowledged'
+PARTIALLY_FILLED = 'partially filled'
+FILLED = 'filled'
+CANCELLED = 'cancelled'
+
+transitions = {
+    INTENT: (SUBMITTED, CANCELLED),
+    SUBMITTED: (ACKNOWLEDGED, CANCELLED),
+    ACKNOWLEDGED: (PARTIALLY_FILLED, FILLED, CANCELLED),
+    PARTIALLY_FILLED: (PARTIALLY_FILLED, FILLED, CANCELLED),
+    FILLED: (),
+    CANCELLED: (),
+}
+
+terminal = (FILLED, CANCELLED)
+
+
+class OrderRecord(object):
+
+    def __init__(self, market, direction, rate, amount, slot,
+                 intent_id=None, state=INTENT, order_number=None, created=None):
+        """One order from the moment we decide to place it.
+
+        - market: something like BTC_STRAT
+        - direction: buy or sell
+        - rate, amount: what is sent to the exchange
+        - slot: dict saying where the order lives in a GridTrader, so that
+          reconciliation can put it back there. kind is 'grid' (with
+          market, direction and level) or 'reciprocal' (with market,
+          direction, reciprocant_trade_id, rate_of_closed_trade and
+          size_of_closed_trade).
+        """
+
+        self.intent_id = intent_id or uuid.uuid4().hex
+        self.market = market
+        self.direction = direction
+        self.rate = float(rate)
+        self.amount = float(amount)
+        self.slot = slot
+        self.state = state
+        self.order_number = order_number
+        self.created = created or time.time()
+
+    def advance(self, state):
+        if state not in transitions[self.state]:
+            raise exception.InvalidOrderTransition(
+                "Order {} cannot go from {} to {}".format(
+                    self.order_number or self.intent_id, self.state, state))
+        self.state = state
+        return self
+
+    def as_dict(self):
+        return dict(
+            intent_id=self.intent_id, market=self.market,
+            direction=self.direction, rate=self.rate, amount=self.amount,
+            slot=self.slot, state=self.state, order_number=self.order_number,
+            created=self.created
+        )
+
+    def __str__(self):
+        return "<OrderRecord {} {} {} {:.8f}@{:.8f} order={} state={}>".format(
+            self.intent_id, self.market, self.direction, self.amount,
+            self.rate, self.order_number, self.state)
+
+    __repr__ = __str__
+
+
+class OrderJournal(object):
+
+    def __init__(self, journal_file):
+        """Write-ahead log of order submissions. Every intent is on disk
+        before the exchange is called and every answer is on disk before
+        the caller carries on, so that a GridTrader which dies before it
+        is persisted can be reconciled on the next run.
+
+        The journal only has to cover what happened since the GridTrader
+        was last persisted, so checkpoint() empties it after every store.
+        With no JOURNAL_FILE records are kept nowhere.
+        """
+
+        self.journal_file = journal_file
+
+    def _append(self, record):
+        if not self.journal_file:
+            return
+        with open(self.journal_file, 'a') as fp:
+            fp.write(json.dumps(record.as_dict()) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def intent(self, market, direction, rate, amount, slot):
+        record = OrderRecord(market, direction, rate, amount, slot)
+        self._append(record)
+        logging.debug("Journaled %s", record)
+        return record
+
+    def adopt(self, market, direction, rate, amount, slot, order_number):
+        """Journal ORDER_NUMBER, an order already open on the exchange, as
+        acknowledged for SLOT."""
+        record = OrderRecord(market, direction, rate, amount, slot,
+                             state=ACKNOWLEDGED, order_number=order_number)
+        self._append(record)
+        logging.debug("Journaled %s", record)
+        return record
+
+    def transition(self, record, state, order_number=None):
+        record.advance(state)
+        if order_number is not None:
+            record.order_number = order_number
+        self._append(record)
+        logging.debug("Journaled %s", record)
+        return record
+
+    def records(self):
+        """The latest journaled version of every order, oldest first."""
+
+        if not self.journal_file or not os.path.exists(self.journal_file):
+            return []
+
+        latest = dict()
+        order = list()
+        with open(self.journal_file) as fp:
+            for line in fp:
+                try:
+                    d = json.loads(line)
+                except ValueError:
+                    # A crash mid-write leaves a torn last line.
+                    logging.debug("Skipping torn journal line %r", line)
+                    continue
+                if d['intent_id'] not in latest:
+                    order.append(d['intent_id'])
+                latest[d['intent_id']] = OrderRecord(**d)
+
+        return [latest[intent_id] for intent_id in order]
+
+    def checkpoint(self):
+        if not self.journal_file:
+            return
+        logging.debug("Checkpointing order journal %s", self.journal_file)
+        with open(self.journal_file, 'w') as fp:
+            fp.flush()
+            os.fsync(fp.fileno())
@@ -1,4 +1,5 @@
 # core
+import json
 import logging
 import os
 
@@ -6,25 +7,156 @@ import os
 # 3rd party
 import dill
 
+# local
+import exception
+import ledger
+import metrics
+
 logging.basicConfig(level=logging.DEBUG)
 
 
+# Version of the state layout Persist writes. Bump it whenever the
+# as_dict() of a persisted object changes in a way older code or older
+# files cannot take, and register a migration from the previous version.
+schema_version = 2
+
+# version -> function taking a state of that version to the next one
+migrations = dict()
+
+
+def migration(version):
+    """Register the decorated function as the migration of states of
+    VERSION to VERSION + 1."""
+    def register(f):
+        migrations[version] = f
+        return f
+    return register
+
+
+def baseline_grid(grid, direction):
+    """Schema 1 of GRID, a SellGrid or BuyGrid as pickled by versions
+    before the schema. Those looked majorLevel, numberOfOrders,
+    increments and size up in the grid's config on every use, so they
+    are resolved here the way Grid.resolve_config() does."""
+    config = grid.config
+    section = "{0}grid".format(direction)
+    number_of_orders = config.getint(section, 'numberOfOrders')
+    initial_core_position = float(grid.initial_core_position)
+    rates = [float(rate) for rate in grid.grid]
+    return dict(
+        direction=direction, quote=grid.quote, pair=grid.pair,
+        current_market_price=float(grid.current_market_price),
+        initial_core_position=initial_core_position,
+        majorLevel=config.getfloat(section, 'majorLevel'),
+        numberOfOrders=number_of_orders,
+        increments=config.getfloat(section, 'increments') / 100.0,
+        size=config.getfloat(section, 'size') / 100.0 * initial_core_position / number_of_orders,
+        grid=rates,
+        far_end=float(grid.__dict__.get('far_end', rates[-1] if rates else 0)),
+        trade_ids=list(grid.trade_ids), trade_ids_filled=list(grid.trade_ids_filled))
+
+
+def baseline_reciprocal(r, direction):
+    """Schema 1 of R, a ReciprocalTrade in DIRECTION as pickled by versions
+    before the schema, which also held the exchange, config and grids."""
+    return dict(
+        direction=direction, reciprocant_trade_id=r.reciprocant_trade_id, market=r.market,
+        rate_of_closed_trade=float(r.rate_of_closed_trade),
+        size_of_closed_trade=float(r.size_of_closed_trade),
+        trade_id=r.trade_id)
+
+
+@migration(0)
+def from_pickle(o):
+    """Version 0 is a GridTrader dill pickled before the state had a
+    schema. Only its attributes are read, not its methods: classes of a
+    script are pickled with it, so O may be an instance of the classes of
+    the version that pickled it. Those kept no order records, fill
+    batches or mirror."""
+    a = o.__dict__
+    reciprocal = dict()
+    for m, directions in a['reciprocal'].items():
+        reciprocal[m] = dict((direction, [baseline_reciprocal(r, direction) for r in rs.values()])
+                             for direction, rs in directions.items())
+    dust = [baseline_reciprocal(r, 'buy' if type(r).__name__ == 'ReciprocalBuy' else 'sell')
+            for r in a.get('reciprocal_dust', ())]
+    return dict(
+        account=a['account'], base=a['base'],
+        market=dict((m, dict((k, float(v)) for k, v in r.items())) for m, r in a['market'].items()),
+        grids=dict((m, dict((direction, baseline_grid(g, direction)) for direction, g in grids.items()))
+                   for m, grids in a['grids'].items()),
+        reciprocal=reciprocal,
+        reciprocal_dust=dust,
+        orders=[],
+        aggregator=dict(batches=[], consumed=[], completed=[]),
+        dust_batches=[],
+        mirror=None)
+
+
+@migration(1)
+def exact_fills(state):
+    """Schema 2 keeps exact fill totals per order and chain (ledger.py),
+    and fill batches count what their fills traded apart from what their
+    reciprocal trades, net of fees. Batches of schema 1 traded what their
+    fills did."""
+    batches = [b for k, b in state['aggregator']['batches']] + state['dust_batches']
+    for b in batches:
+        b['filled'] = b['amount']
+        for k in 'amount filled total'.split():
+            b[k] = str(ledger.D(b[k]))
+    state['ledger'] = dict(orders=[], chains=[], done=[])
+    return state
+
+
+def migrate(version, state):
+    """STATE, of schema VERSION, brought to the current schema."""
+    if version > schema_version:
+        raise exception.UnknownStateSchema(
+            "State of schema {} is newer than this code, which knows up to {}".format(
+                version, schema_version))
+    while version < schema_version:
+        logging.debug("Migrating state from schema %d", version)
+        state = migrations[version](state)
+        version += 1
+    return state
+
 
 class Persist(object):
 
     def __init__(self, dbfile):
+        """The state of one object in DBFILE, as json with the version of
+        its schema, so that the object can be rebuilt by code of the same
+        or a later schema without starting over."""
         self.dbfile = dbfile
 
     def retrieve(self):
+        """The stored state, migrated to the current schema. Rebuild the
+        object from it (e.g. GridTrader.from_dict())."""
         with open(self.dbfile, 'rb') as fp:
-            o = dill.load(fp)
+            data = fp.read()
+
+        try:
+            d = json.loads(data)
+        except ValueError:
+            d = dict(schema=0, state=dill.loads(data))
 
-        logging.debug("<Retrieved Object>{0}</Retrieved>".format(o))
+        state = migrate(d['schema'], d['state'])
+        logging.debug("<Retrieved schema=%s>%s</Retrieved>", d['schema'], self.dbfile)
 
-        return o
+        return state
 
     def store(self, o):
-        with open(self.dbfile, 'wb') as fp:
-            dill.dump(o, fp)
+        """Store the state O.as_dict() gives."""
+        # Write aside and rename over, so a crash mid-dump leaves the
+        # previous state intact.
+        store = os.path.basename(self.dbfile)
+        tmpfile = self.dbfile + '.tmp'
+        with metrics.store_seconds.time(store=store):
+            with open(tmpfile, 'wb') as fp:
+                json.dump(dict(schema=schema_version, state=o.as_dict()), fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.rename(tmpfile, self.dbfile)
+        metrics.store_bytes.set(os.path.getsize(self.dbfile), store=store)
 
         logging.debug("<STORE>{0}</STORE>".format(o))
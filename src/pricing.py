@@ -0,0 +1,90 @@
+# core
+import logging
+import math
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Poloniex quotes BTC markets to 8 decimal places and refuses any order
+# whose total is below 0.0001 BTC ("Total must be at least 0.0001.")
+default_tick_size = 0.00000001
+default_minimum_total = 0.0001
+
+
+def pricing_option(config, option, default):
+    if config.has_option('pricing', option):
+        return config.getfloat('pricing', option)
+    return default
+
+
+def to_step(value, step, rounding):
+    """VALUE rounded to a multiple of STEP by ROUNDING (math.ceil or
+    math.floor), ignoring float noise well below one step."""
+    return rounding(round(value / step, 6)) * step
+
+
+class PricingTable(object):
+
+    def __init__(self, market, direction, major_level, tick_size, minimum_total):
+        """Everything needed to price a reciprocal order in one market and
+        one direction, resolved once when the grids are built.
+
+        - market: something like BTC_STRAT
+        - direction: buy or sell, the direction of the reciprocal order
+        - major_level: percent away from the rate of the closed trade
+        - tick_size: price increment the exchange accepts
+        - minimum_total: smallest rate * amount the exchange accepts
+        """
+
+        self.market = market
+        self.direction = direction
+        self.tick_size = tick_size
+        self.minimum_total = minimum_total
+
+        sign = 1.0 if direction == 'sell' else -1.0
+        self.multiplier = 1.0 + sign * major_level / 100.0
+
+        # Round away from the closed trade so a reciprocal never earns
+        # less than its major level.
+        self._round = math.ceil if direction == 'sell' else math.floor
+
+    def rate(self, rate_of_closed_trade):
+        return to_step(rate_of_closed_trade * self.multiplier, self.tick_size, self._round)
+
+    def is_dust(self, rate, amount):
+        return rate * amount < self.minimum_total
+
+    def __str__(self):
+        return "<PricingTable {} {} multiplier={:.8f} tick={:.8f} minimumTotal={:.8f}>".format(
+            self.market, self.direction, self.multiplier,
+            self.tick_size, self.minimum_total)
+
+    __repr__ = __str__
+
+
+def build_pricing_tables(config, markets, metadata=None):
+    """Return dict of form pricing[market][direction] for the reciprocal
+    orders of each market in MARKETS. Tick size and minimum total come
+    from METADATA, a markets.MarketMetadataCache, when given.
+    """
+
+    tick_size = pricing_option(config, 'tickSize', default_tick_size)
+    minimum_total = pricing_option(config, 'minimumTotal', default_minimum_total)
+
+    tables = dict()
+    for market in markets:
+        if metadata is not None:
+            tick_size = metadata.get(market).tick_size
+            minimum_total = metadata.get(market).minimum_total
+        tables[market] = dict()
+        for direction, section in (('sell', 'ReciprocalSell'), ('buy', 'ReciprocalBuy')):
+            tables[market][direction] = PricingTable(
+                market, direction,
+                major_level=config.getfloat(section, 'majorLevel'),
+                tick_size=tick_size,
+                minimum_total=minimum_total
+            )
+            logging.debug("Built %s", tables[market][direction])
+
+    return tables
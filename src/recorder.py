@@ -0,0 +1,195 @@
+# core
+import gzip
+import json
+import logging
+import os
+import time
+
+# local
+import exception
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# RecordingAPI objects not yet flushed; see flush()
+recorders = list()
+
+# The endpoint clock reads are recorded as
+CLOCK = 'clock'
+
+
+def plain(v):
+    """V as something json can write: DotMaps become dicts and numbers
+    json does not know, such as sympy's, become strings."""
+    if isinstance(v, dict):
+        return dict((str(k), plain(x)) for k, x in v.items())
+    if isinstance(v, (list, tuple)):
+        return [plain(x) for x in v]
+    if v is None or isinstance(v, (bool, int, long, float, basestring)):
+        return v
+    return str(v)
+
+
+class RecordingAPI(object):
+
+    def __init__(self, api, log_file, flush_every=100):
+        """Wraps an exchange API object, writing every call made through
+        it, with its result or error and when it was made, to LOG_FILE,
+        gzipped json lines. Calls are buffered and appended as one gzip
+        member every FLUSH_EVERY calls and by flush().
+
+        What asks the exchange for something since a time reads that
+        time from clock(), which is recorded too, so that a replay asks
+        for the same."""
+
+        self.api = api
+        self.log_file = log_file
+        self.flush_every = flush_every
+        self.buffer = list()
+        recorders.append(self)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'api' not in self.__dict__:
+            raise AttributeError(name)
+
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            r = dict(time=time.time(), endpoint=name, args=plain(args), kwargs=plain(kwargs))
+            try:
+                result = attr(*args, **kwargs)
+                r['result'] = plain(result)
+                return result
+            except Exception as e:
+                r['error'] = [type(e).__name__, str(e)]
+                raise
+            finally:
+                r['seconds'] = time.time() - r['time']
+                self.append(r)
+
+        return call
+
+    def clock(self):
+        """time.time(), recorded for ReplayAPI.clock() to give again."""
+        now = time.time()
+        self.append(dict(time=now, endpoint=CLOCK, args=[], kwargs={}, result=now, seconds=0.0))
+        return now
+
+    def append(self, r):
+        self.buffer.append(r)
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        directory = os.path.dirname(self.log_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Taken before writing, so calls made meanwhile from other threads
+        # wait for the next flush.
+        buffer, self.buffer = self.buffer, list()
+        with gzip.open(self.log_file, 'ab') as fp:
+            for r in buffer:
+                fp.write(json.dumps(r) + "\n")
+        logging.debug("Recorded %d calls in %s", len(buffer), self.log_file)
+
+
+def flush():
+    """Write what every recorder has buffered."""
+    for r in recorders:
+        if r.log_file:
+            r.flush()
+
+
+def read_log(log_file):
+    records = list()
+    with gzip.open(log_file, 'rb') as fp:
+        for line in fp:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+class ReplayAPI(object):
+
+    def __init__(self, log_file, speed=1.0, wrapper=None):
+        """Answers exchange API calls from a log written by RecordingAPI.
+
+        A call gets the result of the first call in the log not yet
+        replayed with the same endpoint and arguments. A call the log
+        has no answer for raises exception.ReplayMismatch, or
+        exception.ReplayExhausted once every call to its endpoint has
+        been replayed: a trader that has come to place other orders than
+        were recorded gets no answer meant for another call. A recorded
+        error is raised again as exception.ReplayedError.
+
+        With SPEED 1 each call waits until as long after the first call as
+        it was made when recorded; 2 replays twice as fast and 0 does not
+        wait at all. WRAPPER is applied to every result, as the exchange
+        library applies it to what the exchange sends. clock() gives the
+        times the recorded run read, in the same order.
+        """
+
+        self.log_file = log_file
+        self.speed = speed
+        self.wrapper = wrapper
+        self.records = read_log(log_file)
+        self.replayed = [False] * len(self.records)
+        self.started = None
+
+    def find(self, endpoint, args, kwargs):
+        expected = None
+        for i, r in enumerate(self.records):
+            if self.replayed[i] or r['endpoint'] != endpoint:
+                continue
+            if r['args'] == args and r['kwargs'] == kwargs:
+                return i
+            if expected is None:
+                expected = r
+        if expected is None:
+            raise exception.ReplayExhausted(
+                "No {} call left to replay in {}".format(endpoint, self.log_file))
+        raise exception.ReplayMismatch(
+            "{} with {} {} was not recorded in {}; the next {} call recorded had {} {}".format(
+                endpoint, args, kwargs, self.log_file, endpoint,
+                expected['args'], expected['kwargs']))
+
+    def clock(self):
+        """The time the recorded run read at this point (see
+        RecordingAPI.clock())."""
+        i = self.find(CLOCK, [], {})
+        self.replayed[i] = True
+        return self.records[i]['result']
+
+    def wait(self, r):
+        if self.started is None:
+            self.started = (time.time(), self.records[0]['time'])
+        if not self.speed:
+            return
+        now, first = self.started
+        delay = (r['time'] - first) / self.speed - (time.time() - now)
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'records' not in self.__dict__:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            i = self.find(name, plain(args), plain(kwargs))
+            self.replayed[i] = True
+            r = self.records[i]
+            self.wait(r)
+            if 'error' in r:
+                raise exception.ReplayedError(*r['error'])
+            if self.wrapper:
+                return self.wrapper(r['result'])
+            return r['result']
+
+        return call
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# core
+from collections import deque
+import csv
+import gzip
+import json
+import logging
+import os
+import pickle
+import StringIO
+import sys
+import time
+import zlib
+
+# 3rd party
+from argh import dispatch_command, arg
+from tabulate import tabulate
+
+# local
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch'))
+import archive
+from filenames import history_dir_name
+from run import Batch
+from settings import load_settings
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Records remembered to count one archived twice once; a record is
+# archived again only by the run right after it was first.
+recent_records = 10000
+
+
+def report_state_file_name(account):
+    return "reports/.state/{0}.pickle".format(account)
+
+
+class MarketTally(object):
+
+    def __init__(self):
+        self.grid_fills = 0
+        self.reciprocal_fills = 0
+        self.bought = 0.0 # quote currency
+        self.sold = 0.0
+        self.fees = 0.0 # base currency
+        self.realized_pnl = 0.0
+        self.levels_placed = 0
+        self.levels_filled = 0
+
+    @property
+    def utilization(self):
+        """Percent of the grid levels placed that filled completely."""
+        if not self.levels_placed:
+            return 0.0
+        return 100.0 * self.levels_filled / self.levels_placed
+
+
+class AccountReport(object):
+
+    def __init__(self, account):
+        """Running totals of one account, built from its history archive.
+        update() only reads what was archived since it last ran: it
+        remembers how far into each segment file it got, and a segment
+        only ever grows by whole gzip members."""
+
+        self.account = account
+        self.offsets = dict() # segment file -> bytes read
+        self.markets = dict() # market -> MarketTally
+        self.balances = dict()
+        self.balances_time = None
+        # Keys of the latest records counted, oldest first: (market,
+        # tradeID) of a fill, (kind, orderNumber) of an order or level.
+        self.recent = deque()
+        self.recent_keys = set() # the same, to look them up
+
+    def seen(self, key):
+        """Whether the record known by KEY was counted already. Remembers
+        it if not."""
+        if key in self.recent_keys:
+            return True
+        self.recent.append(key)
+        self.recent_keys.add(key)
+        if len(self.recent) > recent_records:
+            self.recent_keys.discard(self.recent.popleft())
+        return False
+
+    def update(self, history):
+        for segment in history.segments():
+            name = os.path.basename(segment)
+            offset = self.offsets.get(name, 0)
+            size = os.path.getsize(segment)
+            if size <= offset:
+                continue
+
+            with open(segment, 'rb') as fp:
+                fp.seek(offset)
+                data = fp.read(size - offset)
+            try:
+                lines = gzip.GzipFile(fileobj=StringIO.StringIO(data)).read().splitlines()
+            except (IOError, EOFError, zlib.error) as e:
+                # The trader is still writing the last member.
+                logging.debug("Leaving %s at %d for now: %s", segment, offset, e)
+                continue
+
+            for line in lines:
+                self.add(json.loads(line))
+            self.offsets[name] = size
+
+        return self
+
+    def tally(self, market):
+        return self.markets.setdefault(market, MarketTally())
+
+    def add(self, r):
+        kind = r['kind']
+        if kind == archive.BALANCE:
+            self.balances = r['balances']
+            self.balances_time = r['time']
+        elif kind == archive.LEVEL:
+            if self.seen((kind, r['order'])):
+                return
+            self.tally(r['market']).levels_placed += 1
+        elif kind == archive.ORDER:
+            if self.seen((kind, r['order'])):
+                return
+            if r['role'] == 'grid' and r['state'] == 'filled':
+                self.tally(r['market']).levels_filled += 1
+        elif kind == archive.FILL:
+            if self.seen((r['market'], r['tradeID'])):
+                return
+            t = self.tally(r['market'])
+            if r['role'] == 'grid':
+                t.grid_fills += 1
+            else:
+                t.reciprocal_fills += 1
+                if r['opens_rate'] is not None:
+                    t.realized_pnl += archive.reciprocal_gain(r)
+            if r['direction'] == 'buy':
+                t.bought += r['amount']
+            else:
+                t.sold += r['amount']
+            t.fees += r['fee'] * r['amount'] * r['rate']
+
+    def rows(self):
+        for market in sorted(self.markets):
+            t = self.markets[market]
+            yield [
+                self.account, market, t.grid_fills, t.reciprocal_fills,
+                t.bought, t.sold, t.fees, t.realized_pnl,
+                t.levels_placed, t.levels_filled, t.utilization,
+            ]
+
+    def balance_rows(self):
+        for coin in sorted(self.balances):
+            yield [self.account, coin, self.balances[coin]]
+
+
+market_headers = [
+    'Account', 'Market', 'Grid Fills', 'Reciprocal Fills', 'Bought', 'Sold',
+    'Fees', 'Realized P&L', 'Levels Placed', 'Levels Filled', 'Utilization %',
+]
+balance_headers = ['Account', 'Coin', 'Total']
+
+
+def load_report(account):
+    state_file = report_state_file_name(account)
+    if os.path.exists(state_file):
+        with open(state_file, 'rb') as fp:
+            return pickle.load(fp)
+    return AccountReport(account)
+
+
+def store_report(report):
+    state_file = report_state_file_name(report.account)
+    if not os.path.isdir(os.path.dirname(state_file)):
+        os.makedirs(os.path.dirname(state_file))
+    with open(state_file + '.tmp', 'wb') as fp:
+        pickle.dump(report, fp, pickle.HIGHEST_PROTOCOL)
+    os.rename(state_file + '.tmp', state_file)
+
+
+def render(reports, fmt):
+    market_rows = [row for r in reports for row in r.rows()]
+    balance_rows = [row for r in reports for row in r.balance_rows()]
+    generated = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime())
+
+    if fmt == 'csv':
+        out = StringIO.StringIO()
+        w = csv.writer(out)
+        w.writerow(market_headers)
+        w.writerows(market_rows)
+        w.writerow([])
+        w.writerow(balance_headers)
+        w.writerows(balance_rows)
+        return out.getvalue()
+
+    tablefmt = dict(markdown='pipe', html='html')[fmt]
+    markets = tabulate(market_rows, market_headers, tablefmt=tablefmt, floatfmt=".8f")
+    balances = tabulate(balance_rows, balance_headers, tablefmt=tablefmt, floatfmt=".8f")
+
+    if fmt == 'html':
+        return ("<html><body><h1>Grid Trader Status Report</h1><p>{}</p>"
+                "<h2>Markets</h2>{}<h2>Balances</h2>{}</body></html>\n").format(
+                    generated, markets, balances)
+
+    return "# Grid Trader Status Report\n\n{}\n\n## Markets\n\n{}\n\n## Balances\n\n{}\n".format(
+        generated, markets, balances)
+
+
+@arg('accountgroup', help="Searches [accountgroups] in batch/config.ini for this value. Otherwise considers it a single account")
+@arg('--format', choices=('markdown', 'html', 'csv'), help="Output format")
+@arg('--output', help="Write the report to this file instead of standard output")
+def main(accountgroup, format='markdown', output=None):
+    """Trade log and status report of every account in ACCOUNTGROUP, from
+    the history each account's gridtrader.py runs archive."""
+
+    config = load_settings('batch/config.ini', 'batch')
+
+    reports = list()
+    for account in Batch(config, accountgroup).accounts:
+        report = load_report(account).update(archive.HistoryArchive(history_dir_name(account)))
+        store_report(report)
+        reports.append(report)
+
+    text = render(reports, format)
+    if output:
+        with open(output, 'w') as fp:
+            fp.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    dispatch_command(main)
@@ -0,0 +1,347 @@
+# core
+import ConfigParser
+import cPickle
+import logging
+import os
+
+# local
+import exception
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Bump when compiled settings change shape, to ignore older caches.
+cache_version = 1
+
+
+class Option(object):
+
+    def __init__(self, type=str, required=True, check=None, choices=None):
+        """How to compile and validate one .ini option.
+
+        - type: str, int, float or bool
+        - check: (predicate, description) the compiled value must satisfy
+        - choices: values a str option may take
+        """
+        self.type = type
+        self.required = required
+        self.check = check
+        self.choices = choices
+
+
+positive = (lambda v: v > 0, "greater than 0")
+not_negative = (lambda v: v >= 0, "at least 0")
+percentage = (lambda v: 0 < v <= 100, "greater than 0 and at most 100")
+
+
+def optional(type, check=None, choices=None):
+    return Option(type, required=False, check=check, choices=choices)
+
+
+grid_section = {
+    'majorlevel': Option(float, check=not_negative),
+    'size': Option(float, check=percentage),
+    'numberoforders': Option(int, check=positive),
+    'increments': Option(float, check=positive),
+}
+
+# Sections with one float per free-form option name
+per_coin = object()
+
+admin_section = {
+    'email': Option(),
+    'smtpserver': Option(),
+    'smtpport': optional(int, positive),
+    'smtptls': optional(bool),
+    'dedupwindow': optional(float, not_negative),
+    'digestinterval': optional(float, not_negative),
+    'maxemailsperhour': optional(int, positive),
+}
+
+trader_schema = {
+    'api': {'key': Option(), 'secret': Option()},
+    'admin': admin_section,
+    'sanitycheck': {
+        'allowabledrop': Option(float, check=positive),
+        'allowablegain': Option(float, check=positive),
+    },
+    'pairs': {'pairs': Option()},
+    'initialcorepositions': per_coin,
+    'ReciprocalSell': {'majorlevel': Option(float, check=positive)},
+    'ReciprocalBuy': {'majorlevel': Option(float, check=percentage)},
+    'sellgrid': grid_section,
+    'buygrid': grid_section,
+    'pricing': {
+        'ticksize': optional(float, positive),
+        'lotsize': optional(float, positive),
+        'minimumtotal': optional(float, not_negative),
+    },
+    'rolling': {
+        'enabled': optional(bool),
+        'maxorders': optional(int, positive),
+    },
+    'init': {
+        'reuse': optional(bool),
+        'tolerancepercent': optional(float, not_negative),
+    },
+    'orderbook': {
+        'enabled': optional(bool),
+        'depth': optional(int, not_negative),
+        'marginpercent': optional(float, not_negative),
+        'fullcheckevery': optional(int, positive),
+    },
+    'aggregation': {
+        'mode': optional(str, choices=('fill', 'order', 'bucket', 'window')),
+        'bucketpercent': optional(float, positive),
+        'maxage': optional(float, not_negative),
+        'flushtotal': optional(float, not_negative),
+    },
+}
+
+optional_sections = ('pricing', 'rolling', 'aggregation', 'orderbook', 'init')
+
+batch_schema = {
+    'admin': admin_section,
+    'delay': {
+        'group': Option(float, check=not_negative),
+        'account': Option(float, check=not_negative),
+    },
+    'accountgroups': dict(),
+    'scheduler': {
+        'mininterval': optional(float, positive),
+        'maxinterval': optional(float, positive),
+        'apicallsperminute': optional(float, positive),
+    },
+    'coordination': {
+        'groups': optional(str),
+        'tolerance': optional(float, not_negative),
+        'maxage': optional(float, positive),
+    },
+}
+
+
+def convert(parser, section, option, type):
+    if type is bool:
+        return parser.getboolean(section, option)
+    if type is int:
+        return parser.getint(section, option)
+    if type is float:
+        return parser.getfloat(section, option)
+    return parser.get(section, option)
+
+
+def compile_ini(path, schema, optional_sections=()):
+    """Parse and validate the .ini file PATH against SCHEMA. Returns the
+    raw and typed values, each as dict[section][option]. Raises
+    InvalidConfig naming every problem found."""
+
+    parser = ConfigParser.RawConfigParser()
+    if not parser.read(path):
+        raise exception.InvalidConfig("Cannot read {}".format(path))
+
+    raw = dict()
+    for section in parser.sections():
+        raw[section] = dict(parser.items(section))
+
+    typed = dict()
+    problems = list()
+    for section, options in schema.items():
+        if not parser.has_section(section):
+            if section not in optional_sections:
+                problems.append("missing section [{}]".format(section))
+            continue
+
+        typed[section] = dict()
+        if options is per_coin:
+            options = dict((o, Option(float, check=positive)) for o in parser.options(section))
+
+        for option, spec in options.items():
+            if not parser.has_option(section, option):
+                if spec.required:
+                    problems.append("missing [{}] {}".format(section, option))
+                continue
+            try:
+                value = convert(parser, section, option, spec.type)
+            except ValueError:
+                problems.append("[{}] {} = {!r} is not a {}".format(
+                    section, option, raw[section][option], spec.type.__name__))
+                continue
+            if spec.check and not spec.check[0](value):
+                problems.append("[{}] {} = {!r} must be {}".format(
+                    section, option, value, spec.check[1]))
+            if spec.choices and value not in spec.choices:
+                problems.append("[{}] {} = {!r} must be one of {}".format(
+                    section, option, value, ", ".join(spec.choices)))
+            typed[section][option] = value
+
+    if schema is trader_schema and 'pairs' in raw and 'initialcorepositions' in raw:
+        for quote in raw['pairs'].get('pairs', '').split():
+            if quote not in raw['initialcorepositions']:
+                problems.append("pair {} has no [initialcorepositions] entry".format(quote))
+
+    aggregation = typed.get('aggregation', {})
+    if aggregation.get('mode', 'fill') != 'fill' and not (
+            aggregation.get('maxage') or aggregation.get('flushtotal')):
+        # A batch that never completes, e.g. of an order that is only
+        # partially filled, would wait for its reciprocal forever.
+        problems.append("[aggregation] mode = {!r} needs a maxAge or flushTotal above 0".format(
+            aggregation['mode']))
+
+    if problems:
+        raise exception.InvalidConfig("{}: {}".format(path, "; ".join(problems)))
+
+    return raw, typed
+
+
+def cache_file_name(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, '.cache', filename + '.pickle')
+
+
+class Settings(object):
+
+    def __init__(self, path, schema_name, stamp, raw, typed):
+        """Configuration compiled from one .ini file. Reads like a
+        RawConfigParser, but every value has been converted and validated
+        when the file was loaded, so reading one is a dict lookup.
+
+        Use load_settings() rather than creating one directly.
+        """
+
+        self.path = path
+        self.schema_name = schema_name
+        self.stamp = stamp # (mtime, size) of the .ini compiled
+        self.raw = raw
+        self.typed = typed
+        self.rejected = None # stamp of the last edit that did not validate
+
+    def sections(self):
+        return sorted(self.raw)
+
+    def has_section(self, section):
+        return section in self.raw
+
+    def options(self, section):
+        self._section(section)
+        return sorted(self.raw[section])
+
+    def has_option(self, section, option):
+        return section in self.raw and option.lower() in self.raw[section]
+
+    def items(self, section):
+        return sorted(self._section(section).items())
+
+    def _section(self, section):
+        try:
+            return self.raw[section]
+        except KeyError:
+            raise ConfigParser.NoSectionError(section)
+
+    def _value(self, section, option, type):
+        option = option.lower()
+        value = self.typed.get(section, {}).get(option)
+        if value is not None and isinstance(value, type):
+            return value
+        try:
+            raw = self._section(section)[option]
+        except KeyError:
+            raise ConfigParser.NoOptionError(option, section)
+        if type is bool:
+            return raw.lower() in ('1', 'yes', 'true', 'on')
+        return type(raw)
+
+    def get(self, section, option):
+        return self._value(section, option, str)
+
+    def getint(self, section, option):
+        return self._value(section, option, int)
+
+    def getfloat(self, section, option):
+        return self._value(section, option, float)
+
+    def getboolean(self, section, option):
+        return self._value(section, option, bool)
+
+    @property
+    def changed(self):
+        return file_stamp(self.path) != self.stamp
+
+    def reload_if_changed(self, alert=None):
+        """Settings for the current contents of the .ini file: self if it
+        has not changed since it was loaded, or if the edit does not
+        validate. Then ALERT, if given, is called once with the problems
+        found."""
+        if not self.changed:
+            return self
+        logging.debug("%s changed, reloading", self.path)
+        try:
+            return load_settings(self.path, self.schema_name)
+        except exception.InvalidConfig as e:
+            stamp = file_stamp(self.path)
+            if stamp != self.rejected:
+                self.rejected = stamp
+                logging.debug("Keeping the settings loaded before: %s", e)
+                if alert:
+                    alert(str(e))
+            return self
+
+    def __str__(self):
+        return "<Settings {} stamp={}>".format(self.path, self.stamp)
+
+    __repr__ = __str__
+
+
+schemas = dict(
+    trader=(trader_schema, optional_sections),
+    batch=(batch_schema, ('admin', 'coordination', 'scheduler')),
+)
+
+
+def schema_fingerprint(schema):
+    """Changes whenever options are added to SCHEMA, so that caches
+    compiled without them are not used."""
+    return tuple(sorted(
+        (section, tuple(sorted(options)) if isinstance(options, dict) else ())
+        for section, options in schema.items()))
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+
+def load_settings(path, schema_name='trader'):
+    """Settings compiled from the .ini file PATH. The compiled form is
+    cached next to it, under .cache/, and reused by every process until
+    the .ini file changes."""
+
+    stamp = file_stamp(path)
+    cache_file = cache_file_name(path)
+    schema, optional = schemas[schema_name]
+    key = (cache_version, schema_name, schema_fingerprint(schema), stamp)
+
+    try:
+        with open(cache_file, 'rb') as fp:
+            cached_key, raw, typed = cPickle.load(fp)
+        if cached_key == key:
+            return Settings(path, schema_name, stamp, raw, typed)
+    except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+        pass
+
+    raw, typed = compile_ini(path, schema, optional)
+    logging.debug("Compiled %s", path)
+
+    try:
+        # The [api] key and secret are in the cache too: only the owner
+        # may read it.
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file), 0700)
+        tmpfile = cache_file + '.{}.tmp'.format(os.getpid())
+        with os.fdopen(os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'wb') as fp:
+            cPickle.dump((key, raw, typed), fp, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, cache_file)
+    except (IOError, OSError) as e:
+        logging.debug("Could not cache compiled %s: %s", path, e)
+
+    return Settings(path, schema_name, stamp, raw, typed)
@@ -0,0 +1,242 @@
+# core
+from collections import deque
+import logging
+import os
+import time
+
+# 3rd party
+from tabulate import tabulate
+
+# local
+from aggregation import fill_time
+import exception
+from exchange import PoloniexAPIData
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Virtual order numbers start here, far from real Poloniex ones.
+first_order_number = 900000000000
+
+default_fee = 0.0015
+minimum_total = 0.0001
+
+
+class VirtualBook(object):
+
+    def __init__(self, fee=default_fee):
+        """Orders a shadow GridTrader would have placed. An order fills
+        completely, at its own rate, once the market ticker crosses it."""
+
+        self.fee = fee
+        self.next_order_number = first_order_number
+        self.next_trade_id = 1
+        self.orders = dict() # orderNumber -> order dict
+        self.actions = deque(maxlen=10000) # what would have been sent to the exchange
+
+    def act(self, action, market, **details):
+        details.update(action=action, market=market, time=time.time())
+        self.actions.append(details)
+        logging.debug("SHADOW %s", details)
+
+    def place(self, direction, market, rate, amount):
+        rate, amount = float(rate), float(amount)
+        if rate * amount < minimum_total:
+            self.act('rejected', market, direction=direction, rate=rate, amount=amount)
+            raise exception.DustTrade("Total must be at least {}.".format(minimum_total))
+
+        order_number = str(self.next_order_number)
+        self.next_order_number += 1
+        self.orders[order_number] = dict(
+            orderNumber=order_number, market=market, type=direction,
+            rate=rate, amount=amount, remaining=amount, trades=list(), collected=0)
+        self.act(direction, market, orderNumber=order_number, rate=rate, amount=amount)
+        return PoloniexAPIData(orderNumber=order_number)
+
+    def cancel(self, order_number):
+        order = self.orders.get(str(order_number))
+        if order is None or not order['remaining']:
+            return
+        order['remaining'] = 0.0
+        self.act('cancel', order['market'], orderNumber=order['orderNumber'])
+
+    def match(self, market, ticker):
+        """Fill the open orders of MARKET that TICKER has crossed."""
+        for order in self.orders.values():
+            if order['market'] != market or not order['remaining']:
+                continue
+            if order['type'] == 'buy':
+                crossed = float(ticker.lowestAsk) <= order['rate']
+            else:
+                crossed = float(ticker.highestBid) >= order['rate']
+            if not crossed:
+                continue
+
+            amount = order['remaining']
+            order['remaining'] = 0.0
+            order['trades'].append(dict(
+                tradeID=self.next_trade_id, globalTradeID=0,
+                type=order['type'], rate="{:.8f}".format(order['rate']),
+                amount="{:.8f}".format(amount),
+                total="{:.8f}".format(amount * order['rate']),
+                fee="{:.8f}".format(self.fee),
+                date=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+            self.next_trade_id += 1
+            self.act('fill', market, orderNumber=order['orderNumber'],
+                     rate=order['rate'], amount=amount)
+
+    def collect(self, order_number):
+        """The fills of ORDER_NUMBER, which the trader now knows of."""
+        order = self.orders[str(order_number)]
+        order['collected'] = len(order['trades'])
+        return list(order['trades'])
+
+    def finished(self, order):
+        """Whether ORDER is filled or cancelled, and the trader has
+        collected its fills."""
+        return not order['remaining'] and order['collected'] == len(order['trades'])
+
+    def open_orders(self):
+        retval = dict()
+        for order in self.orders.values():
+            if order['remaining']:
+                retval.setdefault(order['market'], []).append(PoloniexAPIData(
+                    orderNumber=order['orderNumber'], type=order['type'],
+                    rate="{:.8f}".format(order['rate']),
+                    amount="{:.8f}".format(order['remaining']),
+                    startingAmount="{:.8f}".format(order['amount'])))
+        return retval
+
+    def as_dict(self):
+        """The state to store. Finished orders are left out: the actions
+        the report reads are kept, and the order numbers and trade ids
+        carry on from the counters."""
+        orders = dict((n, o) for n, o in self.orders.items() if not self.finished(o))
+        return dict(fee=self.fee, orders=orders, actions=list(self.actions),
+                    next_order_number=self.next_order_number, next_trade_id=self.next_trade_id)
+
+    def restore(self, d):
+        """Carry on from D, what as_dict() gave for an earlier run."""
+        self.fee = d['fee']
+        self.orders = dict((str(n), o) for n, o in d['orders'].items())
+        self.actions.extend(d['actions'])
+        self.next_order_number = d['next_order_number']
+        self.next_trade_id = d['next_trade_id']
+        return self
+
+    def summary(self, since=0):
+        """Table of what would have been done since unix time SINCE."""
+        counts = dict()
+        for a in self.actions:
+            if a['time'] < since:
+                continue
+            key = (a['market'], a['action'])
+            n, total = counts.get(key, (0, 0.0))
+            counts[key] = (n + 1, total + a.get('amount', 0.0) * a.get('rate', 0.0))
+        rows = [[market, action, n, total] for (market, action), (n, total) in sorted(counts.items())]
+        return tabulate(rows, ['Market', 'Action', 'Count', 'Total'], floatfmt=".8f")
+
+
+class ShadowExchange(object):
+
+    def __init__(self, exchange, ticker_ttl=5):
+        """Stands in for EXCHANGE in shadow mode. Market data comes from
+        EXCHANGE, live or replayed, while orders go to a VirtualBook and
+        never reach the exchange. Tickers are fetched at most once every
+        TICKER_TTL seconds."""
+
+        self.exchange = exchange
+        self.book = VirtualBook()
+        self.ticker_ttl = ticker_ttl
+        self.ticker = None
+        self.ticker_time = 0
+
+    @property
+    def replaying(self):
+        return getattr(self.exchange, 'replaying', False)
+
+    # Market data
+
+    def clock(self):
+        return getattr(self.exchange, 'clock', time.time)()
+
+    def returnTicker(self):
+        now = self.clock()
+        if self.ticker is None or now - self.ticker_time >= self.ticker_ttl:
+            self.ticker = self.exchange.returnTicker()
+            self.ticker_time = now
+        return self.ticker
+
+    def tickerFor(self, market):
+        return PoloniexAPIData(self.returnTicker()[market])
+
+    def returnCompleteBalances(self):
+        return self.exchange.returnCompleteBalances()
+
+    def publicTrades(self, market, start, end=None):
+        return self.exchange.publicTrades(market, start, end)
+
+    def orderBook(self, market, depth):
+        return self.exchange.orderBook(market, depth)
+
+    def currency2pair(self, base, quote, uppercase=True):
+        return self.exchange.currency2pair(base, quote, uppercase)
+
+    # Orders
+
+    def buy(self, market, rate, amount):
+        return self.book.place('buy', market, rate, amount)
+
+    def sell(self, market, rate, amount):
+        return self.book.place('sell', market, rate, amount)
+
+    def cancelOrders(self, order_numbers):
+        for order_number in order_numbers:
+            self.book.cancel(order_number)
+
+    def cancelAllOpen(self):
+        for orders in self.book.open_orders().values():
+            self.cancelOrders([o.orderNumber for o in orders])
+
+    def openOrders(self):
+        return self.book.open_orders()
+
+    def fills(self, trade_id):
+        order = self.book.orders.get(str(trade_id))
+        if order is None:
+            return []
+        self.book.match(order['market'], self.tickerFor(order['market']))
+        return self.book.collect(trade_id)
+
+    def fillAmount(self, trade_id):
+        return sum(float(t['amount']) for t in self.fills(trade_id))
+
+    def tradeHistory(self, market, start):
+        retval = list()
+        for order in self.book.orders.values():
+            if order['market'] == market:
+                for t in order['trades']:
+                    if fill_time(t) < start:
+                        continue
+                    d = dict(t)
+                    d['orderNumber'] = order['orderNumber']
+                    retval.append(d)
+        return retval
+
+
+def report(book, timings, since):
+    """What a shadow run would have done since unix time SINCE, and how
+    long each of its TIMINGS, a list of (phase, seconds), took."""
+    return "Shadow run would have done:\n{}\n\nTimings:\n{}\n".format(
+        book.summary(since),
+        tabulate(timings, ['Phase', 'Seconds'], floatfmt=".3f"))
+
+
+def write_report(path, text):
+    """Add TEXT, the report of one shadow run, to the file at PATH."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'a') as fp:
+        fp.write("{}\n{}\n".format(time.strftime('%Y-%m-%d %H:%M:%S'), text))
@@ -0,0 +1,207 @@
+# core
+import logging
+
+# local
+from aggregation import FillAggregator, FillBatch, aggregation_options
+from pricing import build_pricing_tables
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Kinds of event a strategy steps over
+TICK = 'tick'         # market, time, and bid and ask to build grids on
+FILL = 'fill'         # market, direction and order of the order filled, fill (as the exchange gives it), time
+DONE = 'done'         # order: completely filled, no more fills to come
+COVERED = 'covered'   # covers: fills a reciprocal placed outside of step() covers
+PLACED = 'placed'     # intent, order: a place intent was carried out
+REJECTED = 'rejected' # intent, reason: the exchange would not take a place intent
+
+# Kinds of intent a strategy returns
+PLACE = 'place'       # intent, market, direction, rate, amount, role, and for a
+                      # reciprocal reciprocant_trade_id, opens_rate, covers, filled_at
+DUST = 'dust'         # a reciprocal too small to place, as PLACE without intent:
+                      # its fills wait for the next one of its market and direction
+
+
+def grid_levels(direction, price, major_level, increments, n):
+    """Rates of the N levels of a grid in DIRECTION away from PRICE: the
+    first MAJOR_LEVEL percent away, each next one INCREMENTS, a ratio,
+    further. Works on floats and F values alike."""
+    sign = 1 if direction == 'sell' else -1
+    rate = price + price * (sign * major_level / 100.0)
+    retval = list()
+    for i in range(0, n):
+        retval.append(rate)
+        rate = rate + sign * rate * increments
+    return retval
+
+
+def waiting(state):
+    """The orders whose fills wait in STATE for a reciprocal."""
+    retval = set()
+    for batch in [b for k, b in state['aggregator']['batches']] + state['dust_batches']:
+        retval.update(batch['sources'])
+    return retval
+
+
+class Step(object):
+
+    def __init__(self, aggregation, state):
+        """What one GridStrategy.step() works on: the objects of STATE,
+        made anew so that STATE itself is not changed."""
+
+        self.state = state
+        self.aggregator = FillAggregator(**aggregation).restore(state['aggregator'])
+        self.dust = dict(((b['market'], b['direction']), FillBatch.from_dict(b))
+                         for b in state['dust_batches'])
+        self.pending = dict((i, FillBatch.from_dict(b)) for i, b in state['pending'].items())
+        self.next_intent = state['next_intent']
+        self.grids = list(state['grids'])
+        self.intents = list()
+
+    def as_state(self):
+        return dict(
+            self.state, aggregator=self.aggregator.as_dict(),
+            dust_batches=[b.as_dict() for b in self.dust.values()],
+            pending=dict((i, b.as_dict()) for i, b in self.pending.items()),
+            next_intent=self.next_intent, grids=self.grids)
+
+
+class GridStrategy(object):
+
+    direction_toggle = dict(buy='sell', sell='buy')
+
+    def __init__(self, params):
+        """What GridTrader does with fills, as a pure step function:
+        fills are batched (see aggregation.py) and each batch flushed gets
+        a reciprocal priced by the PricingTable of its market and
+        direction. GridTrader runs it on the fills it polls and places
+        the reciprocals it returns; backtest.py runs it against a
+        simulated exchange. It has no exchange, no clock and no files: the
+        time comes with the events.
+
+        PARAMS is a plain dict (see strategy_params()): the pricing tables
+        of each market, the FillAggregator options and, for a backtest,
+        the grids to build on the first tick of each market (see
+        grid_params()).
+
+        A state is a plain dict too, never changed in place: step()
+        returns a new one. Its aggregator and dust_batches are what
+        GridTrader persists.
+        """
+
+        self.params = params
+
+    def initial_state(self):
+        return dict(aggregator=FillAggregator().as_dict(), dust_batches=[], pending=dict(),
+                    next_intent=1, grids=[])
+
+    def step(self, state, events):
+        """(new state, intents) after EVENTS, in order."""
+        s = Step(self.params['aggregation'], state)
+        for e in events:
+            if e['kind'] == FILL:
+                s.aggregator.add(e['market'], self.direction_toggle[e['direction']], e['order'],
+                                 e['fill'], now=e['time'])
+            elif e['kind'] == DONE:
+                s.aggregator.complete(e['order'])
+            elif e['kind'] == COVERED:
+                s.aggregator.consume(e['covers'])
+            elif e['kind'] == TICK:
+                self.on_tick(s, e)
+            elif e['kind'] == PLACED:
+                s.pending.pop(e['intent'], None)
+            elif e['kind'] == REJECTED:
+                self.on_rejected(s, e)
+        return s.as_state(), s.intents
+
+    def on_tick(self, s, e):
+        market = e['market']
+        grids = self.params.get('grids', dict())
+        if market in grids and market not in s.grids:
+            s.grids.append(market)
+            for direction, price in (('sell', e['ask']), ('buy', e['bid'])):
+                g = grids[market][direction]
+                rates = grid_levels(direction, price, g['majorLevel'], g['increments'],
+                                    g['numberOfOrders'])
+                for level, rate in enumerate(rates):
+                    self.place(s, dict(market=market, direction=direction, rate=rate,
+                                       amount=g['size'], role='grid', level=level))
+
+        for batch in s.aggregator.flush(market, now=e['time']):
+            self.reciprocal(s, batch)
+
+    def reciprocal(self, s, batch):
+        """Price a reciprocal for BATCH, with the dust of its market and
+        direction. Too small a one leaves the batch as the new dust."""
+        key = (batch.market, batch.direction)
+        dust = s.dust.pop(key, None)
+        if dust is not None:
+            batch.merge(dust)
+
+        intent = self.reciprocal_intent(batch)
+        if self.params['pricing'][batch.market][batch.direction].is_dust(
+                intent['rate'], intent['amount']):
+            s.dust[key] = batch
+            s.intents.append(dict(intent, kind=DUST))
+            return
+        self.place(s, intent, batch)
+
+    def reciprocal_intent(self, batch):
+        return dict(
+            market=batch.market, direction=batch.direction,
+            rate=self.params['pricing'][batch.market][batch.direction].rate(batch.rate),
+            amount=float(batch.amount), role='reciprocal',
+            reciprocant_trade_id=batch.reciprocant_trade_id, opens_rate=batch.rate,
+            covers=[list(c) for c in batch.covers], filled_at=batch.filled_at)
+
+    def place(self, s, intent, batch=None):
+        intent = dict(intent, kind=PLACE, intent=s.next_intent)
+        s.next_intent += 1
+        if batch is not None:
+            s.pending[intent['intent']] = batch
+        s.intents.append(intent)
+
+    def on_rejected(self, s, e):
+        """A reciprocal the exchange would not take, e.g. too small once
+        rounded to its market, is dust."""
+        batch = s.pending.pop(e['intent'], None)
+        if batch is None:
+            return
+        key = (batch.market, batch.direction)
+        if key in s.dust:
+            batch.merge(s.dust[key])
+        s.dust[key] = batch
+        s.intents.append(dict(self.reciprocal_intent(batch), kind=DUST))
+
+
+def strategy_params(config, markets, metadata):
+    """The GridStrategy parameters of the account whose settings are
+    CONFIG, trading MARKETS, whose MarketMetadata METADATA, a
+    markets.MarketMetadataCache, has."""
+    return dict(
+        pricing=build_pricing_tables(config, markets, metadata),
+        aggregation=aggregation_options(config))
+
+
+def grid_params(config, markets, metadata, fee):
+    """strategy_params() and, for a backtest, the grids of MARKETS, a
+    dict of market -> quote currency, and what its simulated exchange
+    needs: the MarketMetadata of each market and the FEE it charges."""
+
+    def grid(section, quote):
+        n = config.getint(section, 'numberOfOrders')
+        return dict(
+            majorLevel=config.getfloat(section, 'majorLevel'),
+            numberOfOrders=n,
+            increments=config.getfloat(section, 'increments') / 100.0,
+            size=(config.getfloat(section, 'size') / 100.0
+                  * config.getfloat('initialcorepositions', quote) / n))
+
+    return dict(
+        strategy_params(config, markets.keys(), metadata),
+        grids=dict((market, dict(sell=grid('sellgrid', quote), buy=grid('buygrid', quote)))
+                   for market, quote in markets.items()),
+        metadata=dict((market, metadata.get(market)) for market in markets),
+        fee=fee)
@@ -0,0 +1,81 @@
+# core
+import os
+import shutil
+import tempfile
+
+# local
+from exchange import PoloniexAPIData
+
+
+# An account's settings, as config/$accountName.ini, trading two markets
+sample_ini = """[admin]
+email: admin@example.com
+smtpServer: localhost
+
+[sanitycheck]
+allowableDrop: 30
+allowableGain: 30
+
+[pairs]
+pairs: dash strat
+
+[initialcorepositions]
+dash: 6.9
+strat: 368
+
+[ReciprocalSell]
+majorLevel: 1
+
+[ReciprocalBuy]
+majorLevel: 0.5
+
+[sellgrid]
+majorLevel: 1
+size: 100
+numberOfOrders: 4
+increments: 1
+
+[buygrid]
+majorLevel: 1
+size: 40
+numberOfOrders: 4
+increments: 4
+
+[api]
+key: KEY
+secret: SECRET
+"""
+
+
+class Ticker(object):
+    """The market data a ShadowExchange needs, with a ticker the test can
+    move."""
+
+    def __init__(self):
+        self.ticker = dict(BTC_DASH=PoloniexAPIData(lowestAsk='0.05', highestBid='0.049'),
+                           BTC_STRAT=PoloniexAPIData(lowestAsk='0.0005', highestBid='0.00049'))
+
+    def returnTicker(self):
+        return self.ticker
+
+    def currency2pair(self, base, quote, uppercase=True):
+        return "{0}_{1}".format(base, quote).upper()
+
+
+class TemporaryDirectory(object):
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp()
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def write_file(directory, name, text):
+    path = os.path.join(directory, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+        fp.write(text)
+    return path
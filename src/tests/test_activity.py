@@ -0,0 +1,35 @@
+# core
+import json
+import os
+import unittest
+
+# local
+from exchange import InstrumentedAPI
+from gridtrader import GridTrader, api_calls_made
+from support import TemporaryDirectory
+
+
+class Ticker(object):
+
+    def returnTicker(self):
+        return dict(BTC_DASH=dict(lowestAsk='0.05', highestBid='0.049', last='0.0495'))
+
+
+class WriteActivityTest(unittest.TestCase):
+
+    def test_the_ticker_read_for_it_is_counted(self):
+        g = object.__new__(GridTrader)
+        g.account, g.grids, g.orders = 'agnes.activity', dict(BTC_DASH=dict()), dict()
+        g.exchange = InstrumentedAPI(Ticker(), g.account)
+        calls_before = api_calls_made(g.account)
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'activity', 'agnes.json')
+            g.write_activity(path, dict(BTC_DASH=1), calls_before)
+            with open(path) as fp:
+                activity = json.load(fp)
+        self.assertEqual(activity['api_calls'], 1)
+        self.assertEqual(activity['markets']['BTC_DASH']['fills'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
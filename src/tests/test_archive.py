@@ -0,0 +1,35 @@
+# core
+import unittest
+
+# local
+import archive
+from support import TemporaryDirectory
+
+
+def fill(trade_id, rate='0.05', amount='0.69'):
+    return dict(tradeID=trade_id, rate=rate, amount=amount, fee='0.0015')
+
+
+class FillsTest(unittest.TestCase):
+
+    def test_a_fill_archived_twice_counts_once(self):
+        with TemporaryDirectory() as d:
+            history = archive.HistoryArchive(d)
+            for run in range(2):
+                history.fill('BTC_DASH', 'sell', 'reciprocal', '21', fill(7), opens_rate=0.04851)
+                history.flush()
+            self.assertEqual(len(list(history.fills())), 1)
+
+    def test_markets_may_share_trade_ids(self):
+        with TemporaryDirectory() as d:
+            history = archive.HistoryArchive(d)
+            history.fill('BTC_DASH', 'sell', 'reciprocal', '21', fill(7), opens_rate=0.04851)
+            history.fill('BTC_STRAT', 'sell', 'reciprocal', '31', fill(7, rate='0.001'),
+                         opens_rate=0.00099)
+            history.flush()
+            self.assertEqual(sorted(f['market'] for f in history.fills()), ['BTC_DASH', 'BTC_STRAT'])
+            self.assertEqual(sorted(history.realized_pnl()), ['BTC_DASH', 'BTC_STRAT'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# core
+import ConfigParser
+import StringIO
+import unittest
+
+# local
+import backtest
+from markets import MarketMetadataCache
+import strategy
+from support import sample_ini
+
+
+def params():
+    config = ConfigParser.RawConfigParser()
+    config.readfp(StringIO.StringIO(sample_ini))
+    markets = dict(BTC_DASH='dash')
+    return strategy.grid_params(config, markets, MarketMetadataCache(None).refresh(config, markets),
+                                0.0015)
+
+
+def tick(t, bid, ask):
+    return dict(kind=strategy.TICK, market='BTC_DASH', time=t, bid=bid, ask=ask)
+
+
+class BacktestTest(unittest.TestCase):
+
+    def test_fees_are_charged_as_the_exchange_does(self):
+        p = params()
+        sell = dict(kind=strategy.PLACE, intent=1, market='BTC_DASH', direction='sell',
+                    rate=0.05, amount=1.0, role='grid')
+        buy = dict(sell, intent=2, direction='buy', rate=0.04)
+        exchange = backtest.Simulator(dict(BTC=1.0, DASH=1.0), p['metadata'], p['fee'])
+        events = exchange.execute([sell, buy])
+        self.assertEqual([e['kind'] for e in events], [strategy.PLACED, strategy.PLACED])
+        exchange.match(tick(0, 0.05, 0.06))
+        exchange.match(tick(1, 0.03, 0.04))
+        # The sell's fee is in BTC, the buy's in DASH.
+        self.assertAlmostEqual(exchange.fees['BTC'], 0.000075)
+        self.assertAlmostEqual(exchange.fees['DASH'], 0.0015)
+        self.assertAlmostEqual(exchange.balances['BTC'], 1.0 - 0.04 + 0.05 - 0.000075)
+
+    def test_a_fill_gets_its_reciprocal(self):
+        r = backtest.backtest(params(), [tick(0, 0.049, 0.05), tick(1, 0.048, 0.0485),
+                                         tick(2, 0.049, 0.05)],
+                              dict(BTC=1.0, DASH=6.9))
+        # The first buy level filled, and its reciprocal sell at the next
+        # tick.
+        self.assertEqual(r['fills'], 2)
+
+    def test_varying_a_reciprocal_major_level_reprices_it(self):
+        p = backtest.vary(params(), 'ReciprocalSell.majorLevel', '2')
+        self.assertAlmostEqual(p['pricing']['BTC_DASH']['sell'].rate(0.05), 0.051)
+        self.assertAlmostEqual(params()['pricing']['BTC_DASH']['sell'].rate(0.05), 0.0505)
+        self.assertRaises(ValueError, backtest.vary, params(), 'aggregation.mode', 'hourly')
+
+
+if __name__ == '__main__':
+    unittest.main()
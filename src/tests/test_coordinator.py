@@ -0,0 +1,72 @@
+# core
+import unittest
+
+# local
+from coordinator import GroupPlan, Level
+
+
+def plan(*levels):
+    p = GroupPlan('group1', sorted(set(l.account for l in levels)))
+    p.levels = list(levels)
+    return p
+
+
+class StaggerTest(unittest.TestCase):
+
+    def test_levels_of_two_accounts_at_one_rate_are_spread_away_from_the_market(self):
+        agnes = Level('agnes', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        bert = Level('bert', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        agnes_buy = Level('agnes', 'BTC_DASH', 'buy', 0, 0.04, 1, 0.04)
+        bert_buy = Level('bert', 'BTC_DASH', 'buy', 0, 0.04, 1, 0.04)
+        p = plan(bert, agnes, bert_buy, agnes_buy)
+
+        self.assertEqual(p.stagger(), 2)
+        self.assertAlmostEqual(agnes.rate, 0.05)
+        self.assertAlmostEqual(bert.rate, 0.05 * 1.005)
+        self.assertAlmostEqual(agnes_buy.rate, 0.04)
+        self.assertAlmostEqual(bert_buy.rate, 0.04 * 0.98)
+
+    def test_levels_further_apart_than_the_tolerance_stay(self):
+        agnes = Level('agnes', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        bert = Level('bert', 'BTC_DASH', 'sell', 0, 0.0501, 1, 0.01)
+        p = plan(agnes, bert)
+
+        self.assertEqual(p.stagger(tolerance=0.1), 0)
+        self.assertAlmostEqual(bert.rate, 0.0501)
+
+    def test_levels_of_one_account_are_not_clustered(self):
+        first = Level('agnes', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        second = Level('agnes', 'BTC_DASH', 'sell', 1, 0.05001, 1, 0.01)
+        bert = Level('bert', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        p = plan(first, second, bert)
+
+        self.assertEqual(p.stagger(), 1)
+        self.assertAlmostEqual(first.rate, 0.05)
+        self.assertAlmostEqual(second.rate, 0.05001)
+        self.assertAlmostEqual(bert.rate, 0.05 * 1.005)
+
+
+class DropCrossingTest(unittest.TestCase):
+
+    def test_a_buy_at_or_above_another_accounts_sell_is_dropped(self):
+        sell = Level('agnes', 'BTC_DASH', 'sell', 0, 0.05, 1, 0.01)
+        crossing = Level('bert', 'BTC_DASH', 'buy', 0, 0.0505, 1, 0.04)
+        touching = Level('bert', 'BTC_DASH', 'buy', 1, 0.05, 1, 0.04)
+        below = Level('bert', 'BTC_DASH', 'buy', 2, 0.0499, 1, 0.04)
+        p = plan(sell, crossing, touching, below)
+
+        self.assertEqual(p.drop_crossing(), 2)
+        self.assertEqual([l.dropped for l in (crossing, touching, below)], [True, True, False])
+        self.assertEqual(p.side('BTC_DASH', 'buy'), [below])
+
+    def test_buys_of_a_market_without_sells_stay(self):
+        buy = Level('agnes', 'BTC_DASH', 'buy', 0, 0.05, 1, 0.04)
+        sell = Level('agnes', 'BTC_STRAT', 'sell', 0, 0.0001, 1, 0.01)
+        p = plan(buy, sell)
+
+        self.assertEqual(p.drop_crossing(), 0)
+        self.assertFalse(buy.dropped)
+
+
+if __name__ == '__main__':
+    unittest.main()
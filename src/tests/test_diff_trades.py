@@ -0,0 +1,100 @@
+# core
+import ConfigParser
+import StringIO
+import unittest
+
+# local
+import archive
+import exception
+from gridtrader import GridTrader
+import orders
+from shadow import ShadowExchange
+from support import Ticker, sample_ini
+
+
+class BrokeExchange(ShadowExchange):
+    """A ShadowExchange whose account cannot afford a buy of BTC_DASH."""
+
+    def buy(self, market, rate, amount):
+        if market == 'BTC_DASH':
+            raise exception.NotEnoughCoin("Not enough BTC.")
+        return ShadowExchange.buy(self, market, rate, amount)
+
+
+class DiffTradesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigParser.RawConfigParser()
+        self.config.readfp(StringIO.StringIO(sample_ini))
+
+    def trader(self, exchange_class=ShadowExchange):
+        self.exchange = exchange_class(Ticker(), ticker_ttl=0)
+        self.history = archive.HistoryArchive('unused') # buffered, never flushed
+        g = GridTrader(self.exchange, self.config, 'agnes', history=self.history)
+        g.build_new_grids()
+        return g
+
+    def open(self, direction, rate, amount, remaining=None):
+        order_number = self.exchange.book.place(direction, 'BTC_DASH', rate, amount).orderNumber
+        if remaining is not None:
+            self.exchange.book.orders[order_number]['remaining'] = remaining
+        return order_number
+
+    def records(self, kind):
+        return [r['order'] for r in self.history.buffer if r['kind'] == kind]
+
+    def test_a_matching_open_order_is_adopted(self):
+        g = self.trader()
+        sell = g.grids['BTC_DASH']['sell']
+        kept = self.open('sell', '0.05051', sell.size)
+
+        self.assertEqual(g.diff_trades(self.exchange.openOrders(), 0.1), (1, 0, 15))
+        self.assertEqual(sell.trade_ids[0], kept)
+        self.assertAlmostEqual(float(sell.grid[0]), 0.05051)
+        self.assertEqual(g.orders[kept].state, orders.ACKNOWLEDGED)
+        self.assertEqual(self.records(archive.ADOPTED), [kept])
+        self.assertNotIn(kept, self.records(archive.LEVEL))
+        self.assertEqual(len(self.records(archive.LEVEL)), 15)
+
+    def test_an_order_of_another_size_or_partly_filled_is_cancelled(self):
+        g = self.trader()
+        sell = g.grids['BTC_DASH']['sell']
+        resized = self.open('sell', '0.0505', sell.size / 2)
+        partial = self.open('sell', '0.051005', sell.size, remaining=sell.size / 2)
+
+        self.assertEqual(g.diff_trades(self.exchange.openOrders(), 0.1), (0, 2, 16))
+        self.assertNotIn(resized, sell.trade_ids)
+        self.assertNotIn(partial, sell.trade_ids)
+        self.assertEqual(self.exchange.book.orders[resized]['remaining'], 0.0)
+        self.assertEqual(self.exchange.book.orders[partial]['remaining'], 0.0)
+
+    def test_the_missing_levels_are_placed(self):
+        g = self.trader()
+        buy = g.grids['BTC_DASH']['buy']
+        kept = self.open('buy', '0.04851', buy.size)
+
+        g.diff_trades(self.exchange.openOrders(), 0.1)
+        self.assertEqual(len(buy.trade_ids), 4)
+        self.assertEqual(buy.trade_ids[0], kept)
+        for trade_id, rate in zip(buy.trade_ids[1:], buy.grid[1:]):
+            order = self.exchange.book.orders[trade_id]
+            self.assertAlmostEqual(order['rate'], float(rate))
+            self.assertAlmostEqual(order['amount'], float(buy.size))
+
+    def test_a_failed_buy_level_raises_with_the_adopted_orders_kept(self):
+        g = self.trader(BrokeExchange)
+        buy = g.grids['BTC_DASH']['buy']
+        rate = float(buy.grid[1])
+        kept = self.open('buy', '0.04851', buy.size)
+        ShadowExchange.buy(self.exchange, 'BTC_DASH', rate, buy.size)
+        self.assertEqual(len(self.exchange.openOrders()['BTC_DASH']), 2)
+
+        self.assertRaises(exception.NotEnoughCoin, g.diff_trades, self.exchange.openOrders(), 0.1)
+        self.assertEqual(len(buy.trade_ids), 2)
+        self.assertEqual(buy.trade_ids[0], kept)
+        self.assertTrue(set(buy.trade_ids) <= set(g.tracked_trade_ids()))
+        self.assertEqual(len(g.grids['BTC_DASH']['sell'].trade_ids), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# core
+import ConfigParser
+import itertools
+import StringIO
+import unittest
+
+# local
+import exception
+from gridtrader import BuyGrid, SellGrid
+from support import sample_ini
+
+
+def settings():
+    config = ConfigParser.RawConfigParser()
+    config.readfp(StringIO.StringIO(sample_ini))
+    return config
+
+
+class Exchange(object):
+    """Takes orders, numbering them, until it runs out of AFFORD."""
+
+    def __init__(self, afford=1000):
+        self.numbers = itertools.count(1)
+        self.afford = afford
+        self.cancelled = list()
+
+    def submit(self, market, direction, rate, amount, slot):
+        if not self.afford:
+            raise exception.NotEnoughCoin("Not enough BTC.")
+        self.afford -= 1
+        return str(next(self.numbers))
+
+    def cancel(self, trade_id):
+        self.cancelled.append(trade_id)
+
+
+class GridTest(unittest.TestCase):
+
+    def place(self, grid, exchange):
+        for level, rate in enumerate(grid.grid):
+            try:
+                grid.trade_ids.append(exchange.submit(slot=grid.slot(level), **dict(
+                    grid.build_order(rate), direction=grid.direction)))
+            except exception.NotEnoughCoin:
+                break
+
+    def test_extend_goes_on_from_the_levels_placed(self):
+        grid = BuyGrid('dash', 'BTC_DASH', 0.049, settings())
+        rates = list(grid.grid)
+        exchange = Exchange(afford=2)
+        self.place(grid, exchange)
+        self.assertEqual(len(grid.trade_ids), 2)
+
+        exchange.afford = 1000
+        placed = grid.extend(exchange.submit, 4)
+        self.assertEqual(placed, ['3', '4'])
+        self.assertEqual(grid.trade_ids, ['1', '2', '3', '4'])
+        for rate, expected in zip(grid.grid, rates):
+            self.assertAlmostEqual(float(rate), float(expected))
+
+    def test_extend_of_a_grid_none_of_whose_levels_were_placed(self):
+        grid = SellGrid('dash', 'BTC_DASH', 0.05, settings())
+        rates = list(grid.grid)
+        grid.extend(Exchange().submit, 4)
+        self.assertEqual(len(grid.trade_ids), 4)
+        self.assertAlmostEqual(float(grid.grid[0]), float(rates[0]))
+
+    def test_buy_grid_follows_a_rising_market(self):
+        grid = BuyGrid('dash', 'BTC_DASH', 0.049, settings())
+        exchange = Exchange()
+        self.place(grid, exchange)
+        far_end = list(grid.trade_ids[-2:])
+
+        # Room for two levels, 4% apart, between the grid and the market
+        placed = grid.follow(0.054, exchange.submit, exchange.cancel, 4)
+        self.assertEqual(placed, ['5', '6'])
+        self.assertEqual(exchange.cancelled, list(reversed(far_end)))
+        self.assertEqual(grid.trade_ids, ['6', '5', '1', '2'])
+        self.assertLessEqual(float(grid.grid[0]), 0.054 * 0.99)
+        self.assertGreater(float(grid.grid[0]) / 0.96, 0.054 * 0.99)
+        self.assertAlmostEqual(float(grid.far_end), float(grid.grid[-1]))
+
+    def test_a_short_grid_follows_without_cancelling(self):
+        grid = BuyGrid('dash', 'BTC_DASH', 0.049, settings())
+        exchange = Exchange()
+        self.place(grid, exchange)
+        self.assertEqual(grid.follow(0.054, exchange.submit, exchange.cancel, 5), ['5', '6'])
+        self.assertEqual(exchange.cancelled, ['4'])
+        self.assertEqual(len(grid.grid), 5)
+
+    def test_grid_near_the_market_stays(self):
+        grid = SellGrid('dash', 'BTC_DASH', 0.05, settings())
+        exchange = Exchange()
+        self.place(grid, exchange)
+        self.assertEqual(grid.follow(0.0502, exchange.submit, exchange.cancel, 4), [])
+        self.assertEqual(exchange.cancelled, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
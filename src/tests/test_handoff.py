@@ -0,0 +1,57 @@
+# core
+import os
+import socket
+import sys
+import threading
+import unittest
+
+# local
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'batch'))
+import handoff
+from support import TemporaryDirectory
+
+
+class HandoffTest(unittest.TestCase):
+
+    def setUp(self):
+        # Unix socket paths are short: the socket goes in a temporary
+        # directory, by its relative name.
+        self.directory = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.__enter__())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.__exit__()
+
+    def test_the_running_process_drains_and_hands_over(self):
+        running = handoff.Handoff('group1', timeout=5).listen()
+        taken = list()
+        new = threading.Thread(target=lambda: taken.append(handoff.Handoff('group1', timeout=5).take_over()))
+        new.start()
+
+        self.assertTrue(running.stop.wait(5))
+        running.hand_over(dict(runs=dict(agnes=3)))
+        new.join(5)
+        self.assertEqual(taken, [dict(runs=dict(agnes=3))])
+
+    def test_no_process_runs_the_group(self):
+        self.assertIsNone(handoff.Handoff('group1', timeout=1).take_over())
+
+    def test_a_socket_left_by_a_process_that_died(self):
+        os.makedirs('persistence')
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(handoff.socket_file_name('group1'))
+        s.close()
+        self.assertIsNone(handoff.Handoff('group1', timeout=1).take_over())
+
+    def test_a_process_that_does_not_drain_in_time(self):
+        running = handoff.Handoff('group1').listen()
+        self.assertRaises(socket.timeout, handoff.Handoff('group1', timeout=0.2).take_over)
+        self.assertTrue(running.stop.wait(5))
+        # The new process gave up: the running one still exits cleanly.
+        running.hand_over(dict(runs=dict()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# core
+from decimal import Decimal
+import unittest
+
+# local
+from ledger import D, FillAmounts, FillLedger, OrderTally
+import persist
+
+
+def fill(trade_id, direction, amount, rate, fee='0.0015', total=None):
+    f = dict(tradeID=trade_id, type=direction, amount=amount, rate=rate, fee=fee)
+    if total is not None:
+        f['total'] = total
+    return f
+
+
+class FillAmountsTest(unittest.TestCase):
+
+    def test_buy_fee_is_taken_from_the_quote_currency(self):
+        a = FillAmounts(fill(1, 'buy', '0.69000000', '0.04851000', total='0.03347190'))
+        self.assertEqual(a.total, Decimal('0.03347190'))
+        # 0.69 * 0.0015 = 0.001035
+        self.assertEqual(a.fee, Decimal('0.00103500'))
+        self.assertEqual(a.net, Decimal('0.68896500'))
+        self.assertEqual(a.reciprocal_size, a.net)
+
+    def test_sell_fee_is_taken_from_the_base_currency(self):
+        a = FillAmounts(fill(2, 'sell', '1.72500000', '0.05050000'))
+        self.assertEqual(a.total, Decimal('0.08711250'))
+        # 0.0871125 * 0.0015 = 0.00013066875, rounded up
+        self.assertEqual(a.fee, Decimal('0.00013067'))
+        self.assertEqual(a.net, Decimal('0.08698183'))
+        self.assertEqual(a.reciprocal_size, Decimal('1.72500000'))
+
+    def test_floats_are_rounded_down_to_eight_places(self):
+        self.assertEqual(D(0.123456789), Decimal('0.12345678'))
+        self.assertEqual(D('0.123456789'), Decimal('0.123456789'))
+
+
+class OrderTallyTest(unittest.TestCase):
+
+    def test_meets_target_exactly(self):
+        tally = OrderTally('buy', 0.69, chain='11')
+        tally.add(fill(1, 'buy', '0.23000000', '0.04851000'))
+        tally.add(fill(2, 'buy', '0.23000000', '0.04851000'))
+        self.assertFalse(tally.meets_target)
+        self.assertEqual(tally.remaining, Decimal('0.23'))
+        tally.add(fill(3, 'buy', '0.23000000', '0.04851000'))
+        self.assertTrue(tally.meets_target)
+
+    def test_a_fill_counts_once(self):
+        tally = OrderTally('sell', '1', chain='12')
+        self.assertIsNotNone(tally.add(fill(1, 'sell', '0.5', '0.05')))
+        self.assertIsNone(tally.add(fill(1, 'sell', '0.5', '0.05')))
+        self.assertEqual(tally.filled, Decimal('0.5'))
+        self.assertFalse(tally.meets_target)
+
+    def test_round_trip(self):
+        tally = OrderTally('sell', '1', chain='12')
+        tally.add(fill(1, 'sell', '0.5', '0.05'))
+        again = OrderTally.from_dict(tally.as_dict())
+        self.assertEqual(again.as_dict(), tally.as_dict())
+
+
+class FillLedgerTest(unittest.TestCase):
+
+    def test_reciprocals_join_the_chain_of_their_source(self):
+        ledger = FillLedger()
+        ledger.open('11', 'BTC_DASH', 'buy', '0.69')
+        ledger.add('11', fill(1, 'buy', '0.69', '0.04851'))
+        ledger.close('11')
+        ledger.open('21', 'BTC_DASH', 'sell', '0.688965', source='11')
+        self.assertEqual(ledger.chain_of('21'), '11')
+
+        chain = ledger.chains['11']
+        self.assertEqual(chain.live, 1)
+        self.assertEqual(chain.inventory, Decimal('0.68896500'))
+
+    def test_settle_keeps_chains_with_live_or_pending_orders(self):
+        ledger = FillLedger()
+        ledger.open('11', 'BTC_DASH', 'buy', '0.69')
+        ledger.add('11', fill(1, 'buy', '0.69', '0.04851'))
+        ledger.close('11')
+        ledger.open('12', 'BTC_DASH', 'buy', '0.69')
+
+        # 11's fills still wait for a reciprocal.
+        self.assertEqual(ledger.settle(pending=['11']), [])
+        settled = ledger.settle()
+        self.assertEqual([c.chain for c in settled], ['11'])
+        self.assertNotIn('11', ledger.chains)
+        self.assertNotIn('11', ledger.done)
+        # 12 is still live.
+        self.assertIn('12', ledger.chains)
+        self.assertEqual(ledger.settle(), [])
+
+    def test_round_trip(self):
+        ledger = FillLedger()
+        ledger.open('11', 'BTC_DASH', 'buy', '0.69')
+        ledger.add('11', fill(1, 'buy', '0.3', '0.04851'))
+        again = FillLedger().restore(ledger.as_dict())
+        self.assertEqual(again.as_dict(), ledger.as_dict())
+
+
+class ExactFillsMigrationTest(unittest.TestCase):
+
+    def test_schema_1_batches_count_what_their_fills_traded(self):
+        batch = dict(market='BTC_DASH', direction='sell', first_seen=0, amount=0.69,
+                     total=0.0334719, covers=[['11', 1]], sources=['11'], filled_at=None)
+        state = dict(aggregator=dict(batches=[[['BTC_DASH', 'sell', 1], batch]], consumed=[],
+                                     completed=[]),
+                     dust_batches=[])
+        state = persist.migrations[1](state)
+        batch = state['aggregator']['batches'][0][1]
+        self.assertEqual(batch['amount'], '0.69000000')
+        self.assertEqual(batch['filled'], '0.69000000')
+        self.assertEqual(batch['total'], '0.03347190')
+        self.assertEqual(state['ledger'], dict(orders=[], chains=[], done=[]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# core
+import ConfigParser
+import json
+import os
+import StringIO
+import unittest
+
+# local
+import exception
+from markets import MarketMetadata, MarketMetadataCache
+from support import TemporaryDirectory
+
+
+class MarketMetadataTest(unittest.TestCase):
+
+    def test_orders_are_normalized_away_from_the_market(self):
+        m = MarketMetadata('BTC_DASH', 0.00000001, 0.001, 0.0001)
+        for direction, expected in (('sell', 0.05000001), ('buy', 0.05)):
+            rate, amount = m.normalize(direction, 0.050000005, 0.6999)
+            self.assertAlmostEqual(rate, expected, places=10)
+            self.assertAlmostEqual(amount, 0.699, places=10)
+        self.assertRaises(exception.DustTrade, m.normalize, 'buy', 0.05, 0.001)
+
+    def test_refresh_writes_the_metadata_it_built(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(StringIO.StringIO("[pricing]\nminimumTotal: 0.0002\n"))
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'acct.markets.json')
+            cache = MarketMetadataCache(path).refresh(config, ['BTC_DASH'])
+            with open(path) as fp:
+                written = json.load(fp)
+        self.assertEqual(cache.get('BTC_DASH').minimum_total, 0.0002)
+        self.assertEqual(written['markets']['BTC_DASH'], cache.get('BTC_DASH').as_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# core
+import os
+import unittest
+
+# local
+from exchange import InstrumentedAPI
+import metrics
+from support import TemporaryDirectory
+
+
+def registry():
+    r = metrics.Registry()
+    r.counter('calls_total', "Calls", ('endpoint',))
+    r.histogram('call_seconds', "Latency", ('endpoint',), buckets=(0.1, 1))
+    return r
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_metrics_render_as_prometheus_text(self):
+        r = registry()
+        calls, seconds = r.metrics
+        calls.inc(endpoint='returnTicker')
+        calls.inc(2, endpoint='buy')
+        seconds.observe(0.5, endpoint='buy')
+        self.assertEqual(r.render(), "\n".join([
+            '# HELP calls_total Calls',
+            '# TYPE calls_total counter',
+            'calls_total{endpoint="buy"} 2.0',
+            'calls_total{endpoint="returnTicker"} 1.0',
+            '# HELP call_seconds Latency',
+            '# TYPE call_seconds histogram',
+            'call_seconds_bucket{endpoint="buy",le="0.1"} 0.0',
+            'call_seconds_bucket{endpoint="buy",le="1.0"} 1.0',
+            'call_seconds_bucket{endpoint="buy",le="+Inf"} 1.0',
+            'call_seconds_sum{endpoint="buy"} 0.5',
+            'call_seconds_count{endpoint="buy"} 1.0',
+        ]) + "\n")
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(metrics.label_text(('market',), ('a"b\\c\nd',)),
+                         r'{market="a\"b\\c\nd"}')
+
+    def test_totals_carry_on_across_runs(self):
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics', 'agnes')
+            first = registry()
+            first.metrics[0].inc(3, endpoint='buy')
+            first.metrics[1].observe(0.05, endpoint='buy')
+            first.save(path)
+            self.assertTrue(os.path.exists(path + '.prom'))
+
+            second = registry()
+            second.restore(path)
+            second.metrics[0].inc(endpoint='buy')
+            second.metrics[1].observe(2, endpoint='buy')
+            with open(path + '.prom') as fp:
+                self.assertEqual(fp.read(), first.render())
+
+        self.assertEqual(second.metrics[0].values, {('buy',): 4})
+        self.assertEqual(second.metrics[1].values, {('buy',): [[1, 1], 2.05, 2]})
+
+    def test_a_first_run_restores_nothing(self):
+        with TemporaryDirectory() as d:
+            r = registry()
+            r.restore(os.path.join(d, 'agnes'))
+        self.assertEqual(r.metrics[0].values, dict())
+
+
+class API(object):
+
+    def returnTicker(self):
+        return dict()
+
+    def cancelOrder(self, order_number):
+        raise ValueError("Invalid order number")
+
+
+class InstrumentedAPITest(unittest.TestCase):
+
+    def count(self, metric, endpoint):
+        return metric.values.get(('instrumented', endpoint), 0)
+
+    def test_calls_and_errors_are_counted_per_endpoint(self):
+        api = InstrumentedAPI(API(), 'instrumented')
+        before = [(self.count(metrics.api_calls, e), self.count(metrics.api_errors, e))
+                  for e in ('returnTicker', 'cancelOrder')]
+        api.returnTicker()
+        api.returnTicker()
+        self.assertRaises(ValueError, api.cancelOrder, 12)
+        after = [(self.count(metrics.api_calls, e), self.count(metrics.api_errors, e))
+                 for e in ('returnTicker', 'cancelOrder')]
+        self.assertEqual([(c - c0, e - e0) for (c, e), (c0, e0) in zip(after, before)],
+                         [(2, 0), (1, 1)])
+        counts, total, n = metrics.api_latency.values[('instrumented', 'returnTicker')]
+        self.assertGreaterEqual(n, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# core
+import asyncore
+import ConfigParser
+import os
+import smtpd
+import StringIO
+import threading
+import unittest
+
+# local
+from gridtrader import GridTrader
+import mymailer
+from support import TemporaryDirectory
+
+
+class StubSMTPServer(smtpd.SMTPServer):
+    """A local SMTP server that keeps what it is sent."""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = list()
+        self.thread = threading.Thread(target=asyncore.loop, kwargs=dict(timeout=0.05))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, data))
+
+    def stop(self):
+        self.close()
+        self.thread.join()
+
+
+def admin_settings(port, **options):
+    config = ConfigParser.RawConfigParser()
+    config.readfp(StringIO.StringIO(
+        "[admin]\nemail: admin@example.com\nsmtpServer: 127.0.0.1\nsmtpPort: {}\n"
+        "criticalEmail: oncall@example.com\n".format(port)))
+    for option, value in options.items():
+        config.set('admin', option, str(value))
+    return config
+
+
+def traceback_of(error):
+    return "Traceback (most recent call last):\n  File \"gridtrader.py\"\n{}\n".format(error)
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        path = self.directory.__enter__()
+        self.outbox = mymailer.Outbox(os.path.join(path, 'persistence', 'outbox.json'))
+        self.server = StubSMTPServer()
+        self.config = admin_settings(self.server.port, digestInterval=0)
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.__exit__()
+
+    def notify(self, account, error, severity='error', config=None):
+        # A new Outbox each time, as each gridtrader.py run has its own.
+        return mymailer.notify(config or self.config, account, severity,
+                               '({}) Error has occured'.format(account), traceback_of(error),
+                               mymailer.Outbox(self.outbox.path))
+
+    def deliver(self):
+        return mymailer.deliver(self.config, self.outbox)
+
+    def test_repeats_across_runs_are_counted_in_one_message(self):
+        for run in range(3):
+            self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.assertEqual(self.deliver(), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn('(seen 3 times)', self.server.messages[0][1])
+
+    def test_notifications_of_several_accounts_go_out_as_one_digest(self):
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.notify('leelja', 'NotEnoughCoin')
+        self.assertEqual(self.deliver(), 1)
+        recipients, data = self.server.messages[0]
+        self.assertEqual(recipients, ['admin@example.com'])
+        self.assertIn('Subject: (agnes,leelja) 2 notifications', data)
+
+    def test_severities_are_routed(self):
+        self.notify('agnes', 'MarketCrash: BTC_DASH', severity='critical')
+        self.notify('agnes', 'NotEnoughCoin')
+        self.assertEqual(self.deliver(), 2)
+        self.assertEqual(sorted(r for r, data in self.server.messages),
+                         [['admin@example.com'], ['oncall@example.com']])
+
+    def test_digest_interval_holds_across_processes(self):
+        self.config = admin_settings(self.server.port, digestInterval=3600)
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.assertEqual(self.deliver(), 1)
+        self.notify('agnes', 'NotEnoughCoin')
+        self.assertEqual(self.deliver(), 0)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_rate_limit_holds_back_digests(self):
+        self.config = admin_settings(self.server.port, digestInterval=0, maxEmailsPerHour=1)
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.assertEqual(self.deliver(), 1)
+        self.notify('agnes', 'NotEnoughCoin')
+        self.assertEqual(self.deliver(), 0)
+        with self.outbox.locked() as state:
+            self.assertEqual(len(state['pending']), 1)
+
+    def test_repeats_after_sending_are_reported(self):
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.assertEqual(self.deliver(), 1)
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.assertEqual(self.deliver(), 1)
+        data = self.server.messages[1][1]
+        self.assertIn('(repeated)', data)
+        self.assertIn('Seen 2 more times since it was sent.', data)
+        self.assertEqual(self.deliver(), 0)
+
+    def test_what_cannot_be_sent_is_queued_again(self):
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        self.server.stop()
+        self.assertEqual(self.deliver(), 0)
+        with self.outbox.locked() as state:
+            self.assertEqual(len(state['pending']), 1)
+            state['last_digest'] = 0
+
+        self.server = StubSMTPServer()
+        self.config = admin_settings(self.server.port, digestInterval=0)
+        self.assertEqual(self.deliver(), 1)
+
+    def test_courier_delivers_in_the_background(self):
+        courier = mymailer.Courier(self.config, self.outbox, interval=0.05).start()
+        self.notify('agnes', 'MarketCrash: BTC_DASH')
+        for i in range(100):
+            if self.server.messages:
+                break
+            threading.Event().wait(0.05)
+        courier.stop()
+        self.assertEqual(len(self.server.messages), 1)
+
+
+class UnreachableExchange(object):
+
+    def cancelAllOpen(self):
+        raise IOError("Connection refused")
+
+
+class NotifyAdminTest(unittest.TestCase):
+
+    def test_notification_is_queued_before_cancelling(self):
+        with TemporaryDirectory() as d:
+            cwd = os.getcwd()
+            os.chdir(d)
+            try:
+                g = object.__new__(GridTrader)
+                g.config, g.account, g.exchange = admin_settings(25), 'agnes', UnreachableExchange()
+                g.notify_admin(traceback_of('MarketCrash: BTC_DASH'))
+                with mymailer.Outbox(mymailer.outbox_file_name()).locked() as state:
+                    subjects = [n['subject'] for n in state['pending']]
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(subjects, ['(agnes) Error has occured', '(agnes) Open orders not cancelled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# core
+import time
+import unittest
+
+# local
+import orderbook
+
+
+def trade(trade_id, t, rate='0.05'):
+    return dict(tradeID=trade_id, rate=rate, amount='0.1', type='buy',
+                date=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)))
+
+
+class Tape(object):
+    """Answers publicTrades with TRADES, whatever the range asked."""
+
+    def __init__(self, trades):
+        self.trades = trades
+
+    def publicTrades(self, market, start, end=None):
+        return self.trades
+
+
+class MarketMirrorTest(unittest.TestCase):
+
+    def refresh_twice(self, n):
+        now = int(time.time())
+        mirror = orderbook.MarketMirror('BTC_DASH')
+        mirror.refresh(Tape([trade(1, now - 60)]), 0, 10)
+        tape = Tape([trade(i, now - 30 + i % 30) for i in range(2, n + 2)])
+        return mirror.refresh(tape, 0, 10)
+
+    def test_a_quiet_tape_keeps_the_mirror_synced(self):
+        self.assertTrue(self.refresh_twice(10).synced)
+
+    def test_a_capped_tape_loses_sync(self):
+        mirror = self.refresh_twice(orderbook.public_trades_limit)
+        self.assertFalse(mirror.synced)
+        # What it did get still counts.
+        self.assertEqual(mirror.low, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
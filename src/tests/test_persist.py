@@ -0,0 +1,97 @@
+# core
+import ConfigParser
+import os
+import StringIO
+import unittest
+
+# 3rd party
+import dill
+
+# local
+import exception
+from gridtrader import BuyGrid, GridTrader, ReciprocalBuy, ReciprocalSell, SellGrid
+from mynumbers import F
+import persist
+from settings import load_settings
+from support import TemporaryDirectory, sample_ini, write_file
+
+
+def baseline_object(cls, **attributes):
+    """An instance of CLS with only ATTRIBUTES, as versions before the
+    state schema pickled it."""
+    o = object.__new__(cls)
+    o.__dict__.update(attributes)
+    return o
+
+
+def baseline_trader():
+    """A GridTrader laid out as the versions before the state schema
+    pickled it: grid parameters were properties of the config, and
+    reciprocals held the exchange, config and grids."""
+    config = ConfigParser.RawConfigParser()
+    config.readfp(StringIO.StringIO(sample_ini))
+    exchange = object()
+
+    grids = dict()
+    for direction, cls, price, rates in (
+            ('sell', SellGrid, '0.05', ['0.0505', '0.051005']),
+            ('buy', BuyGrid, '0.049', ['0.04851', '0.0465696'])):
+        grids[direction] = baseline_object(
+            cls, initial_core_position=F(6.9), trade_ids=['11', '12'], trade_ids_filled=[0],
+            quote='dash', pair='BTC_DASH', current_market_price=F(price), config=config,
+            grid=[F(rate) for rate in rates])
+
+    reciprocal = baseline_object(
+        ReciprocalSell, reciprocant_trade_id=501, config=config, market='BTC_DASH',
+        exchange=exchange, rate_of_closed_trade=F('0.04851'), size_of_closed_trade=F('0.69'),
+        grid=grids, trade_id='21')
+    dust = baseline_object(
+        ReciprocalBuy, reciprocant_trade_id=502, config=config, market='BTC_DASH',
+        exchange=exchange, rate_of_closed_trade=0.0505, size_of_closed_trade=0.001,
+        grid=grids, trade_id=None)
+
+    return baseline_object(
+        GridTrader, exchange=exchange, config=config, base='btc', account='acct',
+        market=dict(BTC_DASH=dict(lowestAsk=F('0.05'), highestBid=F('0.049'))),
+        reciprocal=dict(BTC_DASH=dict(sell={501: reciprocal}, buy=dict())),
+        reciprocal_dust=[dust], grids=dict(BTC_DASH=grids))
+
+
+class BaselinePickleTest(unittest.TestCase):
+
+    def test_baseline_pickle_is_converted(self):
+        with TemporaryDirectory() as d:
+            storage = os.path.join(d, 'acct.storage')
+            with open(storage, 'wb') as fp:
+                dill.dump(baseline_trader(), fp)
+
+            state = persist.Persist(storage).retrieve()
+            config = load_settings(write_file(d, 'acct.ini', sample_ini))
+            g = GridTrader.from_dict(state, None, config)
+
+            sell = g.grids['BTC_DASH']['sell']
+            self.assertEqual(sell.trade_ids, ['11', '12'])
+            self.assertEqual(sell.trade_ids_filled, [0])
+            self.assertEqual(sell.numberOfOrders, 4)
+            self.assertAlmostEqual(float(sell.size), 6.9 / 4)
+            self.assertAlmostEqual(float(sell.far_end), 0.051005)
+            self.assertAlmostEqual(float(g.grids['BTC_DASH']['buy'].increments), 0.04)
+
+            r = g.reciprocal['BTC_DASH']['sell'][501]
+            self.assertIsInstance(r, ReciprocalSell)
+            self.assertEqual(r.trade_id, '21')
+            self.assertAlmostEqual(r.size_of_closed_trade, 0.69)
+            self.assertIsInstance(g.reciprocal_dust[0], ReciprocalBuy)
+            self.assertEqual(g.orders, dict())
+
+            # Stored again in the current schema, it reads back the same.
+            persist.Persist(storage).store(g)
+            again = GridTrader.from_dict(persist.Persist(storage).retrieve(), None, config)
+            self.assertEqual(again.as_dict(), g.as_dict())
+
+    def test_newer_schema_is_refused(self):
+        self.assertRaises(exception.UnknownStateSchema, persist.migrate, persist.schema_version + 1, dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
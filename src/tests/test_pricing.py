@@ -0,0 +1,71 @@
+# core
+import ConfigParser
+import StringIO
+import unittest
+
+# local
+from markets import MarketMetadata
+from pricing import PricingTable, build_pricing_tables
+from support import sample_ini
+
+
+class Metadata(object):
+    """What build_pricing_tables needs of a MarketMetadataCache."""
+
+    def __init__(self, markets):
+        self.markets = markets
+
+    def get(self, market):
+        return self.markets[market]
+
+
+class PricingTableTest(unittest.TestCase):
+
+    def test_rates_are_rounded_to_the_tick_away_from_the_closed_trade(self):
+        sell = PricingTable('BTC_DASH', 'sell', 1.0, 0.00001, 0.0001)
+        buy = PricingTable('BTC_DASH', 'buy', 1.0, 0.00001, 0.0001)
+        # 0.04851 * 1.01 = 0.0489951 and 0.04851 * 0.99 = 0.0480249
+        self.assertAlmostEqual(sell.rate(0.04851), 0.049, places=10)
+        self.assertAlmostEqual(buy.rate(0.04851), 0.04802, places=10)
+
+    def test_float_noise_does_not_move_a_rate_by_a_tick(self):
+        # In floats 0.07 * 1.01 is 7070000.000000001 ticks and 0.03 * 0.99
+        # is 2969999.9999999995: whole numbers of ticks but for the noise.
+        sell = PricingTable('BTC_DASH', 'sell', 1.0, 0.00000001, 0.0001)
+        buy = PricingTable('BTC_DASH', 'buy', 1.0, 0.00000001, 0.0001)
+        self.assertAlmostEqual(sell.rate(0.07), 0.0707, places=10)
+        self.assertAlmostEqual(buy.rate(0.03), 0.0297, places=10)
+
+    def test_an_order_below_the_minimum_total_is_dust(self):
+        table = PricingTable('BTC_DASH', 'buy', 0.5, 0.00000001, 0.0001)
+        self.assertTrue(table.is_dust(0.05, 0.0019))
+        self.assertFalse(table.is_dust(0.05, 0.002))
+
+
+class BuildPricingTablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigParser.RawConfigParser()
+        self.config.readfp(StringIO.StringIO(sample_ini + "\n[pricing]\ntickSize: 0.000001\n"))
+
+    def test_the_settings_price_every_market(self):
+        tables = build_pricing_tables(self.config, ['BTC_DASH', 'BTC_STRAT'])
+        for market in 'BTC_DASH', 'BTC_STRAT':
+            self.assertEqual(tables[market]['sell'].tick_size, 0.000001)
+            self.assertEqual(tables[market]['buy'].minimum_total, 0.0001)
+        self.assertAlmostEqual(tables['BTC_DASH']['sell'].multiplier, 1.01)
+        self.assertAlmostEqual(tables['BTC_DASH']['buy'].multiplier, 0.995)
+
+    def test_market_metadata_overrides_the_settings(self):
+        metadata = Metadata(dict(
+            BTC_DASH=MarketMetadata('BTC_DASH', 0.0001, 0.001, 0.001),
+            BTC_STRAT=MarketMetadata('BTC_STRAT', 0.00000001, 0.001, 0.0001)))
+        tables = build_pricing_tables(self.config, ['BTC_DASH', 'BTC_STRAT'], metadata)
+        self.assertEqual(tables['BTC_DASH']['sell'].tick_size, 0.0001)
+        self.assertEqual(tables['BTC_DASH']['buy'].minimum_total, 0.001)
+        self.assertEqual(tables['BTC_STRAT']['sell'].tick_size, 0.00000001)
+        self.assertAlmostEqual(tables['BTC_DASH']['sell'].rate(0.04851), 0.0490, places=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# core
+import ConfigParser
+import os
+import StringIO
+import unittest
+
+# local
+from gridtrader import BuyGrid, Grid, GridTrader
+import mymailer
+import orders
+from shadow import ShadowExchange
+from support import TemporaryDirectory, Ticker, sample_ini
+
+
+def trade(order_number, amount, rate='0.04851000', direction='buy'):
+    return dict(orderNumber=order_number, type=direction, rate=rate, amount=amount)
+
+
+class History(object):
+
+    def __init__(self, trades):
+        self.trades = trades
+
+    def tradeHistory(self, market, start):
+        return self.trades
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigParser.RawConfigParser()
+        self.config.readfp(StringIO.StringIO(sample_ini))
+        self.g = object.__new__(GridTrader)
+        self.g.config, self.g.account, self.g.orders = self.config, 'agnes', dict()
+        self.g.exchange = History([])
+        self.record = orders.OrderRecord(
+            'BTC_DASH', 'buy', '0.04851', '0.69', dict(kind='grid', market='BTC_DASH', direction='buy', level=1))
+
+    def find(self, trades):
+        self.g.exchange = History(trades)
+        return self.g.find_trade_id(self.record, dict(), set())
+
+    def test_filled_order_is_found_by_rate_and_amount(self):
+        self.assertEqual(self.find([
+            trade('41', '0.34500000'),                      # another level's: same rate, half the size
+            trade('42', '0.30000000'), trade('42', '0.39000000')]), '42')
+
+    def test_a_tie_goes_to_the_order_placed_first(self):
+        trades = [trade('47', '0.69000000'), trade('42', '0.30000000'), trade('42', '0.39000000')]
+        self.assertEqual(self.find(trades), '42')
+        # The next record alike takes the other one.
+        self.g.exchange = History(trades)
+        self.assertEqual(self.g.find_trade_id(self.record, dict(), set(['42'])), '47')
+
+        open_orders = dict(BTC_DASH=[
+            dict(orderNumber=n, type='buy', rate='0.04851000', amount='0.69000000')
+            for n in ('100', '99')])
+        self.assertEqual(self.g.find_trade_id(self.record, open_orders, set()), '99')
+
+    def test_order_of_another_size_at_the_same_rate_is_not_taken(self):
+        self.assertIsNone(self.find([trade('43', '0.34500000')]))
+        self.assertIsNone(self.find([trade('44', '0.69000000', direction='sell')]))
+
+    def test_order_with_fills_at_other_rates_is_not_taken(self):
+        self.assertIsNone(self.find([trade('45', '0.30000000'),
+                                     trade('45', '0.39000000', rate='0.04800000')]))
+
+    def test_level_out_of_order_is_alerted(self):
+        grid = BuyGrid('dash', 'BTC_DASH', 0.049, self.config)
+        self.g.grids = dict(BTC_DASH=dict(buy=grid))
+        self.record.order_number = '46'
+        with TemporaryDirectory() as d:
+            cwd = os.getcwd()
+            os.chdir(d)
+            try:
+                self.g.attach(self.record)
+                with mymailer.Outbox(mymailer.outbox_file_name()).locked() as state:
+                    subjects = [n['subject'] for n in state['pending']]
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(grid.trade_ids, [])
+        self.assertEqual(subjects, ['(agnes) Order not reconciled'])
+
+
+class TrackFillsTest(unittest.TestCase):
+
+    def test_fills_are_journaled(self):
+        with TemporaryDirectory() as d:
+            g = object.__new__(GridTrader)
+            g.journal = orders.OrderJournal(os.path.join(d, 'agnes.journal'))
+            record = g.journal.intent('BTC_DASH', 'buy', 0.04851, 0.69, dict(kind='grid'))
+            g.journal.transition(record, orders.SUBMITTED)
+            g.journal.transition(record, orders.ACKNOWLEDGED, order_number='41')
+            g.orders = {'41': record}
+
+            g.track_fills('41', False)
+            g.track_fills('41', False)
+            partly = [r.state for r in g.journal.records()]
+            g.track_fills('41', True)
+            with open(g.journal.journal_file) as fp:
+                lines = len(fp.readlines())
+            done = [r.state for r in g.journal.records()]
+
+        self.assertEqual(partly, [orders.PARTIALLY_FILLED])
+        self.assertEqual(done, [orders.FILLED])
+        self.assertEqual(lines, 5) # intent, submitted, acknowledged, partially filled, filled
+        self.assertEqual(g.orders, dict())
+
+
+class FollowReconcileTest(unittest.TestCase):
+
+    def test_levels_a_grid_followed_the_market_with_are_put_back_in_front(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(StringIO.StringIO(sample_ini))
+        with TemporaryDirectory() as d:
+            journal = orders.OrderJournal(os.path.join(d, 'agnes.journal'))
+            g = GridTrader(ShadowExchange(Ticker(), ticker_ttl=0), config, 'agnes', journal=journal)
+            g.build_new_grids()
+            g.issue_trades()
+            grid = g.grids['BTC_DASH']['buy']
+            stored, stored_orders = grid.as_dict(), dict(g.orders)
+
+            # The market rose two levels; the process dies before storing
+            # the grid that followed it.
+            placed = grid.follow(0.054, g.submit, g.cancel_order, 4)
+            followed = (list(grid.trade_ids), [float(rate) for rate in grid.grid])
+            g.grids['BTC_DASH']['buy'] = Grid.from_dict(stored, config)
+            g.orders = stored_orders
+            g.reconcile()
+
+        grid = g.grids['BTC_DASH']['buy']
+        self.assertEqual(len(placed), 2)
+        self.assertEqual(grid.trade_ids, followed[0])
+        for rate, expected in zip(grid.grid, followed[1]):
+            self.assertAlmostEqual(float(rate), expected)
+        self.assertAlmostEqual(float(grid.far_end), followed[1][-1])
+        self.assertTrue(set(grid.trade_ids) <= set(g.orders))
+        self.assertEqual(len([n for n in g.orders if n in stored['trade_ids']]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# core
+import os
+import time
+import unittest
+
+# local
+import exception
+from gridtrader import GridTrader
+import mymailer
+import orderbook
+import recorder
+from shadow import ShadowExchange
+from support import TemporaryDirectory
+
+
+class StubAPI(object):
+    """Answers as an exchange would, for RecordingAPI to record."""
+
+    def returnTicker(self):
+        return dict(BTC_DASH=dict(lowestAsk='0.05', highestBid='0.049'))
+
+    def buy(self, market, rate, amount):
+        return dict(orderNumber=str(int(float(rate) * 1e6)))
+
+    def cancelOrder(self, order_number):
+        raise ValueError("Invalid order number, or you are not the person who placed the order.")
+
+    def returnTradeHistoryPublic(self, market, start, end=None):
+        return [dict(tradeID=start % 1000, rate='0.0501', amount='0.1', type='buy',
+                     date=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)))]
+
+    def returnOrderBook(self, market, depth):
+        return dict(bids=[['0.049', '1']], asks=[['0.05', '1']])
+
+
+class Exchange(object):
+    """What orderbook.py and ShadowExchange call, over API as
+    PoloniexFacade puts it."""
+
+    def __init__(self, api):
+        self.api = api
+        self.clock = api.clock
+
+    def returnTicker(self):
+        return self.api.returnTicker()
+
+    def publicTrades(self, market, start, end=None):
+        return self.api.returnTradeHistoryPublic(market, start=int(start))
+
+    def orderBook(self, market, depth):
+        return self.api.returnOrderBook(market, depth=depth)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.__enter__(), 'recordings', 'run.jsonl.gz')
+        api = recorder.RecordingAPI(StubAPI(), self.log_file)
+        api.returnTicker()
+        api.buy('BTC_DASH', 0.04851, 0.69)
+        api.buy('BTC_DASH', 0.0465696, 0.69)
+        self.assertRaises(ValueError, api.cancelOrder, '12')
+        api.flush()
+        recorder.recorders.remove(api)
+        self.replay = recorder.ReplayAPI(self.log_file, speed=0)
+
+    def tearDown(self):
+        self.directory.__exit__()
+
+    def test_calls_get_the_answer_recorded_for_their_arguments(self):
+        self.assertEqual(self.replay.buy('BTC_DASH', 0.0465696, 0.69), dict(orderNumber='46569'))
+        self.assertEqual(self.replay.buy('BTC_DASH', 0.04851, 0.69), dict(orderNumber='48510'))
+        self.assertEqual(self.replay.returnTicker()['BTC_DASH']['lowestAsk'], '0.05')
+
+    def test_a_call_not_recorded_gets_no_other_calls_answer(self):
+        self.assertRaises(exception.ReplayMismatch, self.replay.buy, 'BTC_DASH', 0.0485, 0.69)
+        # The recorded calls are still there for the calls they answer.
+        self.assertEqual(self.replay.buy('BTC_DASH', 0.04851, 0.69), dict(orderNumber='48510'))
+
+    def test_a_call_replayed_once_is_exhausted(self):
+        self.replay.returnTicker()
+        self.assertRaises(exception.ReplayExhausted, self.replay.returnTicker)
+
+    def test_recorded_errors_are_raised_again(self):
+        self.assertRaises(exception.ReplayedError, self.replay.cancelOrder, '12')
+
+
+class ReplayClockTest(unittest.TestCase):
+
+    def test_an_order_book_refresh_and_ticker_replay_at_the_recorded_times(self):
+        with TemporaryDirectory() as d:
+            log_file = os.path.join(d, 'run.jsonl.gz')
+            api = recorder.RecordingAPI(StubAPI(), log_file)
+            mirror = orderbook.MarketMirror('BTC_DASH').refresh(Exchange(api), 1, 10)
+            shadow = ShadowExchange(Exchange(api), ticker_ttl=5)
+            shadow.tickerFor('BTC_DASH')
+            shadow.tickerFor('BTC_DASH')
+            api.flush()
+            recorder.recorders.remove(api)
+
+            # Later, and as fast as it goes
+            time.sleep(1.1)
+            replay = recorder.ReplayAPI(log_file, speed=0)
+            replayed = orderbook.MarketMirror('BTC_DASH').refresh(Exchange(replay), 1, 10)
+            shadow = ShadowExchange(Exchange(replay), ticker_ttl=5)
+            shadow.tickerFor('BTC_DASH')
+            shadow.tickerFor('BTC_DASH')
+
+        self.assertEqual(replayed.as_dict(), mirror.as_dict())
+        self.assertEqual((replayed.low, replayed.high), (0.049, 0.0501))
+        self.assertEqual(replay.replayed, [True] * len(replay.records))
+
+
+class ReplayingExchange(object):
+    replaying = True
+
+    def cancelAllOpen(self):
+        raise AssertionError("A replay cancelled the open orders")
+
+
+class NotifyAdminDuringReplayTest(unittest.TestCase):
+
+    def test_a_replay_neither_mails_nor_cancels(self):
+        with TemporaryDirectory() as d:
+            cwd = os.getcwd()
+            os.chdir(d)
+            try:
+                for exchange in ReplayingExchange(), ShadowExchange(ReplayingExchange()):
+                    g = object.__new__(GridTrader)
+                    g.config, g.account, g.exchange = None, 'agnes.replay', exchange
+                    g.notify_admin("Traceback (most recent call last):\nReplayMismatch\n")
+                self.assertFalse(os.path.exists(mymailer.outbox_file_name()))
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# core
+import unittest
+
+# local
+import archive
+import report
+
+
+def fill_record(market, trade_id, direction='sell'):
+    return dict(kind=archive.FILL, market=market, direction=direction, role='grid',
+                order='11', tradeID=trade_id, rate=0.05, amount=0.69, total=0.0345,
+                fee=0.0015, opens_rate=None)
+
+
+class AccountReportTest(unittest.TestCase):
+
+    def test_markets_may_share_trade_ids(self):
+        r = report.AccountReport('agnes')
+        for market in 'BTC_DASH', 'BTC_STRAT', 'BTC_DASH':
+            r.add(fill_record(market, 7))
+        self.assertEqual(r.tally('BTC_DASH').grid_fills, 1)
+        self.assertEqual(r.tally('BTC_STRAT').grid_fills, 1)
+
+    def test_only_the_latest_fills_are_remembered(self):
+        r = report.AccountReport('agnes')
+        for trade_id in range(report.recent_records + 5):
+            r.add(fill_record('BTC_DASH', trade_id))
+        self.assertEqual(len(r.recent), report.recent_records)
+        self.assertEqual(r.recent_keys, set(r.recent))
+        self.assertNotIn(('BTC_DASH', 4), r.recent_keys)
+
+    def test_replayed_levels_and_orders_count_once(self):
+        r = report.AccountReport('agnes')
+        for i in range(2):
+            for order in '11', '12':
+                r.add(dict(kind=archive.LEVEL, market='BTC_DASH', direction='sell', order=order,
+                           rate=0.05, amount=0.69))
+            r.add(dict(kind=archive.ORDER, market='BTC_DASH', direction='sell', order='11',
+                       rate=0.05, amount=0.69, role='grid', state='filled'))
+        t = r.tally('BTC_DASH')
+        self.assertEqual((t.levels_placed, t.levels_filled), (2, 1))
+        self.assertEqual(t.utilization, 50.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
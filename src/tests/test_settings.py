@@ -0,0 +1,71 @@
+# core
+import os
+import stat
+import time
+import unittest
+
+# local
+import exception
+import settings
+from support import TemporaryDirectory, sample_ini, write_file
+
+
+class ReloadTest(unittest.TestCase):
+
+    def edit(self, text):
+        write_file(self.directory, 'acct.ini', text)
+        # A new mtime and size, whatever the clock's resolution.
+        self.edits += 1
+        t = time.time() + self.edits
+        os.utime(self.path, (t, t))
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.directory = self.tmp.__enter__()
+        self.path = write_file(self.directory, 'acct.ini', sample_ini)
+        self.alerts = list()
+        self.edits = 0
+
+    def tearDown(self):
+        self.tmp.__exit__()
+
+    def test_an_invalid_edit_keeps_the_settings_loaded_before(self):
+        config = settings.load_settings(self.path)
+        self.edit(sample_ini.replace('numberOfOrders: 4', 'numberOfOrders: many', 1))
+        self.assertRaises(exception.InvalidConfig, settings.load_settings, self.path)
+
+        for check in range(3):
+            again = config.reload_if_changed(self.alerts.append)
+            self.assertIs(again, config)
+        self.assertEqual(len(self.alerts), 1)
+        self.assertIn('numberoforders', self.alerts[0])
+
+        self.edit(sample_ini.replace('numberOfOrders: 4', 'numberOfOrders: 5', 1))
+        again = config.reload_if_changed(self.alerts.append)
+        self.assertEqual(again.getint('sellgrid', 'numberOfOrders'), 5)
+
+    def test_the_cache_is_private(self):
+        settings.load_settings(self.path)
+        mode = os.stat(settings.cache_file_name(self.path)).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0600)
+
+
+class AggregationTest(unittest.TestCase):
+
+    def load(self, options):
+        with TemporaryDirectory() as d:
+            return settings.load_settings(write_file(d, 'acct.ini', sample_ini + "\n[aggregation]\n" + options))
+
+    def test_batches_that_may_never_complete_are_refused(self):
+        for options in ("mode: order\n", "mode: bucket\nmaxAge: 0\n",
+                        "mode: window\nmaxAge: 0\nflushTotal: 0\n"):
+            self.assertRaises(exception.InvalidConfig, self.load, options)
+
+    def test_batches_with_a_limit_are_taken(self):
+        for options in ("mode: fill\n", "mode: order\nmaxAge: 3600\n",
+                        "mode: window\nmaxAge: 0\nflushTotal: 0.01\n"):
+            self.assertTrue(self.load(options).has_section('aggregation'))
+
+
+if __name__ == '__main__':
+    unittest.main()
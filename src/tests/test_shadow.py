@@ -0,0 +1,76 @@
+# core
+import calendar
+import os
+import time
+import unittest
+
+# local
+from exchange import PoloniexAPIData
+import shadow
+from support import TemporaryDirectory
+
+
+class StubExchange(object):
+    """Gives a ticker the test can move."""
+
+    def __init__(self, ask, bid):
+        self.ticker = dict(BTC_DASH=dict(lowestAsk=ask, highestBid=bid))
+
+    def returnTicker(self):
+        return self.ticker
+
+
+class ShadowExchangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.live = StubExchange('0.05', '0.049')
+        self.exchange = shadow.ShadowExchange(self.live, ticker_ttl=0)
+
+    def fill_buy(self, rate='0.04851'):
+        order_number = self.exchange.buy('BTC_DASH', rate, 0.69).orderNumber
+        self.live.ticker['BTC_DASH']['lowestAsk'] = rate
+        return order_number, self.exchange.fills(order_number)
+
+    def test_finished_orders_are_not_stored(self):
+        filled, trades = self.fill_buy()
+        self.assertEqual(len(trades), 1)
+        cancelled = self.exchange.sell('BTC_DASH', '0.0505', 0.69).orderNumber
+        self.exchange.cancelOrders([cancelled])
+        open_order = self.exchange.sell('BTC_DASH', '0.051005', 0.69).orderNumber
+
+        d = self.exchange.book.as_dict()
+        self.assertEqual(d['orders'].keys(), [open_order])
+        self.assertEqual(len(d['actions']), 5)
+
+        book = shadow.VirtualBook().restore(d)
+        self.assertEqual(book.place('buy', 'BTC_DASH', '0.0465696', 0.69).orderNumber,
+                         str(int(open_order) + 1))
+
+    def test_fills_the_trader_has_not_collected_are_stored(self):
+        first = self.exchange.buy('BTC_DASH', '0.04851', 0.69).orderNumber
+        second, trades = self.fill_buy('0.0485')
+        # Both filled, but only the fills of the second were asked for.
+        self.assertEqual(self.exchange.book.as_dict()['orders'].keys(), [first])
+
+        book = shadow.VirtualBook().restore(self.exchange.book.as_dict())
+        book.match('BTC_DASH', PoloniexAPIData(lowestAsk='0.04', highestBid='0.039'))
+        self.assertEqual(book.next_trade_id, trades[0]['tradeID'] + 2)
+
+    def test_trade_history_starts_at_start(self):
+        order_number, trades = self.fill_buy()
+        date = self.exchange.book.orders[order_number]['trades'][0]['date']
+        filled_at = calendar.timegm(time.strptime(date, '%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(len(self.exchange.tradeHistory('BTC_DASH', filled_at - 60)), 1)
+        self.assertEqual(self.exchange.tradeHistory('BTC_DASH', filled_at + 60), [])
+
+    def test_reports_are_added_to_the_file(self):
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'reports', 'agnes.shadow.txt')
+            for run in range(2):
+                shadow.write_report(path, shadow.report(self.exchange.book, [('monitor', 0.5)], 0))
+            with open(path) as fp:
+                self.assertEqual(fp.read().count('Shadow run would have done:'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
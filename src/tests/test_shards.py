@@ -0,0 +1,62 @@
+# core
+import os
+import sys
+import unittest
+
+# local
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'batch'))
+import shards
+
+
+class DeadProcess(object):
+    exitcode = 1
+
+    def is_alive(self):
+        return False
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = shards.Supervisor(
+            'group', ['agnes', 'leelja'], 1, None, dict(calls_per_minute=60), None)
+        self.alerts = list()
+        self.supervisor.alert = lambda severity, subject, body: self.alerts.append(subject)
+        self.supervisor.start = self.start
+
+    def start(self, shard_id, accounts):
+        self.supervisor.shards[shard_id] = (DeadProcess(), accounts)
+
+    def die(self):
+        """Let shard 0 die, and restart it when due."""
+        self.supervisor.check()
+        for shard_id, (due, accounts) in self.supervisor.waiting.items():
+            self.supervisor.waiting[shard_id] = (0, accounts)
+        self.supervisor.check()
+
+    def test_restarts_back_off(self):
+        self.start(0, ['agnes', 'leelja'])
+        self.supervisor.check()
+        due, accounts = self.supervisor.waiting[0]
+        self.supervisor.check()
+        self.assertNotIn(0, self.supervisor.shards)
+
+        self.supervisor.waiting[0] = (0, accounts)
+        self.supervisor.check()
+        self.assertIn(0, self.supervisor.shards)
+        self.supervisor.check()
+        later, accounts = self.supervisor.waiting[0]
+        self.assertGreater(later - due, shards.restart_backoff / 2)
+
+    def test_a_shard_that_keeps_dying_is_left_down(self):
+        self.start(0, ['agnes', 'leelja'])
+        for death in range(shards.max_restarts + 1):
+            self.die()
+        self.assertEqual(self.supervisor.shards, dict())
+        self.assertEqual(self.supervisor.waiting, dict())
+        self.assertEqual(self.alerts[-1], 'Shard 0 left down')
+        self.assertEqual(len(self.supervisor.restarts[0]), shards.max_restarts)
+
+
+if __name__ == '__main__':
+    unittest.main()
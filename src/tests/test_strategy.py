@@ -0,0 +1,179 @@
+# core
+import ConfigParser
+import StringIO
+import time
+import unittest
+
+# local
+import aggregation
+from exchange import PoloniexAPIData
+from gridtrader import GridTrader
+from pricing import PricingTable
+from shadow import ShadowExchange
+import strategy
+from support import Ticker, sample_ini
+
+
+def params(mode=aggregation.FILL, minimum_total=0.0001, max_age=0.0):
+    grid = dict(majorLevel=1.0, numberOfOrders=2, increments=0.01, size=1.0)
+    return dict(
+        pricing=dict(BTC_DASH=dict(
+            sell=PricingTable('BTC_DASH', 'sell', 1.0, 0.00000001, minimum_total),
+            buy=PricingTable('BTC_DASH', 'buy', 0.5, 0.00000001, minimum_total))),
+        aggregation=dict(mode=mode, bucket_percent=1.0, max_age=max_age, flush_total=0.0),
+        grids=dict(BTC_DASH=dict(sell=dict(grid), buy=dict(grid))))
+
+
+def tick(t=0, bid=0.049, ask=0.05):
+    return dict(kind=strategy.TICK, market='BTC_DASH', bid=bid, ask=ask, time=t)
+
+
+def fill(order, direction, rate, amount, trade_id, t=0):
+    return dict(kind=strategy.FILL, market='BTC_DASH', direction=direction, order=order, time=t,
+                fill=dict(tradeID=trade_id, type=direction, rate=rate, amount=amount,
+                          fee='0.00150000', date=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))))
+
+
+def done(order):
+    return dict(kind=strategy.DONE, order=order)
+
+
+class GridStrategyTest(unittest.TestCase):
+
+    def start(self, **options):
+        self.strategy = strategy.GridStrategy(params(**options))
+        state, intents = self.strategy.step(self.strategy.initial_state(), [tick()])
+        self.grid = dict(((i['direction'], i['level']), i) for i in intents)
+        return state
+
+    def test_first_tick_builds_the_grids(self):
+        self.start()
+        self.assertEqual(sorted(self.grid), [('buy', 0), ('buy', 1), ('sell', 0), ('sell', 1)])
+        self.assertAlmostEqual(self.grid['sell', 0]['rate'], 0.0505)
+        self.assertAlmostEqual(self.grid['sell', 1]['rate'], 0.051005)
+        self.assertAlmostEqual(self.grid['buy', 0]['rate'], 0.04851)
+
+    def test_later_ticks_place_nothing(self):
+        state = self.start()
+        state, intents = self.strategy.step(state, [tick(1, 0.03, 0.031)])
+        self.assertEqual(intents, [])
+
+    def test_step_leaves_the_state_it_was_given(self):
+        state = self.start()
+        state, intents = self.strategy.step(state, [fill('11', 'sell', '0.05050000', '0.40000000', 1)])
+        before = repr(state)
+        self.strategy.step(state, [fill('11', 'sell', '0.05050000', '0.60000000', 2), tick(1)])
+        self.assertEqual(repr(state), before)
+
+    def test_a_buy_fill_gets_a_sell_net_of_its_fee(self):
+        state = self.start()
+        state, intents = self.strategy.step(
+            state, [fill('12', 'buy', '0.04851000', '1.00000000', 1), done('12'), tick(1)])
+        [sell] = intents
+        self.assertEqual((sell['kind'], sell['direction'], sell['role']), (strategy.PLACE, 'sell', 'reciprocal'))
+        self.assertAlmostEqual(sell['amount'], 0.9985)
+        self.assertAlmostEqual(sell['rate'], 0.0489951)
+        self.assertEqual(sell['covers'], [['12', 1]])
+
+    def test_a_sell_fill_gets_a_buy_of_what_it_sold(self):
+        state = self.start()
+        state, [buy] = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '1.00000000', 1), tick(1)])
+        self.assertAlmostEqual(buy['amount'], 1.0)
+        self.assertAlmostEqual(buy['rate'], 0.0502475)
+
+    def test_fills_wait_for_a_tick(self):
+        state = self.start()
+        state, intents = self.strategy.step(state, [fill('11', 'sell', '0.05050000', '1.00000000', 1)])
+        self.assertEqual(intents, [])
+        self.assertEqual(strategy.waiting(state), set(['11']))
+
+    def test_order_aggregation_waits_for_the_order_to_fill(self):
+        state = self.start(mode=aggregation.ORDER)
+        state, intents = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '0.40000000', 1), tick(1)])
+        self.assertEqual(intents, [])
+        state, intents = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '0.60000000', 2), done('11'), tick(2)])
+        [buy] = intents
+        self.assertAlmostEqual(buy['amount'], 1.0)
+        self.assertAlmostEqual(buy['opens_rate'], 0.0505)
+
+    def test_window_aggregation_flushes_by_the_time_of_the_ticks(self):
+        state = self.start(mode=aggregation.WINDOW, max_age=60)
+        state, intents = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '0.40000000', 1, t=0), tick(30)])
+        self.assertEqual(intents, [])
+        state, intents = self.strategy.step(
+            state, [fill('11', 'sell', '0.05060000', '0.60000000', 2, t=40), tick(60)])
+        [buy] = intents
+        self.assertAlmostEqual(buy['amount'], 1.0)
+        self.assertAlmostEqual(buy['opens_rate'], 0.05056)
+
+    def test_a_fill_is_batched_once(self):
+        state = self.start()
+        state, intents = self.strategy.step(state, [
+            fill('11', 'sell', '0.05050000', '1.00000000', 1),
+            fill('11', 'sell', '0.05050000', '1.00000000', 1), tick(1)])
+        self.assertEqual([i['amount'] for i in intents], [1.0])
+
+    def test_dust_joins_the_next_reciprocal(self):
+        state = self.start(minimum_total=0.03)
+        state, [dust] = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '0.40000000', 1), tick(1)])
+        self.assertEqual(dust['kind'], strategy.DUST)
+        state, [buy] = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '0.60000000', 2), tick(2)])
+        self.assertEqual(buy['kind'], strategy.PLACE)
+        self.assertAlmostEqual(buy['amount'], 1.0)
+        self.assertEqual(buy['covers'], [['11', 1], ['11', 2]])
+        self.assertEqual(state['dust_batches'], [])
+
+    def test_a_rejected_reciprocal_becomes_dust(self):
+        state = self.start()
+        state, [buy] = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '1.00000000', 1), tick(1)])
+        state, [dust] = self.strategy.step(
+            state, [dict(kind=strategy.REJECTED, intent=buy['intent'], reason='Total too small')])
+        self.assertEqual(dust['kind'], strategy.DUST)
+        self.assertEqual(state['pending'], dict())
+        self.assertEqual([b['covers'] for b in state['dust_batches']], [[['11', 1]]])
+
+    def test_a_placed_reciprocal_is_no_longer_pending(self):
+        state = self.start()
+        state, [buy] = self.strategy.step(
+            state, [fill('11', 'sell', '0.05050000', '1.00000000', 1), tick(1)])
+        self.assertEqual(state['pending'].keys(), [buy['intent']])
+        state, intents = self.strategy.step(
+            state, [dict(kind=strategy.PLACED, intent=buy['intent'], order='21')])
+        self.assertEqual(intents, [])
+        self.assertEqual(state['pending'], dict())
+
+
+class GridTraderStepTest(unittest.TestCase):
+
+    def test_reciprocals_are_what_the_strategy_says(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(StringIO.StringIO(sample_ini))
+        live = Ticker()
+        g = GridTrader(ShadowExchange(live, ticker_ttl=0), config, 'agnes')
+        g.build_new_grids()
+        g.issue_trades()
+        buy = g.grids['BTC_DASH']['buy']
+
+        live.ticker['BTC_DASH'] = PoloniexAPIData(lowestAsk='0.0485', highestBid='0.048')
+        g.poll(['BTC_DASH'])
+
+        [r] = g.reciprocal['BTC_DASH']['sell'].values()
+        [fill] = g.exchange.fills(buy.trade_ids[0])
+        state, [intent] = g.strategy.step(g.strategy.initial_state(), [
+            g.fill_event('BTC_DASH', 'buy', buy.trade_ids[0], fill),
+            dict(kind=strategy.TICK, market='BTC_DASH', time=time.time())])
+        order = g.exchange.book.orders[r.trade_id]
+        self.assertAlmostEqual(order['rate'], intent['rate'])
+        self.assertAlmostEqual(order['amount'], intent['amount'])
+        self.assertEqual(g.state['aggregator']['batches'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()